@@ -0,0 +1,40 @@
+"""Escalado del algoritmo voraz.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.bench_asignacion
+    python -m benchmarks.bench_asignacion --tamanos 35x200,500x20000 --semilla 7
+"""
+
+import argparse
+import time
+
+from rutas_ambulancias.optimizador import optimizar_rutas_multiple_servicios
+
+from .generador import generar_flota, generar_servicios
+
+TAMANOS_POR_DEFECTO = '35x200,100x2000,250x8000,500x20000'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tamanos', default=TAMANOS_POR_DEFECTO, help='Lista VEHÍCULOSxSERVICIOS separada por comas')
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'vehículos':>9} {'servicios':>9} {'segundos':>9} {'µs/servicio':>12} {'asignados':>9}")
+    for tamano in args.tamanos.split(','):
+        num_vehiculos, num_servicios = (int(x) for x in tamano.lower().split('x'))
+        df = generar_servicios(num_servicios, args.semilla)
+        flota = generar_flota(num_vehiculos)
+
+        inicio = time.perf_counter()
+        df_resultado, _ = optimizar_rutas_multiple_servicios(df, flota)
+        segundos = time.perf_counter() - inicio
+
+        asignados = (df_resultado['Vehículo'] != 'SIN ASIGNAR').sum()
+        print(f"{num_vehiculos:>9} {num_servicios:>9} {segundos:>9.2f} {segundos / num_servicios * 1e6:>12.0f} "
+              f"{asignados / num_servicios:>9.1%}")
+
+
+if __name__ == '__main__':
+    main()
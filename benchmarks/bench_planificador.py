@@ -0,0 +1,207 @@
+"""Benchmark de extremo a extremo del planificador.
+
+Mide cada etapa (ingesta del Excel, asignación de bases, algoritmo voraz y
+exportación a Excel) con su pico de memoria y la calidad del resultado, y
+escribe los resultados en JSON para comparar versiones.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.bench_planificador --escenarios dia,comarca --salida bench.json
+    python -m benchmarks.bench_planificador --referencia bench.json  # falla si alguna etapa empeora
+"""
+
+import argparse
+import gc
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from rutas_ambulancias.distancias import MatrizTiempos
+from rutas_ambulancias.exportacion import escribir_excel, resumen_por_conductor
+from rutas_ambulancias.ingesta import cargar_servicios
+from rutas_ambulancias.optimizador import INDICE_BASES, optimizar_rutas_multiple_servicios
+
+from .generador import generar_flota, generar_servicios
+
+# Nombre -> (vehículos, servicios); unos 6 servicios por vehículo, como un día real
+ESCENARIOS = {
+    'dia': (35, 200),
+    'comarca': (350, 2000),
+    'provincia': (1400, 8000),
+    'region': (8500, 50000),
+}
+ESCENARIOS_POR_DEFECTO = 'dia,comarca,provincia'
+TOLERANCIA = 0.25  # Empeoramiento relativo admitido frente a la referencia
+MINIMO_SEGUNDOS = 0.05  # Por debajo, el ruido domina y no se compara
+
+
+def _escenario(texto):
+    if texto in ESCENARIOS:
+        return texto, ESCENARIOS[texto]
+    num_vehiculos, num_servicios = (int(x) for x in texto.lower().split('x'))
+    return texto, (num_vehiculos, num_servicios)
+
+
+def _version():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _medir(funcion, repeticiones, memoria):
+    """Devuelve (resultado, mejor tiempo en segundos, pico de memoria en MB o None)."""
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+
+    pico = None
+    if memoria:
+        # Pasada aparte: tracemalloc ralentiza mucho y falsearía los tiempos
+        gc.collect()
+        tracemalloc.start()
+        funcion()
+        pico = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return resultado, mejor, pico
+
+
+def ejecutar_escenario(nombre, num_vehiculos, num_servicios, semilla=0, repeticiones=1, memoria=True):
+    df_entrada = generar_servicios(num_servicios, semilla)
+    buffer = io.BytesIO()
+    df_entrada.to_excel(buffer, index=False)
+    contenido = buffer.getvalue()
+
+    etapas = {}
+
+    def registrar(etapa, funcion):
+        resultado, segundos, pico = _medir(funcion, repeticiones, memoria)
+        etapas[etapa] = {'segundos': round(segundos, 4), 'memoria_pico_mb': None if pico is None else round(pico, 2)}
+        return resultado
+
+    df_servicios, df_rechazados, _, _ = registrar('ingesta', lambda: cargar_servicios(contenido, 'xlsx'))
+
+    def asignar_bases():
+        matriz = MatrizTiempos.desde_servicios(df_servicios)
+        return INDICE_BASES.mas_cercanas(matriz.lats, matriz.lons)[matriz.indices_de(df_servicios['Recogida'])]
+
+    registrar('asignacion_bases', asignar_bases)
+
+    # Flota nueva en cada repetición: el optimizador la rellena
+    df_resultado, flota = registrar(
+        'optimizacion', lambda: optimizar_rutas_multiple_servicios(df_servicios.copy(), generar_flota(num_vehiculos))
+    )
+
+    def exportar():
+        df_conductores = pd.DataFrame(resumen_por_conductor(flota))
+        return escribir_excel(df_resultado, df_conductores)
+
+    excel = registrar('exportacion', exportar)
+
+    asignados = df_resultado[df_resultado['Vehículo'] != 'SIN ASIGNAR']
+    return {
+        'escenario': nombre,
+        'vehiculos': num_vehiculos,
+        'servicios': num_servicios,
+        'etapas': etapas,
+        'segundos_totales': round(sum(e['segundos'] for e in etapas.values()), 4),
+        'calidad': {
+            'rechazados': len(df_rechazados),
+            'asignados_pct': round(100 * len(asignados) / max(1, len(df_resultado)), 2),
+            'vehiculos_usados': int(asignados['Vehículo'].nunique()),
+            'km_totales': round(float(pd.to_numeric(asignados['Km Viaje']).sum()), 1),
+            'minutos_viaje_totales': int(pd.to_numeric(asignados['Tiempo Viaje']).sum()),
+            'excel_kb': round(len(excel) / 1024, 1),
+        },
+    }
+
+
+def comparar(resultados, referencia, tolerancia=TOLERANCIA):
+    """Lista de regresiones (texto) frente a un JSON anterior del mismo benchmark."""
+    anteriores = {(r['escenario'], r['vehiculos'], r['servicios']): r for r in referencia['resultados']}
+    regresiones = []
+    for actual in resultados:
+        anterior = anteriores.get((actual['escenario'], actual['vehiculos'], actual['servicios']))
+        if anterior is None:
+            continue
+        for etapa, medida in actual['etapas'].items():
+            previa = anterior['etapas'].get(etapa)
+            if previa is None:
+                continue
+            for campo in ('segundos', 'memoria_pico_mb'):
+                antes, ahora = previa.get(campo), medida.get(campo)
+                if antes is None or ahora is None or (campo == 'segundos' and antes < MINIMO_SEGUNDOS):
+                    continue
+                if ahora > antes * (1 + tolerancia):
+                    regresiones.append(f"{actual['escenario']}/{etapa}: {campo} {antes} -> {ahora}")
+        if actual['calidad']['asignados_pct'] < anterior['calidad']['asignados_pct']:
+            regresiones.append(f"{actual['escenario']}: asignados {anterior['calidad']['asignados_pct']}% -> "
+                               f"{actual['calidad']['asignados_pct']}%")
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--escenarios', default=ESCENARIOS_POR_DEFECTO,
+                        help=f"Lista separada por comas de {', '.join(ESCENARIOS)} o VEHÍCULOSxSERVICIOS")
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--repeticiones', type=int, default=1, help="Se conserva el mejor tiempo de cada etapa")
+    parser.add_argument('--sin-memoria', action='store_true', help="No medir el pico de memoria (más rápido)")
+    parser.add_argument('--salida', help="Fichero JSON de resultados")
+    parser.add_argument('--referencia', help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA)
+    args = parser.parse_args(argv)
+
+    resultados = []
+    print(f"{'escenario':>10} {'servicios':>9} {'ingesta':>8} {'bases':>7} {'voraz':>7} {'excel':>7} "
+          f"{'pico MB':>8} {'asignados':>9} {'vehículos':>9} {'km':>9}")
+    for texto in args.escenarios.split(','):
+        nombre, (num_vehiculos, num_servicios) = _escenario(texto.strip())
+        r = ejecutar_escenario(nombre, num_vehiculos, num_servicios, args.semilla, args.repeticiones,
+                               memoria=not args.sin_memoria)
+        resultados.append(r)
+        e, c = r['etapas'], r['calidad']
+        picos = [m['memoria_pico_mb'] for m in e.values() if m['memoria_pico_mb'] is not None]
+        print(f"{nombre:>10} {num_servicios:>9} {e['ingesta']['segundos']:>8.2f} {e['asignacion_bases']['segundos']:>7.2f} "
+              f"{e['optimizacion']['segundos']:>7.2f} {e['exportacion']['segundos']:>7.2f} "
+              f"{max(picos) if picos else float('nan'):>8.1f} {c['asignados_pct']:>8.1f}% {c['vehiculos_usados']:>9} "
+              f"{c['km_totales']:>9.0f}")
+
+    informe = {
+        'version': _version(),
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'plataforma': platform.platform(),
+        'semilla': args.semilla,
+        'repeticiones': args.repeticiones,
+        'resultados': resultados,
+    }
+    if args.salida:
+        Path(args.salida).write_text(json.dumps(informe, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    if args.referencia:
+        regresiones = comparar(resultados, json.loads(Path(args.referencia).read_text(encoding='utf-8')),
+                               args.tolerancia)
+        for regresion in regresiones:
+            print(f"REGRESIÓN {regresion}", file=sys.stderr)
+        return 1 if regresiones else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
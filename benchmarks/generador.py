@@ -0,0 +1,65 @@
+"""Generador reproducible de días de servicios sintéticos.
+
+Las recogidas salen de los municipios del gazetteer agrupados por su base más
+cercana, de modo que la carga se reparte alrededor de las cuatro `BASES`; los
+destinos son mayoritariamente los hospitales de Soria capital.
+"""
+
+import csv
+import random
+
+import pandas as pd
+
+from rutas_ambulancias.config import BASES
+from rutas_ambulancias.distancias import IndiceBases
+from rutas_ambulancias.geocodificacion import RUTA_GAZETTEER
+
+MEZCLA_TIPOS = {'Sentado': 60, 'Silla': 25, 'Camilla': 15}
+PESO_BASES = {'Soria': 4, 'Almazán': 2, 'Burgo de Osma': 2, 'Ólvega': 1}  # Soria capital concentra la demanda
+HORARIO = (7 * 60, 20 * 60)
+
+
+def _lugares():
+    with open(RUTA_GAZETTEER, encoding='utf-8', newline='') as f:
+        filas = list(csv.DictReader(f))
+    municipios = [f for f in filas if f['tipo'] in ('municipio', 'base')]
+    bases = IndiceBases().mas_cercanas([float(f['lat']) for f in municipios], [float(f['lon']) for f in municipios])
+    por_base = {nombre: [] for nombre in BASES}
+    for fila, base in zip(municipios, bases):
+        por_base[base].append(fila['nombre'])
+    # La mayoría de destinos son los hospitales de Soria capital; el resto, de referencia fuera de la provincia
+    hospitales = [f['nombre'] for f in filas if f['tipo'] == 'hospital']
+    pesos = [30 if 'Bárbara' in h or 'Mirón' in h else 1 for h in hospitales]
+    return por_base, hospitales, pesos
+
+
+def generar_servicios(num_servicios, semilla=0, mezcla=MEZCLA_TIPOS, horario=HORARIO):
+    """DataFrame con las columnas de entrada (`COLUMNAS_REQUERIDAS`) y horas 'HH:MM' cada 5 minutos."""
+    rng = random.Random(semilla)
+    por_base, hospitales, pesos = _lugares()
+    bases = [b for b in PESO_BASES if por_base[b]]
+    pesos_bases = [PESO_BASES[b] for b in bases]
+    tipos, pesos_tipos = list(mezcla), list(mezcla.values())
+    filas = []
+    for i in range(num_servicios):
+        minuto = rng.randint(*horario) // 5 * 5
+        base = rng.choices(bases, weights=pesos_bases)[0]
+        filas.append({
+            'Paciente': f'Paciente {i:05d}',
+            'Hora Cita': f'{minuto // 60:02d}:{minuto % 60:02d}',
+            'Recogida': rng.choice(por_base[base]),
+            'Destino': rng.choices(hospitales, weights=pesos)[0],
+            'Tipo': rng.choices(tipos, weights=pesos_tipos)[0],
+        })
+    return pd.DataFrame(filas)
+
+
+def generar_flota(num_vehiculos, proporcion_b=0.7):
+    """Flota con el 70 % de vehículos tipo B, repartida entre las bases en proporción a la demanda."""
+    num_b = int(num_vehiculos * proporcion_b)
+    bases = [b for b, peso in PESO_BASES.items() for _ in range(peso)]
+    flota = [{'id': f'B-{i:03d}', 'tipo': 'B', 'conductor': f'Conductor B-{i}'} for i in range(1, num_b + 1)]
+    flota += [{'id': f'A-{i:03d}', 'tipo': 'A', 'conductor': f'Conductor A-{i}'} for i in range(1, num_vehiculos - num_b + 1)]
+    for i, vehiculo in enumerate(flota):
+        vehiculo['base'] = bases[i % len(bases)]
+    return flota
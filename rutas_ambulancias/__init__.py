@@ -0,0 +1,65 @@
+"""Núcleo del gestor de flota de ambulancias (sin dependencias de interfaz).
+
+Los nombres públicos se importan bajo demanda: `import rutas_ambulancias`
+no carga pandas, NumPy ni los motores de optimización hasta que se usan.
+"""
+
+import importlib
+
+_EXPORTACIONES = {
+    'agrupar_servicios': 'agrupacion',
+    'desagrupar': 'agrupacion',
+    'mejorar_plan': 'busqueda_local',
+    'BASES': 'config',
+    'CAPACIDAD_VEHICULO': 'config',
+    'DURACION_SERVICIO': 'config',
+    'JORNADA_MAX': 'config',
+    'MARGEN_TIEMPO': 'config',
+    'puede_llevar': 'config',
+    'optimizar_por_zonas': 'descomposicion',
+    'IndiceBases': 'distancias',
+    'MatrizTiempos': 'distancias',
+    'calcular_distancia_km': 'distancias',
+    'matriz_distancias_km': 'distancias',
+    'Diagnostico': 'diagnostico',
+    'completar_flota': 'dimensionado',
+    'cota_inferior_flota': 'dimensionado',
+    'dimensionar_flota': 'dimensionado',
+    'escribir_excel': 'exportacion',
+    'generar_paquete': 'exportacion',
+    'resumen_por_conductor': 'exportacion',
+    'crear_flota': 'flota',
+    'flota_automatica': 'flota',
+    'flota_desde_tabla': 'flota',
+    'leer_flota': 'flota',
+    'tabla_flota': 'flota',
+    'Geocodificador': 'geocodificacion',
+    'geocodificador_por_defecto': 'geocodificacion',
+    'normalizar_direccion': 'geocodificacion',
+    'HistorialPlanes': 'historial',
+    'optimizar_con_historial': 'historial',
+    'formatear_minutos': 'horarios',
+    'minutos_desde_medianoche': 'horarios',
+    'preparar_servicios': 'horarios',
+    'cargar_servicios': 'ingesta',
+    'leer_pdf': 'ingesta',
+    'mapa_html': 'mapa',
+    'optimizar_rutas': 'optimizador',
+    'optimizar_rutas_multiple_servicios': 'optimizador',
+    'PlanIncremental': 'replanificacion',
+    'resolver_vrptw': 'vrptw',
+}
+
+__all__ = sorted(_EXPORTACIONES)
+
+
+def __getattr__(nombre):
+    if nombre not in _EXPORTACIONES:
+        raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
+    valor = getattr(importlib.import_module(f'.{_EXPORTACIONES[nombre]}', __name__), nombre)
+    globals()[nombre] = valor
+    return valor
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTACIONES))
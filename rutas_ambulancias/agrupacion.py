@@ -0,0 +1,135 @@
+"""Traslados compartidos: varios pacientes compatibles en un mismo viaje.
+
+Antes de asignar, los servicios con recogida y destino iguales o cercanos
+(a menos de `RADIO_AGRUPACION_KM`) y citas a menos de `VENTANA_AGRUPACION`
+minutos se agrupan en un solo viaje, siempre que algún tipo de vehículo de
+la flota pueda llevarlos juntos (`puede_llevar`, con sus plazas de asiento
+y camilla). El viaje se programa con la cita más temprana del grupo, así que
+nadie llega tarde a la suya.
+
+El optimizador ve cada viaje como un servicio cuyo 'Tipo' es la lista de
+tipos de sus pacientes ('Sentado+Silla') y cuya columna 'Viaje' lleva el id
+del traslado; los motores conservan esa columna y después `desagrupar`
+devuelve una fila por paciente con el 'Viaje' de su traslado.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from .config import SEPARADOR_TIPOS, puede_llevar
+from .diagnostico import Diagnostico
+from .distancias import MatrizTiempos
+from .horarios import COLUMNA_MINUTOS, preparar_servicios
+
+RADIO_AGRUPACION_KM = 1.0  # Misma localidad: el desvío cabe en DURACION_SERVICIO
+VENTANA_AGRUPACION = 15  # Minutos máximos entre la primera y la última cita de un viaje
+SEPARADOR_PACIENTES = ' + '
+
+
+def _representantes(matriz, radio_km):
+    """Para cada punto de la matriz, el primer punto a menos de `radio_km` (él mismo si no hay otro)."""
+    representante = np.arange(len(matriz))
+    for i in range(1, len(matriz)):
+        cercanos = np.flatnonzero((matriz.distancias_km[i, :i] <= radio_km) & (representante[:i] == np.arange(i)))
+        if len(cercanos):
+            representante[i] = cercanos[0]
+    return representante
+
+
+def agrupar_servicios(df_servicios, tipos_vehiculo=('A', 'B'), radio_km=RADIO_AGRUPACION_KM,
+                      ventana=VENTANA_AGRUPACION, diagnostico=None):
+    """Devuelve (df_viajes, viajes): una fila por viaje y {id del viaje: filas de sus pacientes}.
+
+    Los servicios que viajan solos quedan como estaban, con 'Viaje' vacío;
+    `viajes` solo incluye los compartidos, con las filas originales de sus
+    pacientes.
+    """
+    diagnostico = diagnostico if diagnostico is not None else Diagnostico()
+    instante = time.perf_counter()
+    if COLUMNA_MINUTOS not in df_servicios.columns:
+        df_servicios, _ = preparar_servicios(df_servicios)
+    df_servicios = df_servicios.sort_values(COLUMNA_MINUTOS, kind='stable').reset_index(drop=True)
+    tipos_vehiculo = sorted(set(tipos_vehiculo))
+
+    matriz = MatrizTiempos.desde_servicios(df_servicios)
+    representante = _representantes(matriz, radio_km)
+    recogidas = representante[matriz.indices_de(df_servicios['Recogida'])]
+    destinos = representante[matriz.indices_de(df_servicios['Destino'])]
+    tipos = df_servicios['Tipo'].astype(object).where(df_servicios['Tipo'].notna(), 'Sentado').astype(str).tolist()
+    minutos = df_servicios[COLUMNA_MINUTOS].to_numpy(dtype=np.int64)
+
+    # Barrido por (recogida, destino) en orden de cita: cada servicio entra en el primer grupo abierto
+    # de su ventana en el que quepa; si no cabe en ninguno, abre uno nuevo
+    grupos = []
+    for filas in pd.Series(range(len(df_servicios))).groupby([recogidas, destinos], sort=False).groups.values():
+        abiertos = []
+        for fila in filas:
+            abiertos = [g for g in abiertos if minutos[fila] - minutos[g[0]] <= ventana]
+            for grupo in abiertos:
+                combinado = SEPARADOR_TIPOS.join([tipos[f] for f in grupo] + [tipos[fila]])
+                if any(puede_llevar(tipo, combinado) for tipo in tipos_vehiculo):
+                    grupo.append(fila)
+                    break
+            else:
+                grupo = [fila]
+                abiertos.append(grupo)
+                grupos.append(grupo)
+
+    registros = df_servicios.to_dict('records')
+    filas_viajes, viajes = [], {}
+    for grupo in sorted(grupos, key=lambda g: g[0]):
+        if len(grupo) == 1:
+            filas_viajes.append(dict(registros[grupo[0]], Viaje=None))
+            continue
+        miembros = [registros[f] for f in grupo]
+        id_viaje = f"V-{len(viajes) + 1:04d}"
+        viajes[id_viaje] = miembros
+        filas_viajes.append(dict(
+            miembros[0],
+            Paciente=SEPARADOR_PACIENTES.join(str(m['Paciente']) for m in miembros),
+            Tipo=SEPARADOR_TIPOS.join(tipos[f] for f in grupo),
+            Viaje=id_viaje,
+        ))
+    columnas = [c for c in df_servicios.columns if c != 'Viaje'] + ['Viaje']
+    df_viajes = pd.DataFrame(filas_viajes, columns=columnas)
+    df_viajes[COLUMNA_MINUTOS] = df_viajes[COLUMNA_MINUTOS].astype(np.int64)
+
+    diagnostico.medir('agrupacion', instante)
+    diagnostico.contar('viajes_compartidos', len(viajes))
+    diagnostico.contar('servicios_agrupados', sum(len(miembros) for miembros in viajes.values()))
+    return df_viajes, viajes
+
+
+def _expandir(filas, viajes):
+    expandidas = []
+    for fila in filas:
+        id_viaje = fila.get('Viaje')
+        miembros = viajes.get(id_viaje) if isinstance(id_viaje, str) else None
+        if miembros is None:
+            expandidas.append(fila)
+            continue
+        asignado = fila['Vehículo'] != 'SIN ASIGNAR'
+        for orden, miembro in enumerate(miembros):
+            nueva = dict(fila, **{
+                campo: miembro[campo] for campo in ('Paciente', 'Hora Cita', COLUMNA_MINUTOS, 'Recogida', 'Destino', 'Tipo')
+            })
+            # Sin asignar, cada paciente vuelve a ser un servicio suelto
+            nueva['Viaje'] = id_viaje if asignado else None
+            if asignado:
+                # El desplazamiento hasta la recogida se cuenta una vez por viaje
+                if orden:
+                    nueva['Tiempo Viaje'], nueva['Km Viaje'] = 0, 0.0
+            expandidas.append(nueva)
+    return expandidas
+
+
+def desagrupar(df_resultado, flota, viajes):
+    """Una fila por paciente en el resultado y en los servicios de cada vehículo, con la columna 'Viaje'."""
+    columnas = list(df_resultado.columns.drop('Viaje', errors='ignore')) + ['Viaje']
+    df = pd.DataFrame(_expandir(df_resultado.to_dict('records'), viajes), columns=columnas)
+    if not df.empty:
+        df[COLUMNA_MINUTOS] = df[COLUMNA_MINUTOS].astype(np.int64)
+    flota = [dict(v, servicios_asignados=_expandir(v['servicios_asignados'], viajes)) for v in flota]
+    return df, flota
@@ -0,0 +1,433 @@
+"""Búsqueda local entre rutas para mejorar un plan ya calculado.
+
+Movimientos entre vehículos distintos:
+
+- recolocar: un servicio pasa a otra ruta (también los SIN ASIGNAR);
+- intercambiar: dos servicios de rutas distintas cambian de vehículo;
+- 2-opt*: dos rutas se intercambian las colas a partir de un punto.
+
+Cada candidato se evalúa en O(1) con lo precalculado por ruta: inicio más
+temprano de cada servicio (hacia delante), inicio más tardío que no rompe lo
+que viene detrás (hacia atrás) y viaje acumulado para la jornada. Solo se
+prueban los vecinos más cercanos de cada servicio con cita compatible.
+
+El objetivo es, por este orden, asignar pendientes y reducir el viaje total
+(lo que suma la jornada de los conductores). En cada óptimo local se
+perturba el plan y se conserva el mejor, hasta agotar tiempo o iteraciones.
+Los pacientes de un traslado compartido se mueven juntos y lo que ya está en
+curso (`ahora` del plan) no se toca.
+"""
+
+import random
+import time
+from collections import Counter
+
+import numpy as np
+
+from .config import BASES, DURACION_SERVICIO, JORNADA_MAX, MARGEN_TIEMPO, MEJORA_SEGUNDOS, SEPARADOR_TIPOS, puede_llevar
+from .distancias import MatrizTiempos
+from .horarios import COLUMNA_MINUTOS
+from .replanificacion import PlanIncremental, _minutos_hhmm
+
+VECINOS = 20  # Servicios cercanos probados por cada servicio
+VENTANA_VECINOS = 3 * DURACION_SERVICIO  # Diferencia máxima de cita entre vecinos (minutos)
+PERTURBACION = 0.02  # Fracción de servicios recolocados al azar en cada óptimo local
+PENALIZACION_PENDIENTE = 10_000  # Un SIN ASIGNAR pesa más que cualquier ahorro de viaje
+
+
+def _nodos_de(filas):
+    """Agrupa filas seguidas del mismo traslado compartido (columna 'Viaje')."""
+    nodos = []
+    anterior = None
+    for fila in filas:
+        viaje = fila.get('Viaje')
+        viaje = viaje if isinstance(viaje, str) else None
+        if viaje is not None and viaje == anterior:
+            nodos[-1].append(fila)
+        else:
+            nodos.append([fila])
+        anterior = viaje
+    return nodos
+
+
+class _Ruta:
+    """Tiempos precalculados de una ruta (listas indexadas por posición)."""
+
+    __slots__ = ('inicios', 'viajes', 'tardios', 'acumulado', 'compatibles')
+
+
+class BusquedaLocal:
+    """Estado de la búsqueda sobre un `PlanIncremental` (que no modifica: lo aplica `PlanIncremental.mejorar`)."""
+
+    def __init__(self, plan, semilla=0):
+        self.plan = plan
+        self.jornada_max = plan.jornada_max
+        self.ahora = plan.ahora
+        self._azar = random.Random(semilla)
+        self.tipos = sorted({v['tipo'] for v in plan.flota})
+
+        # Nodos: un servicio, o los pacientes de un traslado compartido
+        self.filas, rutas, fijos = [], [], []
+        for vehiculo in plan.flota:
+            ruta = []
+            for filas in _nodos_de(vehiculo['servicios_asignados']):
+                ruta.append(len(self.filas))
+                self.filas.append(filas)
+            rutas.append(ruta)
+            fijos.append(self._nodos_fijos(vehiculo['servicios_asignados'], plan._num_fijos(vehiculo)))
+        pendientes = []
+        for fila in plan.sin_asignar:
+            pendientes.append(len(self.filas))
+            self.filas.append([fila])
+        self.rutas, self.fijos, self.pendientes = rutas, fijos, set(pendientes)
+
+        ubicaciones = list(BASES) + [str(f[c]) for filas in self.filas for f in filas for c in ('Recogida', 'Destino')]
+        ubicaciones += [str(v.get('base', 'Soria')) for v in plan.flota]
+        matriz = MatrizTiempos(ubicaciones, plan._geocodificar, plan._proveedor)
+        self._tiempos_np = matriz.minutos.astype(np.int64)
+        self.tiempos = self._tiempos_np.tolist()
+        self.bases = [matriz.indice(v.get('base', 'Soria')) for v in plan.flota]
+        self.recogidas = [matriz.indice(filas[0]['Recogida']) for filas in self.filas]
+        self.destinos = [matriz.indice(filas[-1]['Destino']) for filas in self.filas]
+        self.tempranos = [int(filas[0][COLUMNA_MINUTOS]) - MARGEN_TIEMPO for filas in self.filas]
+        self.limites = [min(int(f[COLUMNA_MINUTOS]) for f in filas) + MARGEN_TIEMPO for filas in self.filas]
+        self.puede = [
+            {tipo: puede_llevar(tipo, SEPARADOR_TIPOS.join(str(f.get('Tipo', 'Sentado')) for f in filas))
+             for tipo in self.tipos}
+            for filas in self.filas
+        ]
+        self.tipo_ruta = [v['tipo'] for v in plan.flota]
+        # Jornada ya registrada en lo fijo (Horas Trabajadas) frente a la que se deduce de sus viajes
+        self.ajuste = [0] * len(rutas)
+        for r in range(len(rutas)):
+            if fijos[r]:
+                ultima = self.filas[rutas[r][fijos[r] - 1]][-1]
+                deducida = sum(int(self.filas[u][0].get('Tiempo Viaje', 0)) for u in rutas[r][:fijos[r]])
+                self.ajuste[r] = round(ultima['Horas Trabajadas'] * 60) - deducida - DURACION_SERVICIO * fijos[r]
+
+        self._vecinos = {}
+        orden = np.argsort(self.tempranos, kind='stable')
+        self._por_cita = orden
+        self._citas_ordenadas = np.asarray(self.tempranos, dtype=np.int64)[orden]
+        self.posicion = [None] * len(self.filas)
+        self.estado = [None] * len(self.rutas)
+        for r in range(len(self.rutas)):
+            self._recalcular(r)
+
+    @staticmethod
+    def _nodos_fijos(filas, filas_fijas):
+        fijos, vistas = 0, 0
+        for nodo in _nodos_de(filas):
+            vistas += len(nodo)
+            if vistas > filas_fijas:
+                break
+            fijos += 1
+        return fijos
+
+    # ------------------------------------------
+    # Estado por ruta
+    # ------------------------------------------
+
+    def _recalcular(self, r):
+        nodos = self.rutas[r]
+        estado = _Ruta()
+        inicios, viajes = [], []
+        disponible, ubicacion = 0, self.bases[r]
+        for k, u in enumerate(nodos):
+            if k < self.fijos[r]:
+                fila = self.filas[u][0]
+                inicio, viaje = _minutos_hhmm(fila['Inicio Real']), int(fila.get('Tiempo Viaje', 0))
+            else:
+                salida = disponible if self.ahora is None else max(disponible, self.ahora)
+                viaje = self.tiempos[ubicacion][self.recogidas[u]]
+                inicio = max(salida + viaje, self.tempranos[u])
+            inicios.append(inicio)
+            viajes.append(viaje)
+            disponible, ubicacion = inicio + DURACION_SERVICIO, self.destinos[u]
+        tardios = [0] * len(nodos)
+        for k in range(len(nodos) - 1, -1, -1):
+            u = nodos[k]
+            tardios[k] = self.limites[u]
+            if k + 1 < len(nodos):
+                siguiente = tardios[k + 1] - DURACION_SERVICIO - self.tiempos[self.destinos[u]][self.recogidas[nodos[k + 1]]]
+                tardios[k] = min(tardios[k], siguiente)
+        acumulado = [0]
+        for viaje in viajes:
+            acumulado.append(acumulado[-1] + viaje)
+        compatibles = {}
+        for tipo in self.tipos:
+            sufijo = [True] * (len(nodos) + 1)
+            for k in range(len(nodos) - 1, -1, -1):
+                sufijo[k] = sufijo[k + 1] and self.puede[nodos[k]][tipo]
+            compatibles[tipo] = sufijo
+        estado.inicios, estado.viajes, estado.tardios = inicios, viajes, tardios
+        estado.acumulado, estado.compatibles = acumulado, compatibles
+        self.estado[r] = estado
+        for k, u in enumerate(nodos):
+            self.posicion[u] = (r, k)
+
+    def _salida(self, r, i):
+        """(minuto, ubicación) desde los que se sale hacia el nodo de la posición i."""
+        if i == 0:
+            disponible, ubicacion = 0, self.bases[r]
+        else:
+            disponible = self.estado[r].inicios[i - 1] + DURACION_SERVICIO
+            ubicacion = self.destinos[self.rutas[r][i - 1]]
+        return (disponible if self.ahora is None else max(disponible, self.ahora)), ubicacion
+
+    def _cabe_jornada(self, r, viaje, servicios):
+        return viaje + DURACION_SERVICIO * servicios + self.ajuste[r] <= self.jornada_max
+
+    def viaje_total(self):
+        return sum(e.acumulado[-1] for e in self.estado)
+
+    def coste(self):
+        return self.viaje_total() + PENALIZACION_PENDIENTE * len(self.pendientes)
+
+    # ------------------------------------------
+    # Evaluación O(1) de cada pieza de un movimiento
+    # ------------------------------------------
+
+    def _enlazar(self, disponible, ubicacion, r, j):
+        """Viaje hasta el nodo j de la ruta r saliendo de (disponible, ubicacion); None si rompe la ruta."""
+        siguiente = self.rutas[r][j]
+        viaje = self.tiempos[ubicacion][self.recogidas[siguiente]]
+        if max(disponible + viaje, self.tempranos[siguiente]) > self.estado[r].tardios[j]:
+            return None
+        return viaje
+
+    def _quitar(self, r, i):
+        """Cambio de viaje de la ruta r al quitar el nodo i (None si no es factible)."""
+        estado, n = self.estado[r], len(self.rutas[r])
+        delta = -estado.viajes[i]
+        if i + 1 < n:
+            disponible, ubicacion = self._salida(r, i)
+            viaje = self._enlazar(disponible, ubicacion, r, i + 1)
+            if viaje is None:
+                return None
+            delta += viaje - estado.viajes[i + 1]
+        return delta if self._cabe_jornada(r, estado.acumulado[-1] + delta, n - 1) else None
+
+    def _poner(self, r, p, u, sustituye=False):
+        """Cambio de viaje de la ruta r al poner u en la posición p (sustituyendo al nodo p si se pide)."""
+        if not self.puede[u][self.tipo_ruta[r]]:
+            return None
+        estado, n = self.estado[r], len(self.rutas[r])
+        disponible, ubicacion = self._salida(r, p)
+        llegada = self.tiempos[ubicacion][self.recogidas[u]]
+        inicio = max(disponible + llegada, self.tempranos[u])
+        if inicio > self.limites[u]:
+            return None
+        delta = llegada
+        siguiente = p + 1 if sustituye else p
+        if sustituye:
+            delta -= estado.viajes[p]
+        if siguiente < n:
+            viaje = self._enlazar(inicio + DURACION_SERVICIO, self.destinos[u], r, siguiente)
+            if viaje is None:
+                return None
+            delta += viaje - estado.viajes[siguiente]
+        servicios = n if sustituye else n + 1
+        return delta if self._cabe_jornada(r, estado.acumulado[-1] + delta, servicios) else None
+
+    def _colas(self, a, i, b, j):
+        """Viaje de la ruta a[:i] + b[j:] (None si no es factible)."""
+        estado_b, n_b = self.estado[b], len(self.rutas[b])
+        if not self.estado[b].compatibles[self.tipo_ruta[a]][j]:
+            return None
+        viaje = self.estado[a].acumulado[i]
+        if j < n_b:
+            disponible, ubicacion = self._salida(a, i)
+            enlace = self._enlazar(disponible, ubicacion, b, j)
+            if enlace is None:
+                return None
+            viaje += enlace + estado_b.acumulado[-1] - estado_b.acumulado[j + 1]
+        return viaje if self._cabe_jornada(a, viaje, i + n_b - j) else None
+
+    # ------------------------------------------
+    # Vecindario
+    # ------------------------------------------
+
+    def vecinos(self, u):
+        if u not in self._vecinos:
+            desde, hasta = np.searchsorted(
+                self._citas_ordenadas, [self.tempranos[u] - VENTANA_VECINOS, self.tempranos[u] + VENTANA_VECINOS + 1]
+            )
+            candidatos = self._por_cita[desde:hasta]
+            candidatos = candidatos[candidatos != u]
+            recogidas = np.asarray(self.recogidas)[candidatos]
+            destinos = np.asarray(self.destinos)[candidatos]
+            cercania = np.minimum(self._tiempos_np[self.destinos[u], recogidas], self._tiempos_np[destinos, self.recogidas[u]])
+            if len(candidatos) > VECINOS:
+                elegidos = np.argpartition(cercania, VECINOS)[:VECINOS]
+                candidatos = candidatos[elegidos[np.argsort(cercania[elegidos], kind='stable')]]
+            self._vecinos[u] = candidatos.tolist()
+        return self._vecinos[u]
+
+    def _movimientos(self, u):
+        """Genera (ganancia, movimiento) factibles para el nodo u con sus vecinos."""
+        if u in self.pendientes:
+            for w in self.vecinos(u):
+                if self.posicion[w] is None or w in self.pendientes:
+                    continue
+                b, j = self.posicion[w]
+                for p in (j, j + 1):
+                    if p >= self.fijos[b]:
+                        delta = self._poner(b, p, u)
+                        if delta is not None:
+                            yield delta - PENALIZACION_PENDIENTE, ('recolocar', u, None, b, p)
+            vistos = set()
+            for b, nodos in enumerate(self.rutas):
+                clave = (self.bases[b], self.tipo_ruta[b])
+                if nodos or clave in vistos:
+                    continue
+                vistos.add(clave)
+                delta = self._poner(b, 0, u)
+                if delta is not None:
+                    yield delta - PENALIZACION_PENDIENTE, ('recolocar', u, None, b, 0)
+            return
+
+        a, i = self.posicion[u]
+        if i < self.fijos[a]:
+            return
+        quitar = self._quitar(a, i)
+        viaje_a = self.estado[a].acumulado[-1]
+        for w in self.vecinos(u):
+            if w in self.pendientes or self.posicion[w] is None:
+                continue
+            b, j = self.posicion[w]
+            if b == a:
+                continue
+            viaje_b = self.estado[b].acumulado[-1]
+            if quitar is not None:
+                for p in (j, j + 1):
+                    if p >= self.fijos[b]:
+                        delta = self._poner(b, p, u)
+                        if delta is not None:
+                            yield quitar + delta, ('recolocar', u, a, b, p)
+            if j >= self.fijos[b]:
+                delta_a = self._poner(a, i, w, sustituye=True)
+                if delta_a is not None:
+                    delta_b = self._poner(b, j, u, sustituye=True)
+                    if delta_b is not None:
+                        yield delta_a + delta_b, ('intercambiar', u, a, b, w)
+            for corte_a, corte_b in ((i, j + 1), (i + 1, j)):
+                if corte_b < self.fijos[b]:
+                    continue
+                nuevo_a = self._colas(a, corte_a, b, corte_b)
+                if nuevo_a is None:
+                    continue
+                nuevo_b = self._colas(b, corte_b, a, corte_a)
+                if nuevo_b is not None:
+                    yield nuevo_a + nuevo_b - viaje_a - viaje_b, ('2-opt*', corte_a, a, b, corte_b)
+
+    def _aplicar(self, movimiento):
+        tipo, x, a, b, y = movimiento
+        if tipo == 'recolocar':
+            if a is None:
+                self.pendientes.discard(x)
+            else:
+                self.rutas[a].pop(self.posicion[x][1])
+            self.rutas[b].insert(y, x)
+        elif tipo == 'intercambiar':
+            i, j = self.posicion[x][1], self.posicion[y][1]
+            self.rutas[a][i], self.rutas[b][j] = y, x
+        else:
+            cola_a, cola_b = self.rutas[a][x:], self.rutas[b][y:]
+            self.rutas[a] = self.rutas[a][:x] + cola_b
+            self.rutas[b] = self.rutas[b][:y] + cola_a
+        for r in (a, b):
+            if r is not None:
+                self._recalcular(r)
+
+    # ------------------------------------------
+    # Bucle principal
+    # ------------------------------------------
+
+    def _foto(self):
+        return [list(ruta) for ruta in self.rutas], set(self.pendientes)
+
+    def _restaurar(self, foto):
+        rutas, pendientes = foto
+        self.rutas, self.pendientes = [list(ruta) for ruta in rutas], set(pendientes)
+        self.posicion = [None] * len(self.filas)
+        for r in range(len(self.rutas)):
+            self._recalcular(r)
+
+    def _perturbar(self):
+        movibles = [u for u, pos in enumerate(self.posicion)
+                    if pos is not None and u not in self.pendientes and pos[1] >= self.fijos[pos[0]]]
+        for u in self._azar.sample(movibles, min(len(movibles), max(1, int(PERTURBACION * len(movibles))))):
+            candidatos = [m for _, m in self._movimientos(u) if m[0] == 'recolocar']
+            if candidatos:
+                self._aplicar(self._azar.choice(candidatos))
+
+    def ejecutar(self, segundos=MEJORA_SEGUNDOS, max_iteraciones=None):
+        """Mejora hasta agotar `segundos` o `max_iteraciones` (sin ninguno, hasta el primer óptimo local).
+
+        Deja en `rutas` y `pendientes` la mejor solución encontrada y devuelve el resumen.
+        """
+        inicio = time.perf_counter()
+        viaje_inicial, pendientes_iniciales = self.viaje_total(), len(self.pendientes)
+        limite = None if segundos is None else inicio + segundos
+        mejor_coste = self.coste()
+        mejor = self._foto()
+        movimientos, iteraciones, optimos = Counter(), 0, 0
+
+        def agotado():
+            return ((limite is not None and time.perf_counter() >= limite)
+                    or (max_iteraciones is not None and iteraciones >= max_iteraciones))
+
+        orden = list(range(len(self.filas)))
+        while not agotado():
+            mejora = False
+            self._azar.shuffle(orden)
+            for u in orden:
+                if agotado():
+                    break
+                iteraciones += 1
+                elegido = min(self._movimientos(u), default=None, key=lambda m: m[0])
+                if elegido is not None and elegido[0] < 0:
+                    self._aplicar(elegido[1])
+                    movimientos[elegido[1][0]] += 1
+                    mejora = True
+            if mejora:
+                continue
+            # Óptimo local: se guarda si es el mejor y se perturba para seguir buscando
+            optimos += 1
+            coste = self.coste()
+            if coste < mejor_coste:
+                mejor_coste, mejor = coste, self._foto()
+            elif coste > mejor_coste:
+                self._restaurar(mejor)
+            if segundos is None and max_iteraciones is None:
+                break
+            self._perturbar()
+
+        if self.coste() < mejor_coste:
+            mejor_coste, mejor = self.coste(), self._foto()
+        self._restaurar(mejor)
+        return {
+            'minutos_ahorrados': viaje_inicial - self.viaje_total(),
+            'asignados': pendientes_iniciales - len(self.pendientes),
+            'movimientos': dict(movimientos),
+            'iteraciones': iteraciones,
+            'optimos_locales': optimos,
+            'segundos': round(time.perf_counter() - inicio, 2),
+        }
+
+    def filas_por_vehiculo(self):
+        """Filas de cada vehículo (en el orden de la flota) y filas que siguen sin asignar."""
+        rutas = [[fila for u in ruta for fila in self.filas[u]] for ruta in self.rutas]
+        return rutas, [self.filas[u][0] for u in sorted(self.pendientes)]
+
+
+def mejorar_plan(df_resultado, flota, segundos=MEJORA_SEGUNDOS, max_iteraciones=None, jornada_max=JORNADA_MAX,
+                 ahora=None, semilla=0, diagnostico=None):
+    """Devuelve (df_resultado, flota, resumen) tras la búsqueda local; la flota se modifica en el sitio."""
+    plan = PlanIncremental(df_resultado, flota, ahora=ahora, jornada_max=jornada_max)
+    resumen = plan.mejorar(segundos, max_iteraciones, semilla, diagnostico)['mejora']
+    df_mejorado = plan.dataframe().reindex(columns=df_resultado.columns)
+    if not df_mejorado.empty:
+        df_mejorado[COLUMNA_MINUTOS] = df_mejorado[COLUMNA_MINUTOS].astype(np.int64)
+    return df_mejorado, plan.flota, resumen
@@ -0,0 +1,169 @@
+"""Planificación por lotes sin interfaz.
+
+    python -m rutas_ambulancias planificar DIRECTORIO [--salida DIR] [--procesos N]
+
+Cada fichero Excel/PDF del directorio es un día de servicios; los días se
+planifican en paralelo (un proceso por día) y el resultado de cada uno se
+escribe en el directorio de salida.
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+EXTENSIONES = ('.xlsx', '.xls', '.pdf')
+FORMATOS = ('xlsx', 'csv', 'parquet')
+
+
+def planificar_fichero(ruta, salida, flota=None, motor='Voraz', formato='xlsx', jornada_max=None,
+                       jornada_objetivo=8, limite_segundos=10, diagnostico=False, perfilador=None, agrupar=False,
+                       mejorar=0, historial=None):
+    """Carga, optimiza y exporta un día. Devuelve un resumen (dict) apto para enviar entre procesos.
+
+    Con `historial` (ruta SQLite) y una fecha en el nombre del fichero, el
+    día parte de las asignaciones de días anteriores y queda guardado.
+    """
+    import pandas as pd
+
+    from .config import JORNADA_MAX
+    from .diagnostico import Diagnostico
+    from .exportacion import escribir_excel, generar_paquete, resumen_por_conductor
+    from .flota import flota_automatica
+    from .historial import HistorialPlanes, fecha_en_nombre, optimizar_con_historial
+    from .ingesta import cargar_servicios
+    from .optimizador import optimizar_rutas
+
+    inicio = time.perf_counter()
+    ruta = Path(ruta)
+    registro = Diagnostico(perfilador)
+    resumen = {'fichero': ruta.name, 'servicios': 0, 'asignados': 0, 'vehiculos': 0, 'rechazados': 0,
+               'motor': None, 'salida': None, 'error': None}
+    try:
+        # Cada día ya ocupa un proceso: el PDF se lee en serie dentro de él
+        df, df_rechazados, faltantes, errores_pagina = cargar_servicios(
+            ruta.read_bytes(), ruta.suffix.lower().lstrip('.'), procesos=1, diagnostico=registro
+        )
+        if df is None:
+            raise ValueError("No se encontraron tablas en el PDF")
+        if faltantes:
+            raise ValueError(f"Faltan columnas: {', '.join(faltantes)}")
+        if errores_pagina:
+            resumen['error'] = '; '.join(f"página {p}: {e}" for p, e in errores_pagina)
+
+        flota = [v.copy() for v in flota] if flota else flota_automatica(len(df))
+        opciones = dict(limite_segundos=limite_segundos, procesos=1, agrupar=agrupar, mejorar_segundos=mejorar)
+        fecha = fecha_en_nombre(ruta.name) if historial else None
+        if fecha is not None:
+            planes = HistorialPlanes(historial)
+            try:
+                df_resultado, flota, motor_usado, _ = optimizar_con_historial(
+                    df, flota, planes, fecha, motor=motor, jornada_max=jornada_max or JORNADA_MAX,
+                    diagnostico=registro, **opciones
+                )
+            finally:
+                planes.cerrar()
+        else:
+            df_resultado, flota, motor_usado = optimizar_rutas(
+                df, flota, motor=motor, jornada_max=jornada_max or JORNADA_MAX, diagnostico=registro, **opciones
+            )
+        df_conductores = pd.DataFrame(resumen_por_conductor(flota, jornada_objetivo))
+
+        Path(salida).mkdir(parents=True, exist_ok=True)
+        with registro.etapa('exportacion'):
+            if formato == 'xlsx':
+                destino = Path(salida) / f"{ruta.stem}_rutas.xlsx"
+                destino.write_bytes(escribir_excel(df_resultado, df_conductores))
+            else:
+                destino = Path(salida) / f"{ruta.stem}_rutas_{formato}.zip"
+                destino.write_bytes(generar_paquete(df_resultado, df_conductores, formato))
+        if diagnostico:
+            (Path(salida) / f"{ruta.stem}_diagnostico.json").write_text(registro.como_json(), encoding='utf-8')
+
+        resumen.update(
+            servicios=len(df_resultado),
+            asignados=int((df_resultado['Vehículo'] != 'SIN ASIGNAR').sum()),
+            vehiculos=len(df_conductores),
+            rechazados=len(df_rechazados),
+            motor=motor_usado,
+            salida=str(destino),
+        )
+    except Exception as e:
+        resumen['error'] = f"{type(e).__name__}: {e}"
+    resumen['segundos'] = round(time.perf_counter() - inicio, 2)
+    return resumen
+
+
+def planificar_directorio(directorio, salida=None, procesos=None, **opciones):
+    """Planifica todos los ficheros del directorio; genera los resúmenes según terminan."""
+    directorio = Path(directorio)
+    salida = Path(salida) if salida else directorio / 'rutas'
+    ficheros = sorted(p for p in directorio.iterdir() if p.suffix.lower() in EXTENSIONES and p.is_file())
+    procesos = min(procesos or os.cpu_count() or 1, max(1, len(ficheros)))
+    if opciones.get('historial'):
+        # Cada día parte de los anteriores: se planifican en orden, uno tras otro
+        procesos = 1
+
+    if procesos <= 1:
+        for ruta in ficheros:
+            yield planificar_fichero(ruta, salida, **opciones)
+        return
+
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        futuros = [pool.submit(planificar_fichero, ruta, salida, **opciones) for ruta in ficheros]
+        for futuro in as_completed(futuros):
+            yield futuro.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rutas_ambulancias', description="Gestor de flota de ambulancias")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    planificar = subparsers.add_parser('planificar', help="Planifica todos los días de un directorio")
+    planificar.add_argument('directorio', help="Directorio con un Excel/PDF de servicios por día")
+    planificar.add_argument('--salida', help="Directorio de resultados (por defecto DIRECTORIO/rutas)")
+    planificar.add_argument('--procesos', type=int, help="Procesos en paralelo (por defecto, uno por núcleo)")
+    planificar.add_argument('--flota', help="CSV/Excel de flota (id, tipo, conductor, matricula, base); "
+                                            "si se omite se usa la flota automática")
+    planificar.add_argument('--motor', choices=['Voraz', 'VRPTW', 'Zonas'], default='Voraz')
+    planificar.add_argument('--limite-segundos', type=float, default=10, help="Límite de tiempo del motor VRPTW")
+    planificar.add_argument('--agrupar', action='store_true',
+                            help="Agrupa en un viaje a los pacientes compatibles (misma zona, destino y hora)")
+    planificar.add_argument('--mejorar', type=float, default=0, metavar='SEGUNDOS',
+                            help="Segundos de búsqueda local entre rutas tras el motor (0 = sin mejora)")
+    planificar.add_argument('--historial', metavar='SQLITE',
+                            help="Historial de planes: los días con fecha en el nombre (AAAA-MM-DD) parten de "
+                                 "las asignaciones de días anteriores y se guardan en él")
+    planificar.add_argument('--formato', choices=FORMATOS, default='xlsx')
+    planificar.add_argument('--jornada-max', type=int, help="Jornada máxima en minutos")
+    planificar.add_argument('--jornada-objetivo', type=float, default=8, help="Jornada objetivo en horas")
+    planificar.add_argument('--diagnostico', action='store_true',
+                            help="Escribe tiempos por etapa y motivos de rechazo en DIA_diagnostico.json")
+    planificar.add_argument('--perfil', choices=['cprofile', 'pyinstrument'],
+                            help="Perfila la optimización (el informe va en el JSON de diagnóstico)")
+
+    args = parser.parse_args(argv)
+
+    flota = None
+    if args.flota:
+        from .flota import leer_flota
+        flota = leer_flota(args.flota)
+
+    errores = 0
+    for resumen in planificar_directorio(
+        args.directorio, salida=args.salida, procesos=args.procesos, flota=flota, motor=args.motor,
+        formato=args.formato, jornada_max=args.jornada_max, jornada_objetivo=args.jornada_objetivo,
+        limite_segundos=args.limite_segundos, diagnostico=args.diagnostico or args.perfil is not None,
+        perfilador=args.perfil, agrupar=args.agrupar, mejorar=args.mejorar, historial=args.historial,
+    ):
+        if resumen['salida'] is None:
+            errores += 1
+            print(f"❌ {resumen['fichero']}: {resumen['error']}", file=sys.stderr)
+            continue
+        print(f"✅ {resumen['fichero']}: {resumen['asignados']}/{resumen['servicios']} servicios, "
+              f"{resumen['vehiculos']} vehículos, {resumen['motor']}, {resumen['segundos']} s -> {resumen['salida']}")
+        if resumen['error']:
+            print(f"⚠️ {resumen['fichero']}: {resumen['error']}", file=sys.stderr)
+    return 1 if errores else 0
@@ -0,0 +1,47 @@
+# ==========================================
+# CONFIGURACIÓN COMPARTIDA
+# ==========================================
+
+from collections import Counter
+
+DURACION_SERVICIO = 60
+MARGEN_TIEMPO = 30  # Margen de tiempo para llegar a la cita (minutos)
+JORNADA_MAX = 600  # Jornada máxima en minutos (10 horas)
+
+BASES = {
+    'Soria': {'lat': 41.7665, 'lon': -2.4790},
+    'Almazán': {'lat': 41.4856, 'lon': -2.5252},
+    'Burgo de Osma': {'lat': 41.5869, 'lon': -3.0661},
+    'Ólvega': {'lat': 41.7974, 'lon': -2.0306, 'solo_tarde': True}
+}
+
+COLUMNAS_REQUERIDAS = ['Paciente', 'Hora Cita', 'Recogida', 'Destino', 'Tipo']
+
+# Perfil de velocidad para convertir distancias en tiempos de viaje
+VELOCIDAD_MEDIA_KMH = 70  # Velocidad media en carretera
+FACTOR_RUTA = 1.3  # Distancia por carretera / distancia en línea recta
+TIEMPO_MINIMO_VIAJE = 5  # Minutos mínimos de cualquier desplazamiento
+MEJORA_SEGUNDOS = 5  # Duración por defecto de cada tanda de búsqueda local
+
+
+# Plazas de cada tipo de vehículo para los traslados compartidos
+CAPACIDAD_VEHICULO = {
+    'A': {'asientos': 4, 'camillas': 0},
+    'B': {'asientos': 2, 'camillas': 1},
+}
+PLAZA_POR_TIPO = {'Sentado': 'asientos', 'Silla': 'asientos', 'Camilla': 'camillas'}
+SEPARADOR_TIPOS = '+'  # Tipo de un traslado compartido: 'Sentado+Silla+Camilla'
+
+
+def puede_llevar(vehiculo_tipo, paciente_tipo):
+    if isinstance(paciente_tipo, str) and SEPARADOR_TIPOS in paciente_tipo:
+        # Traslado compartido: cada paciente debe poder ir en el vehículo y caber en sus plazas
+        tipos = paciente_tipo.split(SEPARADOR_TIPOS)
+        if not all(puede_llevar(vehiculo_tipo, tipo) for tipo in tipos):
+            return False
+        capacidad = CAPACIDAD_VEHICULO.get(vehiculo_tipo, CAPACIDAD_VEHICULO['B'])
+        plazas = Counter(PLAZA_POR_TIPO.get(tipo, 'asientos') for tipo in tipos)
+        return all(n <= capacidad.get(plaza, 0) for plaza, n in plazas.items())
+    if vehiculo_tipo == "A":
+        return paciente_tipo in ["Sentado", "Silla"]
+    return True
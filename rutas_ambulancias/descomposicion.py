@@ -0,0 +1,142 @@
+"""Descomposición espacio-temporal del día por base y bloque horario.
+
+Los servicios se reparten en particiones (base más cercana × bloque horario)
+y la flota se reparte entre ellas en proporción a la demanda. Cada partición
+se resuelve con el algoritmo voraz en su propio proceso. Después, una pasada
+de fusión y reparación intenta colocar los servicios SIN ASIGNAR en
+cualquier vehículo de cualquier partición, incluidos los que quedaron
+libres.
+"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .config import BASES, JORNADA_MAX
+from .diagnostico import MOTIVO_REPARACION, Diagnostico
+from .distancias import IndiceBases, MatrizTiempos
+from .horarios import COLUMNA_MINUTOS, preparar_servicios
+from .optimizador import optimizar_rutas_multiple_servicios
+from .replanificacion import PlanIncremental
+
+INICIO_TARDE = 14 * 60  # Frontera por defecto entre el bloque de mañana y el de tarde
+MIN_SERVICIOS_POOL = 2000  # Por debajo, arrancar procesos cuesta más que resolver en serie
+
+
+def _bloque(minuto, fronteras):
+    return int(np.searchsorted(fronteras, minuto, side='right'))
+
+
+def particionar(df_servicios, fronteras=(INICIO_TARDE,)):
+    """Añade las columnas 'Base' y 'Bloque' y devuelve {(base, bloque): índices de fila}.
+
+    Las bases con `solo_tarde` no reciben servicios de bloques anteriores a la
+    tarde: esos servicios van a la base más cercana con servicio de mañana.
+    """
+    matriz = MatrizTiempos(df_servicios['Recogida'].astype(str))
+    indices = matriz.indices_de(df_servicios['Recogida'])
+    bases = IndiceBases().mas_cercanas(matriz.lats, matriz.lons)[indices]
+    bases_manana = IndiceBases({n: b for n, b in BASES.items() if not b.get('solo_tarde')})
+    bases_manana = bases_manana.mas_cercanas(matriz.lats, matriz.lons)[indices]
+
+    fronteras = np.asarray(sorted(fronteras), dtype=np.int64)
+    bloques = np.searchsorted(fronteras, df_servicios[COLUMNA_MINUTOS].to_numpy(dtype=np.int64), side='right')
+    solo_tarde = np.array([BASES[b].get('solo_tarde', False) for b in bases], dtype=bool)
+    manana = bloques < _bloque(INICIO_TARDE, fronteras)
+    bases = np.where(solo_tarde & manana, bases_manana, bases)
+
+    df_servicios = df_servicios.assign(Base=bases, Bloque=bloques)
+    return df_servicios, df_servicios.groupby(['Base', 'Bloque'], sort=True).indices
+
+
+def repartir_flota(flota, demanda):
+    """{partición: [posiciones en la flota]} en proporción a la demanda, por tipo de vehículo.
+
+    Un vehículo con base fija solo va a particiones de su base (si las hay);
+    los demás van a la partición con más déficit.
+    """
+    total = sum(demanda.values())
+    asignacion = {clave: [] for clave in demanda}
+    for tipo in dict.fromkeys(v['tipo'] for v in flota):
+        del_tipo = [orden for orden, v in enumerate(flota) if v['tipo'] == tipo]
+        objetivo = {clave: len(del_tipo) * n / total for clave, n in demanda.items()}
+        repartidos = dict.fromkeys(demanda, 0)
+        # Primero los de base fija, que tienen menos opciones
+        del_tipo.sort(key=lambda orden: 'base' not in flota[orden])
+        for orden in del_tipo:
+            propias = [c for c in demanda if c[0] == flota[orden].get('base')]
+            clave = max(propias or demanda, key=lambda c: objetivo[c] - repartidos[c])
+            repartidos[clave] += 1
+            asignacion[clave].append(orden)
+    return asignacion
+
+
+def _resolver_particion(df_servicios, flota, jornada_max):
+    diagnostico = Diagnostico()
+    df_resultado, flota = optimizar_rutas_multiple_servicios(df_servicios, flota, jornada_max, diagnostico)
+    return df_resultado, flota, diagnostico
+
+
+def optimizar_por_zonas(df_servicios, flota, jornada_max=JORNADA_MAX, procesos=None, fronteras=(INICIO_TARDE,),
+                        diagnostico=None):
+    """Resuelve cada (base, bloque) por separado, en paralelo, y repara los SIN ASIGNAR sobre la flota entera.
+
+    Devuelve (df_resultado, flota) como `optimizar_rutas_multiple_servicios`.
+    Los vehículos sin base fija reciben la base de la partición que les toca.
+    """
+    diagnostico = diagnostico if diagnostico is not None else Diagnostico()
+    instante = time.perf_counter()
+
+    if COLUMNA_MINUTOS not in df_servicios.columns:
+        df_servicios, _ = preparar_servicios(df_servicios)
+    if df_servicios.empty or not flota:
+        return optimizar_rutas_multiple_servicios(df_servicios, flota, jornada_max, diagnostico)
+    df_servicios, particiones = particionar(df_servicios, fronteras)
+    demanda = {clave: len(filas) for clave, filas in particiones.items()}
+    reparto = repartir_flota(flota, demanda)
+    instante = diagnostico.medir('zonas.particion', instante)
+    diagnostico.contar('particiones', len(particiones))
+
+    tareas = []
+    for clave, filas in particiones.items():
+        subflota = [dict(flota[orden], base=flota[orden].get('base', clave[0])) for orden in reparto[clave]]
+        tareas.append((df_servicios.iloc[filas].drop(columns=['Base', 'Bloque']), subflota))
+
+    procesos = min(procesos or os.cpu_count() or 1, len(tareas))
+    if procesos <= 1 or len(df_servicios) < MIN_SERVICIOS_POOL:
+        soluciones = [_resolver_particion(df, subflota, jornada_max) for df, subflota in tareas]
+    else:
+        # 'spawn' evita hacer fork de un proceso con hilos (el servidor de Streamlit)
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futuros = [pool.submit(_resolver_particion, df, subflota, jornada_max) for df, subflota in tareas]
+            soluciones = [futuro.result() for futuro in futuros]
+    instante = diagnostico.medir('zonas.resolucion', instante)
+
+    # Fusión: una fila por servicio y cada vehículo en su posición original de la flota
+    flota_resultado = [dict(v, servicios_asignados=[], tiempo_trabajado=0, disponible_desde=0) for v in flota]
+    for clave, (_, flota_particion, diagnostico_particion) in zip(particiones, soluciones):
+        # Los motivos de SIN ASIGNAR de cada partición dejan de valer tras la reparación
+        diagnostico_particion.sin_asignar.clear()
+        diagnostico.combinar(diagnostico_particion)
+        for orden, vehiculo in zip(reparto[clave], flota_particion):
+            flota_resultado[orden] = vehiculo
+    df_resultado = pd.concat([df for df, _, _ in soluciones], ignore_index=True)
+    columnas = df_resultado.columns
+    instante = diagnostico.medir('zonas.fusion', instante)
+
+    # Reparación: los SIN ASIGNAR pueden ir a vehículos de otras bases o bloques
+    plan = PlanIncremental(df_resultado, flota_resultado, jornada_max=jornada_max)
+    pendientes_antes = len(plan.sin_asignar)
+    plan.reparar()
+    diagnostico.contar('reparados', pendientes_antes - len(plan.sin_asignar))
+    if plan.sin_asignar:
+        diagnostico.sin_asignar[MOTIVO_REPARACION] += len(plan.sin_asignar)
+    diagnostico.medir('zonas.reparacion', instante)
+
+    df_resultado = plan.dataframe().reindex(columns=columnas)
+    df_resultado[COLUMNA_MINUTOS] = df_resultado[COLUMNA_MINUTOS].astype(np.int64)
+    return df_resultado, plan.flota
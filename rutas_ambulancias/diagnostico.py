@@ -0,0 +1,120 @@
+"""Instrumentación ligera del proceso de planificación.
+
+Un `Diagnostico` acumula tiempos por etapa, contadores y motivos de rechazo
+o de servicio sin asignar. Las funciones del núcleo lo reciben como
+argumento opcional `diagnostico` (si no se pasa, usan uno desechable).
+También puede perfilar una etapa con cProfile o pyinstrument (importado solo
+si se pide).
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+PERFILADORES = ('cprofile', 'pyinstrument')
+LINEAS_PERFIL = 30  # Funciones mostradas en el informe de cProfile
+
+# Motivos de servicio sin asignar
+MOTIVO_SIN_COMPATIBLE = 'Sin vehículo compatible'
+MOTIVO_VENTANA = 'Ningún vehículo llega en la ventana'
+MOTIVO_JORNADA = 'JORNADA_MAX superada'
+MOTIVO_VRPTW = 'Descartado por el VRPTW'
+MOTIVO_REPARACION = 'Sin hueco tras fusionar las zonas'
+MOTIVO_ACOMPANANTE = 'Comparte viaje con un servicio sin asignar'
+MOTIVO_MEJORA = 'Sin hueco tras la búsqueda local'
+
+
+class Diagnostico:
+    """Tiempos, contadores y motivos de una planificación (se puede serializar a JSON)."""
+
+    def __init__(self, perfilador=None):
+        if perfilador is not None and perfilador not in PERFILADORES:
+            raise ValueError(f"Perfilador desconocido: {perfilador!r} (opciones: {', '.join(PERFILADORES)})")
+        self.perfilador = perfilador
+        self.tiempos = {}
+        self.llamadas = Counter()
+        self.contadores = Counter()
+        self.rechazados = Counter()
+        self.sin_asignar = Counter()
+        self.perfiles = {}
+
+    @contextmanager
+    def etapa(self, nombre):
+        inicio = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.tiempos[nombre] = self.tiempos.get(nombre, 0.0) + time.perf_counter() - inicio
+            self.llamadas[nombre] += 1
+
+    def medir(self, nombre, desde):
+        """Suma a la etapa el tiempo desde `desde` (perf_counter) y devuelve el instante actual."""
+        ahora = time.perf_counter()
+        self.tiempos[nombre] = self.tiempos.get(nombre, 0.0) + ahora - desde
+        self.llamadas[nombre] += 1
+        return ahora
+
+    def contar(self, nombre, cantidad=1):
+        self.contadores[nombre] += int(cantidad)
+
+    def perfilar(self, nombre):
+        """Contexto que perfila el bloque si hay perfilador configurado (si no, no hace nada)."""
+        if self.perfilador is None:
+            return nullcontext(self)
+        return self._perfilar(nombre)
+
+    @contextmanager
+    def _perfilar(self, nombre):
+        if self.perfilador == 'pyinstrument':
+            from pyinstrument import Profiler
+
+            perfil = Profiler()
+            perfil.start()
+            try:
+                yield self
+            finally:
+                perfil.stop()
+                self.perfiles[nombre] = perfil.output_text(unicode=True)
+            return
+
+        perfil = cProfile.Profile()
+        perfil.enable()
+        try:
+            yield self
+        finally:
+            perfil.disable()
+            salida = io.StringIO()
+            pstats.Stats(perfil, stream=salida).sort_stats('cumulative').print_stats(LINEAS_PERFIL)
+            self.perfiles[nombre] = salida.getvalue()
+
+    def combinar(self, otro):
+        """Suma a este diagnóstico los datos de otro (p. ej. ingesta + optimización)."""
+        if otro is None:
+            return self
+        for nombre, segundos in otro.tiempos.items():
+            self.tiempos[nombre] = self.tiempos.get(nombre, 0.0) + segundos
+        self.llamadas.update(otro.llamadas)
+        self.contadores.update(otro.contadores)
+        self.rechazados.update(otro.rechazados)
+        self.sin_asignar.update(otro.sin_asignar)
+        self.perfiles.update(otro.perfiles)
+        return self
+
+    def como_dict(self):
+        return {
+            'etapas': {
+                nombre: {'segundos': round(segundos, 4), 'llamadas': self.llamadas[nombre]}
+                for nombre, segundos in self.tiempos.items()
+            },
+            'contadores': dict(self.contadores),
+            'rechazados': dict(self.rechazados),
+            'sin_asignar': dict(self.sin_asignar),
+            'perfiles': dict(self.perfiles),
+        }
+
+    def como_json(self, indent=2):
+        return json.dumps(self.como_dict(), ensure_ascii=False, indent=indent)
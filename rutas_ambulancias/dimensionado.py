@@ -0,0 +1,211 @@
+"""Dimensionado de la flota: cuántas ambulancias A y B hacen falta para el día.
+
+Primero se calcula una cota inferior por tipo con un barrido sobre las horas
+de cita ordenadas (O(n log n)): si k+1 servicios no caben en un vehículo por
+estar demasiado juntos, los que caen en esa ventana necesitan al menos
+ceil(n/k) vehículos. Luego se busca hacia arriba desde la cota: el voraz
+reparte los servicios y, mientras queden SIN ASIGNAR, se añaden vehículos
+(tantos como la cota de los pendientes) y solo se colocan los pendientes,
+conservando la asignación anterior. Al final se retiran los vehículos cuyos
+servicios caben en el resto.
+
+La flota resultante solo garantiza ese plan voraz: con otro motor (o con
+traslados compartidos) `completar_flota` añade, con la misma búsqueda, los
+vehículos que falten a su plan.
+"""
+
+import math
+import re
+import time
+
+import numpy as np
+
+from .config import DURACION_SERVICIO, JORNADA_MAX, MARGEN_TIEMPO, puede_llevar
+from .descomposicion import particionar, repartir_flota
+from .diagnostico import Diagnostico
+from .flota import crear_flota
+from .horarios import COLUMNA_MINUTOS, preparar_servicios
+from .optimizador import optimizar_rutas_multiple_servicios
+from .replanificacion import SIN_ASIGNAR, PlanIncremental
+
+MAX_ITERACIONES = 50
+
+
+def _cota(minutos, jornada_max):
+    """Vehículos mínimos para atender servicios con estas horas de cita (minutos)."""
+    n = len(minutos)
+    if n == 0:
+        return 0
+    minutos = np.sort(np.asarray(minutos, dtype=np.int64))
+    por_vehiculo = max(1, jornada_max // DURACION_SERVICIO)
+    cota = math.ceil(n / por_vehiculo)  # Carga: cada servicio ocupa al menos DURACION_SERVICIO de jornada
+    posiciones = np.arange(n)
+    for k in range(2, por_vehiculo + 1):
+        # k+1 servicios en un vehículo abarcan al menos k*DURACION - 2*MARGEN minutos de cita
+        ancho = k * DURACION_SERVICIO - 2 * MARGEN_TIEMPO - 1
+        en_ventana = np.searchsorted(minutos, minutos + ancho, side='right') - posiciones
+        cota = max(cota, math.ceil(int(en_ventana.max()) / k))
+    return cota
+
+
+def _solo_tipo_b(df_servicios):
+    tipos = df_servicios['Tipo'] if 'Tipo' in df_servicios.columns else None
+    if tipos is None:
+        return np.zeros(len(df_servicios), dtype=bool)
+    return ~tipos.fillna('Sentado').astype(str).map(lambda tipo: puede_llevar('A', tipo)).to_numpy(dtype=bool)
+
+
+def cota_inferior_flota(df_servicios, jornada_max=JORNADA_MAX):
+    """{'B': n, 'A': n} mínimos: los B cubren los servicios que solo puede llevar un B; A + B, el total."""
+    if COLUMNA_MINUTOS not in df_servicios.columns:
+        df_servicios, _ = preparar_servicios(df_servicios)
+    minutos = df_servicios[COLUMNA_MINUTOS].to_numpy(dtype=np.int64)
+    solo_b = _solo_tipo_b(df_servicios)
+    num_b = _cota(minutos[solo_b], jornada_max)
+    num_a = max(0, _cota(minutos, jornada_max) - num_b) if (~solo_b).any() else 0
+    return {'B': num_b, 'A': num_a}
+
+
+def _nuevos_vehiculos(pendientes, cantidades, numerados):
+    """Vehículos añadidos, con la base repartida según dónde están los servicios pendientes."""
+    _, particiones = particionar(pendientes)
+    demanda = {clave: len(filas) for clave, filas in particiones.items()}
+    nuevos = []
+    for tipo, cantidad in cantidades.items():
+        inicio = numerados[tipo]
+        completa = crear_flota(inicio + cantidad, 0) if tipo == 'B' else crear_flota(0, inicio + cantidad)
+        del_tipo = completa[inicio:]
+        for clave, posiciones in repartir_flota(del_tipo, demanda).items():
+            for posicion in posiciones:
+                del_tipo[posicion]['base'] = clave[0]
+        numerados[tipo] += cantidad
+        nuevos += [dict(v, servicios_asignados=[], tiempo_trabajado=0, disponible_desde=0) for v in del_tipo]
+    return nuevos
+
+
+def _numerados(flota):
+    """Último número de id (B-001, A-001...) usado por tipo, para que los vehículos añadidos no lo repitan."""
+    numerados = {'B': 0, 'A': 0}
+    for vehiculo in flota:
+        coincidencia = re.fullmatch(r'([AB])-(\d+)', str(vehiculo['id']))
+        if coincidencia is not None:
+            numerados[coincidencia[1]] = max(numerados[coincidencia[1]], int(coincidencia[2]))
+    return numerados
+
+
+def _ampliar(df_resultado, flota, jornada_max, numerados, max_iteraciones, diagnostico):
+    """Añade vehículos y coloca solo los SIN ASIGNAR hasta que no quede ninguno o ya no quepan en ninguno.
+
+    Devuelve (df_resultado, flota, iteraciones, pendientes).
+    """
+    columnas = df_resultado.columns
+    iteraciones = 0
+    pendientes = df_resultado[df_resultado['Vehículo'] == SIN_ASIGNAR]
+    while not pendientes.empty and iteraciones < max_iteraciones:
+        # Tantos vehículos más como pide la cota de lo que falta (al menos uno del tipo necesario)
+        extra = cota_inferior_flota(pendientes, jornada_max)
+        if not sum(extra.values()):
+            extra['B' if _solo_tipo_b(pendientes).all() else 'A'] = 1
+        plan = PlanIncremental(df_resultado, flota + _nuevos_vehiculos(pendientes, extra, numerados),
+                               jornada_max=jornada_max)
+        plan.reparar()
+        iteraciones += 1
+        diagnostico.contar('vehiculos_anadidos', sum(extra.values()))
+        if len(plan.sin_asignar) == len(pendientes):
+            # Ni con vehículos vacíos: esos servicios no caben en ninguna jornada
+            break
+        df_resultado = plan.dataframe().reindex(columns=columnas)
+        df_resultado[COLUMNA_MINUTOS] = df_resultado[COLUMNA_MINUTOS].astype(np.int64)
+        flota = plan.flota
+        pendientes = df_resultado[df_resultado['Vehículo'] == SIN_ASIGNAR]
+    return df_resultado, flota, iteraciones, pendientes
+
+
+def _renumerar(df_resultado, flota):
+    """Quita los vehículos sin servicios y numera los demás como crear_flota (B-001..., A-001...)."""
+    usados = [v for v in flota if v['servicios_asignados']]
+    usados.sort(key=lambda v: v['tipo'] != 'B')
+    num_b = sum(v['tipo'] == 'B' for v in usados)
+    nombres = crear_flota(num_b, len(usados) - num_b)
+    renombrados, vehiculos, conductores = [], {}, {}
+    for vehiculo, nombre in zip(usados, nombres):
+        vehiculos[vehiculo['id']] = nombre['id']
+        conductores[vehiculo['id']] = nombre['conductor']
+        servicios = [dict(s, **{'Vehículo': nombre['id'], 'Conductor': nombre['conductor']})
+                     for s in vehiculo['servicios_asignados']]
+        renombrados.append(dict(vehiculo, **nombre, servicios_asignados=servicios))
+    asignado = df_resultado['Vehículo'] != SIN_ASIGNAR
+    df_resultado = df_resultado.copy()
+    df_resultado.loc[asignado, 'Conductor'] = df_resultado.loc[asignado, 'Vehículo'].map(conductores)
+    df_resultado.loc[asignado, 'Vehículo'] = df_resultado.loc[asignado, 'Vehículo'].map(vehiculos)
+    return df_resultado, renombrados
+
+
+def dimensionar_flota(df_servicios, jornada_max=JORNADA_MAX, max_iteraciones=MAX_ITERACIONES, diagnostico=None):
+    """Flota mínima encontrada que asigna todos los servicios dentro de `jornada_max`.
+
+    Devuelve (df_resultado, flota, informe). La flota solo incluye vehículos
+    con servicios, numerados B-001..., A-001...; cada uno lleva la base
+    donde más se le necesita. `informe` tiene la cota inferior, los
+    vehículos necesarios por tipo, las iteraciones y los servicios que no
+    caben en ningún vehículo ('sin_asignar', normalmente 0).
+    """
+    diagnostico = diagnostico if diagnostico is not None else Diagnostico()
+    instante = time.perf_counter()
+
+    if COLUMNA_MINUTOS not in df_servicios.columns:
+        df_servicios, _ = preparar_servicios(df_servicios)
+    cota = cota_inferior_flota(df_servicios, jornada_max)
+    instante = diagnostico.medir('flota.cota', instante)
+
+    numerados = dict.fromkeys(cota, 0)
+    flota = _nuevos_vehiculos(df_servicios, {tipo: max(n, 0) for tipo, n in cota.items()}, numerados)
+    df_resultado, flota = optimizar_rutas_multiple_servicios(df_servicios, flota, jornada_max, diagnostico)
+    columnas = df_resultado.columns
+
+    df_resultado, flota, iteraciones, pendientes = _ampliar(df_resultado, flota, jornada_max, numerados,
+                                                            max_iteraciones - 1, diagnostico)
+    iteraciones += 1
+    instante = diagnostico.medir('flota.busqueda', instante)
+    diagnostico.contar('iteraciones_flota', iteraciones)
+
+    # Consolidación: los vehículos con menos carga se vacían si sus servicios caben en el resto
+    plan = PlanIncremental(df_resultado, flota, jornada_max=jornada_max)
+    for vehiculo in sorted(flota, key=lambda v: (len(v['servicios_asignados']), v['tiempo_trabajado'])):
+        if plan.vaciar(vehiculo['id']):
+            diagnostico.contar('vehiculos_retirados')
+    df_resultado = plan.dataframe().reindex(columns=columnas)
+    df_resultado[COLUMNA_MINUTOS] = df_resultado[COLUMNA_MINUTOS].astype(np.int64)
+    flota = plan.flota
+    diagnostico.medir('flota.consolidacion', instante)
+
+    df_resultado, flota = _renumerar(df_resultado, flota)
+    informe = {
+        'cota': cota,
+        'necesarios': {tipo: sum(v['tipo'] == tipo for v in flota) for tipo in ('B', 'A')},
+        'iteraciones': iteraciones,
+        'sin_asignar': len(pendientes),
+    }
+    return df_resultado, flota, informe
+
+
+def completar_flota(df_resultado, flota, jornada_max=JORNADA_MAX, max_iteraciones=MAX_ITERACIONES, diagnostico=None):
+    """Añade al plan de cualquier motor los vehículos que necesitan sus SIN ASIGNAR.
+
+    Los servicios ya asignados no se mueven; los pendientes se colocan en
+    el hueco más barato de la flota ampliada. Devuelve (df_resultado,
+    flota, informe) con los vehículos añadidos por tipo, las iteraciones y
+    los servicios que no caben en ningún vehículo ('sin_asignar').
+    """
+    diagnostico = diagnostico if diagnostico is not None else Diagnostico()
+    instante = time.perf_counter()
+    previos = {v['id'] for v in flota}
+    df_resultado, flota, iteraciones, pendientes = _ampliar(df_resultado, flota, jornada_max, _numerados(flota),
+                                                            max_iteraciones, diagnostico)
+    diagnostico.medir('flota.completar', instante)
+    informe = {
+        'anadidos': {tipo: sum(v['tipo'] == tipo and v['id'] not in previos for v in flota) for tipo in ('B', 'A')},
+        'iteraciones': iteraciones,
+        'sin_asignar': len(pendientes),
+    }
+    return df_resultado, flota, informe
@@ -0,0 +1,171 @@
+"""Motor vectorizado de distancias y tiempos de viaje.
+
+Todas las ubicaciones distintas de un día (recogidas, destinos y bases) se
+geocodifican una sola vez y se calcula la matriz N×N completa, de modo que
+el optimizador consulta cualquier tiempo de viaje en O(1).
+
+La matriz la calcula un proveedor de tiempos: por defecto haversine con un
+perfil de velocidad (NumPy, sin red); con RUTAS_OSRM_URL definida, un
+servicio de tablas tipo OSRM por carretera (ver `osrm`). Un proveedor es
+cualquier objeto con `tabla(lats_origen, lons_origen, lats_destino,
+lons_destino)` y `matriz(lats, lons)` que devuelvan (km, minutos).
+"""
+
+import os
+import threading
+
+import numpy as np
+
+from .config import BASES, FACTOR_RUTA, TIEMPO_MINIMO_VIAJE, VELOCIDAD_MEDIA_KMH
+from .geocodificacion import coordenadas
+
+RADIO_TIERRA_KM = 6371.0
+
+
+def calcular_distancia_km(lat1, lon1, lat2, lon2):
+    """Distancia haversine en km; acepta escalares o arrays (con broadcasting)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def matriz_distancias_km(lats, lons):
+    """Matriz N×N de distancias haversine en una sola llamada vectorizada."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    return calcular_distancia_km(lats[:, None], lons[:, None], lats[None, :], lons[None, :]).astype(np.float32)
+
+
+def minutos_desde_km(distancias_km, velocidad_kmh=VELOCIDAD_MEDIA_KMH, factor_ruta=FACTOR_RUTA,
+                     tiempo_minimo=TIEMPO_MINIMO_VIAJE):
+    minutos = np.asarray(distancias_km, dtype=np.float32) * np.float32(factor_ruta * 60.0 / velocidad_kmh)
+    return np.maximum(np.ceil(minutos), np.float32(tiempo_minimo))
+
+
+def _velocidades(distancias_km, perfil):
+    # Tramos (hasta_km, km/h) ordenados; a partir del último, su velocidad
+    limites = np.asarray([hasta for hasta, _ in perfil], dtype=np.float32)
+    kmh = np.asarray([v for _, v in perfil], dtype=np.float32)
+    return kmh[np.minimum(np.searchsorted(limites, distancias_km), len(kmh) - 1)]
+
+
+class ProveedorHaversine:
+    """Línea recta × FACTOR_RUTA a la velocidad del perfil; no necesita red.
+
+    `perfil` es una lista de tramos (hasta_km, km/h), por ejemplo
+    [(15, 45), (60, 65), (inf, 80)] para que los trayectos cortos por
+    carreteras de montaña sean más lentos; sin perfil se usa
+    VELOCIDAD_MEDIA_KMH para todo.
+    """
+
+    def __init__(self, perfil=None, factor_ruta=FACTOR_RUTA, tiempo_minimo=TIEMPO_MINIMO_VIAJE):
+        self.perfil = sorted(perfil) if perfil else None
+        self.factor_ruta = factor_ruta
+        self.tiempo_minimo = tiempo_minimo
+
+    def _minutos(self, distancias_km):
+        velocidad = VELOCIDAD_MEDIA_KMH if self.perfil is None else _velocidades(distancias_km, self.perfil)
+        return minutos_desde_km(distancias_km, velocidad, self.factor_ruta, self.tiempo_minimo)
+
+    def tabla(self, lats_origen, lons_origen, lats_destino, lons_destino):
+        distancias_km = calcular_distancia_km(
+            np.asarray(lats_origen)[:, None], np.asarray(lons_origen)[:, None],
+            np.asarray(lats_destino)[None, :], np.asarray(lons_destino)[None, :],
+        ).astype(np.float32)
+        return distancias_km, self._minutos(distancias_km)
+
+    def matriz(self, lats, lons):
+        distancias_km = matriz_distancias_km(lats, lons)
+        return distancias_km, self._minutos(distancias_km)
+
+
+_proveedor = None
+_proveedor_lock = threading.Lock()
+
+
+def proveedor_por_defecto():
+    """Instancia compartida: OSRM si RUTAS_OSRM_URL está definida, haversine si no."""
+    global _proveedor
+    with _proveedor_lock:
+        if _proveedor is None:
+            url = os.environ.get('RUTAS_OSRM_URL')
+            if url:
+                from .osrm import ProveedorOSRM
+
+                _proveedor = ProveedorOSRM(url)
+            else:
+                _proveedor = ProveedorHaversine()
+    return _proveedor
+
+
+def _vectores_unitarios(lats, lons):
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class IndiceBases:
+    """Índice espacial de las bases para consultas de base más cercana.
+
+    Cada base se guarda como vector unitario 3D: la más cercana por distancia
+    haversine es la de mayor producto escalar, de modo que P consultas se
+    resuelven con un único producto de matrices P×3 · 3×B.
+    """
+
+    def __init__(self, bases=BASES):
+        self.nombres = np.asarray(list(bases), dtype=object)
+        self._vectores = _vectores_unitarios([b['lat'] for b in bases.values()], [b['lon'] for b in bases.values()])
+
+    def mas_cercanas(self, lats, lons):
+        return self.nombres[np.argmax(_vectores_unitarios(lats, lons) @ self._vectores.T, axis=1)]
+
+    def mas_cercana(self, lat, lon):
+        return self.mas_cercanas([lat], [lon])[0]
+
+
+class MatrizTiempos:
+    """Distancias (km) y tiempos de viaje (min) entre todas las ubicaciones de un día.
+
+    Las ubicaciones que geocodifican al mismo punto comparten fila, así que el
+    tamaño de la matriz depende de los puntos distintos y no del número de
+    servicios.
+    """
+
+    def __init__(self, ubicaciones, geocodificar=coordenadas, proveedor=None):
+        self.indices = {}
+        puntos = {}
+        lats, lons = [], []
+        for ubicacion in dict.fromkeys(str(u) for u in ubicaciones):
+            punto = geocodificar(ubicacion)
+            if punto not in puntos:
+                puntos[punto] = len(lats)
+                lats.append(punto[0])
+                lons.append(punto[1])
+            self.indices[ubicacion] = puntos[punto]
+
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        proveedor = proveedor if proveedor is not None else proveedor_por_defecto()
+        self.distancias_km, self.minutos = proveedor.matriz(self.lats, self.lons)
+        # Un mismo punto no cuesta desplazamiento
+        np.fill_diagonal(self.minutos, 0)
+
+    @classmethod
+    def desde_servicios(cls, df_servicios, **kwargs):
+        ubicaciones = list(BASES) + df_servicios['Recogida'].astype(str).tolist() + df_servicios['Destino'].astype(str).tolist()
+        return cls(ubicaciones, **kwargs)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def indice(self, ubicacion):
+        return self.indices[str(ubicacion)]
+
+    def indices_de(self, serie):
+        return serie.astype(str).map(self.indices).to_numpy(dtype=np.int64)
+
+    def tiempo(self, origen, destino):
+        return float(self.minutos[origen, destino])
+
+    def distancia(self, origen, destino):
+        return float(self.distancias_km[origen, destino])
@@ -0,0 +1,129 @@
+"""Exportación de resultados a Excel (openpyxl en modo solo escritura) y a CSV/Parquet.
+
+Todas las hojas se escriben fila a fila desde columnas ya calculadas
+(`df_resultado` y el resumen por conductor), sin construir un DataFrame ni
+una hoja en memoria por conductor.
+"""
+
+import io
+import re
+import zipfile
+
+from .horarios import COLUMNA_MINUTOS, formatear_minutos
+
+COLUMNAS_JORNADA = ['Hora', 'Actividad', 'Paciente', 'Recogida', 'Destino', 'Tipo', 'Observaciones']
+MAX_NOMBRE_HOJA = 30
+_CARACTERES_PROHIBIDOS_HOJA = re.compile(r'[\[\]:*?/\\]')
+
+
+def calcular_hora_entrada(servicios):
+    if not servicios:
+        return "08:00"
+    primer_minuto = min(s[COLUMNA_MINUTOS] for s in servicios)
+    return formatear_minutos(max(0, primer_minuto - 45))
+
+
+def resumen_por_conductor(flota, jornada_objetivo=8):
+    """Una fila por conductor con servicios: entrada, salida, horas y estado frente a la jornada objetivo."""
+    resumen = []
+    for v in flota:
+        if v['servicios_asignados']:
+            hora_entrada = calcular_hora_entrada(v['servicios_asignados'])
+            hora_salida = v['servicios_asignados'][-1]['Fin Servicio']
+            total_horas = round(v['tiempo_trabajado'] / 60, 2)
+            num_servicios = len(v['servicios_asignados'])
+
+            # Calcular horas de espera y viaje para jornada
+            total_viaje = sum([s.get('Tiempo Viaje', 0) for s in v['servicios_asignados']]) / 60  # Convertir a horas
+            jornada_horas = jornada_objetivo - total_viaje  # Jornada = objetivo - tiempo_viaje
+
+            resumen.append({
+                'Vehículo': v['id'],
+                'Conductor': v.get('conductor', 'N/A'),
+                'Matrícula': v.get('matricula', 'N/A'),
+                'Hora Entrada': hora_entrada,
+                'Hora Salida': hora_salida,
+                'Total Horas': total_horas,
+                'Nº Servicios': num_servicios,
+                'Jornada (h)': round(jornada_horas, 2),
+                'Estado': '✅ Óptimo' if total_horas <= jornada_objetivo else '⚠️ Extendida'
+            })
+    return resumen
+
+
+def _filas(df):
+    # NaN -> celda vacía; el resto de valores se escriben tal cual
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+
+def _nombre_hoja(nombre, usados):
+    base = _CARACTERES_PROHIBIDOS_HOJA.sub('-', str(nombre))[:MAX_NOMBRE_HOJA] or 'Hoja'
+    candidato, n = base, 2
+    while candidato.lower() in usados:
+        sufijo = f" ({n})"
+        candidato, n = base[:MAX_NOMBRE_HOJA - len(sufijo)] + sufijo, n + 1
+    usados.add(candidato.lower())
+    return candidato
+
+
+def filas_jornada(df_resultado, df_conductores):
+    """Genera (conductor, filas) de la hoja de cada conductor a partir de las columnas del resultado."""
+    asignados = df_resultado[df_resultado['Vehículo'] != 'SIN ASIGNAR']
+    posiciones = asignados.groupby('Vehículo', sort=False).indices
+    columnas = {c: asignados[c].to_numpy(dtype=object)
+                for c in ['Hora Cita', 'Paciente', 'Recogida', 'Destino', 'Tipo', 'Inicio Real', 'Fin Servicio']}
+
+    for conductor in df_conductores.to_dict('records'):
+        filas = [[conductor['Hora Entrada'], 'ENTRADA', '-', '-', '-', '-',
+                  f"Conductor: {conductor['Conductor']} | Veh: {conductor['Vehículo']}"]]
+        for i, p in enumerate(posiciones.get(conductor['Vehículo'], []), 1):
+            filas.append([columnas['Hora Cita'][p], f'SERVICIO #{i}', columnas['Paciente'][p],
+                          columnas['Recogida'][p], columnas['Destino'][p], columnas['Tipo'][p],
+                          f"Inicio: {columnas['Inicio Real'][p]} | Fin: {columnas['Fin Servicio'][p]}"])
+        filas.append([conductor['Hora Salida'], 'SALIDA', '-', '-', '-', '-',
+                      f"Total: {conductor['Total Horas']}h | Servicios: {conductor['Nº Servicios']}"])
+        yield conductor, filas
+
+
+def escribir_excel(df_resultado, df_conductores):
+    """Libro con 'Resumen General', una hoja por conductor y 'Estadísticas'; devuelve los bytes del xlsx."""
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    usados = set()
+
+    hoja = libro.create_sheet(_nombre_hoja('Resumen General', usados))
+    hoja.append(list(df_resultado.columns))
+    for fila in _filas(df_resultado):
+        hoja.append(fila)
+
+    for conductor, filas in filas_jornada(df_resultado, df_conductores):
+        nombre = conductor['Conductor'] if conductor['Conductor'] not in (None, '', 'N/A') else conductor['Vehículo']
+        hoja = libro.create_sheet(_nombre_hoja(nombre, usados))
+        hoja.append(COLUMNAS_JORNADA)
+        for fila in filas:
+            hoja.append(fila)
+
+    if len(df_conductores):
+        hoja = libro.create_sheet(_nombre_hoja('Estadísticas', usados))
+        hoja.append(list(df_conductores.columns))
+        for fila in _filas(df_conductores):
+            hoja.append(fila)
+
+    buffer = io.BytesIO()
+    libro.save(buffer)
+    return buffer.getvalue()
+
+
+def generar_paquete(df_resultado, df_conductores, formato='csv'):
+    """Zip con 'servicios' y 'conductores' en CSV o Parquet (este último requiere pyarrow)."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as paquete:
+        for nombre, df in (('servicios', df_resultado), ('conductores', df_conductores)):
+            if formato == 'parquet':
+                # Columnas de tipos mezclados (p. ej. horas de Excel y texto) se guardan como texto
+                mixtas = {c: 'string' for c in df.columns if df[c].dtype == object}
+                paquete.writestr(f'{nombre}.parquet', df.astype(mixtas).to_parquet(index=False))
+            else:
+                paquete.writestr(f'{nombre}.csv', df.to_csv(index=False))
+    return buffer.getvalue()
@@ -0,0 +1,101 @@
+# ==========================================
+# DEFINICIÓN DE FLOTA
+# ==========================================
+
+import math
+
+from .config import BASES, CAPACIDAD_VEHICULO
+from .geocodificacion import normalizar_direccion
+
+PROPORCION_TIPO_B = 0.7  # Reparto B/A de la flota automática
+COLUMNAS_FLOTA = ['id', 'tipo', 'conductor', 'matricula', 'base']
+_BASES_NORMALIZADAS = {normalizar_direccion(base): base for base in BASES}
+
+
+def crear_flota(num_b, num_a):
+    flota = []
+    for i in range(1, num_b + 1):
+        flota.append({
+            "id": f"B-{i:03d}",
+            "tipo": "B",
+            "conductor": f"Conductor B-{i}",
+            "matricula": f"{1000+i}BBB"
+        })
+    for i in range(1, num_a + 1):
+        flota.append({
+            "id": f"A-{i:03d}",
+            "tipo": "A",
+            "conductor": f"Conductor A-{i}",
+            "matricula": f"{2000+i}AAA"
+        })
+    return flota
+
+
+def flota_predefinida():
+    return crear_flota(27, 8)
+
+
+def flota_automatica(num_servicios):
+    """Regla práctica: un vehículo por cada 6 servicios (mínimo 10), 70% tipo B."""
+    num_vehiculos = max(10, (num_servicios // 6) + 1)
+    num_b = int(num_vehiculos * PROPORCION_TIPO_B)
+    return crear_flota(num_b, num_vehiculos - num_b)
+
+
+def tabla_flota(flota):
+    """La flota como DataFrame (una fila por vehículo, columnas COLUMNAS_FLOTA) para editarla o guardarla."""
+    import pandas as pd
+
+    return pd.DataFrame([[v.get(c) for c in COLUMNAS_FLOTA] for v in flota], columns=COLUMNAS_FLOTA, dtype=object)
+
+
+def flota_desde_tabla(df):
+    """Vehículos de una tabla con columnas id, tipo y opcionalmente conductor, matricula y base.
+
+    Las filas sin id se ignoran (filas en blanco de una hoja o del editor);
+    la base se reconoce sin mayúsculas ni tildes ('olvega' es 'Ólvega') y
+    se guarda con su nombre en BASES. Un tipo o una base desconocidos, o un
+    id repetido, son un ValueError.
+    """
+    df = df.rename(columns=lambda c: str(c).strip().lower())
+    faltan = [c for c in ('id', 'tipo') if c not in df.columns]
+    if faltan:
+        raise ValueError(f"Faltan columnas en la flota: {', '.join(faltan)}")
+    df = df.astype(object).where(df.notna(), None)
+    flota, ids = [], set()
+    for fila in df.to_dict('records'):
+        if _vacio(fila['id']):
+            continue
+        vehiculo = {
+            "id": str(fila['id']).strip(),
+            "tipo": '' if _vacio(fila['tipo']) else str(fila['tipo']).strip().upper(),
+            "conductor": str(fila['id']).strip() if _vacio(fila.get('conductor')) else str(fila['conductor']),
+            "matricula": '' if _vacio(fila.get('matricula')) else str(fila['matricula'])
+        }
+        if vehiculo['tipo'] not in CAPACIDAD_VEHICULO:
+            raise ValueError(f"Tipo de vehículo desconocido en {vehiculo['id']}: {fila['tipo']!r} "
+                             f"(tipos: {', '.join(CAPACIDAD_VEHICULO)})")
+        if vehiculo['id'] in ids:
+            raise ValueError(f"Vehículo repetido en la flota: {vehiculo['id']}")
+        ids.add(vehiculo['id'])
+        if not _vacio(fila.get('base')):
+            base = _BASES_NORMALIZADAS.get(normalizar_direccion(fila['base']))
+            if base is None:
+                raise ValueError(f"Base desconocida en {vehiculo['id']}: {fila['base']!r} "
+                                 f"(bases: {', '.join(BASES)})")
+            vehiculo['base'] = base
+        flota.append(vehiculo)
+    return flota
+
+
+def leer_flota(fichero):
+    """Lee una flota desde CSV o Excel (ruta o fichero subido); ver `flota_desde_tabla`."""
+    import pandas as pd
+
+    nombre = str(getattr(fichero, 'name', fichero))
+    df = pd.read_csv(fichero) if nombre.lower().endswith('.csv') else pd.read_excel(fichero)
+    return flota_desde_tabla(df)
+
+
+def _vacio(valor):
+    return valor is None or (isinstance(valor, float) and math.isnan(valor)) or str(valor).strip() == ''
@@ -0,0 +1,197 @@
+"""Geocodificación de direcciones sin red en régimen normal.
+
+Las direcciones se normalizan y se resuelven, por este orden, contra un
+nomenclátor incluido con el paquete (municipios de la provincia de Soria y
+hospitales de referencia), una caché persistente en SQLite y, solo si se
+configura, un proveedor externo (geopy/Nominatim) cuyos resultados quedan
+guardados en la caché.
+"""
+
+import csv
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from pathlib import Path
+
+from .config import BASES
+
+RUTA_GAZETTEER = Path(__file__).parent / 'datos' / 'gazetteer_soria.csv'
+RUTA_CACHE_POR_DEFECTO = Path(os.environ.get(
+    'RUTAS_GEOCACHE', Path.home() / '.cache' / 'rutas_ambulancias' / 'geocache.sqlite'))
+MAX_PALABRAS_NOMBRE = 6  # Longitud máxima (en palabras) de un nombre del nomenclátor
+PALABRAS_HOSPITAL = ('hospital', 'h')  # Delante de un alias de hospital, confirman que no es una calle
+PREFIJOS_CENTRO = ('hospital ', 'h ', 'centro de salud ', 'c s ')
+
+
+def normalizar_direccion(direccion):
+    texto = unicodedata.normalize('NFKD', str(direccion).lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', texto).split())
+
+
+def cargar_gazetteer(ruta=RUTA_GAZETTEER):
+    """Devuelve {nombre normalizado: (lat, lon)} incluyendo los alias."""
+    gazetteer = {}
+    with open(ruta, encoding='utf-8', newline='') as f:
+        for fila in csv.DictReader(f):
+            punto = (float(fila['lat']), float(fila['lon']))
+            nombres = [fila['nombre']] + [a for a in (fila.get('alias') or '').split('|') if a]
+            for nombre in nombres:
+                gazetteer.setdefault(normalizar_direccion(nombre), punto)
+    return gazetteer
+
+
+def cargar_alias_de_hospital(ruta=RUTA_GAZETTEER):
+    """Nombres normalizados de hospital que también pueden ser calles ('La Paz', 'Miguel Servet').
+
+    Dentro de una dirección solo cuentan precedidos de PALABRAS_HOSPITAL;
+    solos, como dirección completa, se resuelven igual que el resto.
+    """
+    with open(ruta, encoding='utf-8', newline='') as f:
+        return {
+            clave
+            for fila in csv.DictReader(f) if fila['tipo'] == 'hospital'
+            for clave in map(normalizar_direccion, [fila['nombre']] + (fila.get('alias') or '').split('|'))
+            if clave and not clave.startswith(PREFIJOS_CENTRO)
+        }
+
+
+class CacheGeocodificacion:
+    """Caché persistente clave normalizada -> (lat, lon) en SQLite.
+
+    Los fallos del proveedor también se guardan (con coordenadas nulas) para
+    no repetir la consulta en ejecuciones posteriores.
+    """
+
+    def __init__(self, ruta=RUTA_CACHE_POR_DEFECTO):
+        self.ruta = str(ruta)
+        if self.ruta != ':memory:':
+            Path(self.ruta).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+        self._conexion.execute(
+            'CREATE TABLE IF NOT EXISTS geocache ('
+            'clave TEXT PRIMARY KEY, lat REAL, lon REAL, fuente TEXT)'
+        )
+        self._conexion.commit()
+
+    def obtener(self, clave):
+        """(lat, lon), None si se sabe que no existe o KeyError si no está en caché."""
+        with self._lock:
+            fila = self._conexion.execute('SELECT lat, lon FROM geocache WHERE clave = ?', (clave,)).fetchone()
+        if fila is None:
+            raise KeyError(clave)
+        return None if fila[0] is None else (fila[0], fila[1])
+
+    def guardar(self, clave, punto, fuente):
+        lat, lon = punto if punto is not None else (None, None)
+        with self._lock:
+            self._conexion.execute('INSERT OR REPLACE INTO geocache VALUES (?, ?, ?, ?)', (clave, lat, lon, fuente))
+            self._conexion.commit()
+
+    def cerrar(self):
+        self._conexion.close()
+
+
+def proveedor_geopy(user_agent='rutas-ambulancias', sufijo=', Soria, España', min_delay_seconds=1.0):
+    """Proveedor de respaldo basado en Nominatim; solo se usa si se activa explícitamente."""
+    from geopy.extra.rate_limiter import RateLimiter
+    from geopy.geocoders import Nominatim
+
+    geocode = RateLimiter(Nominatim(user_agent=user_agent).geocode, min_delay_seconds=min_delay_seconds)
+
+    def proveedor(direccion):
+        resultado = geocode(f"{direccion}{sufijo}")
+        return None if resultado is None else (resultado.latitude, resultado.longitude)
+
+    return proveedor
+
+
+class Geocodificador:
+    """Resuelve direcciones a (lat, lon) con memoria, nomenclátor, caché y proveedor opcional.
+
+    `proveedor` es cualquier callable direccion -> (lat, lon) | None; en
+    pruebas puede sustituirse por un stub sin tocar la red. Los nombres de
+    `alias_de_hospital` solo se buscan dentro de una dirección si van tras
+    'Hospital' o 'H.' (ver `cargar_alias_de_hospital`).
+    """
+
+    def __init__(self, cache=None, proveedor=None, gazetteer=None, alias_de_hospital=None):
+        self.cache = cache
+        self.proveedor = proveedor
+        self.gazetteer = cargar_gazetteer() if gazetteer is None else gazetteer
+        if alias_de_hospital is None:
+            alias_de_hospital = cargar_alias_de_hospital() if gazetteer is None else set()
+        self.alias_de_hospital = alias_de_hospital
+        self._memoria = {}
+        self.consultas_red = 0
+
+    def _buscar_en_gazetteer(self, clave):
+        if clave in self.gazetteer:
+            return self.gazetteer[clave]
+        # El nombre más largo contenido en la dirección; a igualdad, el más a la derecha
+        palabras = clave.split()
+        for n in range(min(MAX_PALABRAS_NOMBRE, len(palabras)), 0, -1):
+            for i in range(len(palabras) - n, -1, -1):
+                nombre = ' '.join(palabras[i:i + n])
+                if nombre in self.alias_de_hospital and (i == 0 or palabras[i - 1] not in PALABRAS_HOSPITAL):
+                    continue  # 'Calle La Paz 3, Soria' es una calle de Soria, no el hospital de Madrid
+                punto = self.gazetteer.get(nombre)
+                if punto is not None:
+                    return punto
+        return None
+
+    def geocodificar(self, direccion):
+        clave = normalizar_direccion(direccion)
+        if clave not in self._memoria:
+            self._memoria[clave] = self._resolver(clave, direccion)
+        return self._memoria[clave]
+
+    def _resolver(self, clave, direccion):
+        if not clave:
+            return None
+        punto = self._buscar_en_gazetteer(clave)
+        if punto is not None:
+            return punto
+        if self.cache is not None:
+            try:
+                return self.cache.obtener(clave)
+            except KeyError:
+                pass
+        if self.proveedor is None:
+            return None
+        self.consultas_red += 1
+        punto = self.proveedor(direccion)
+        if self.cache is not None:
+            self.cache.guardar(clave, punto, 'proveedor')
+        return punto
+
+    def coordenadas(self, direccion, por_defecto='Soria'):
+        punto = self.geocodificar(direccion)
+        if punto is None:
+            return BASES[por_defecto]['lat'], BASES[por_defecto]['lon']
+        return punto
+
+
+_geocodificador = None
+_geocodificador_lock = threading.Lock()
+
+
+def geocodificador_por_defecto():
+    """Instancia compartida; el respaldo en línea se activa con RUTAS_GEOCODIFICAR_EN_LINEA=1."""
+    global _geocodificador
+    with _geocodificador_lock:
+        if _geocodificador is None:
+            try:
+                cache = CacheGeocodificacion()
+            except (OSError, sqlite3.Error):
+                cache = CacheGeocodificacion(':memory:')
+            proveedor = proveedor_geopy() if os.environ.get('RUTAS_GEOCODIFICAR_EN_LINEA') == '1' else None
+            _geocodificador = Geocodificador(cache=cache, proveedor=proveedor)
+    return _geocodificador
+
+
+def coordenadas(direccion):
+    return geocodificador_por_defecto().coordenadas(direccion)
@@ -0,0 +1,243 @@
+"""Historial de planes en SQLite y arranque en caliente desde días anteriores.
+
+Cada plan guardado es una fila por servicio (fecha, vehículo, paciente,
+cita, recogida, destino...), con índices por fecha, vehículo y paciente.
+La mayor parte del volumen se repite cada semana (diálisis, rehabilitación,
+oncología): un servicio es recurrente si el mismo paciente tuvo la misma
+cita, recogida, destino y tipo el mismo día de semanas anteriores o el día
+anterior. Esos servicios se precargan en el vehículo que los llevó y solo
+los nuevos o cambiados se colocan después en el hueco más barato.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .busqueda_local import mejorar_plan
+from .config import JORNADA_MAX
+from .diagnostico import Diagnostico
+from .geocodificacion import normalizar_direccion
+from .horarios import COLUMNA_MINUTOS, preparar_servicios
+from .optimizador import optimizar_rutas
+from .replanificacion import SIN_ASIGNAR, PlanIncremental
+
+RUTA_HISTORIAL_POR_DEFECTO = Path(os.environ.get(
+    'RUTAS_HISTORIAL', Path.home() / '.cache' / 'rutas_ambulancias' / 'planes.sqlite'))
+SEMANAS_HISTORIAL = 4  # Semanas hacia atrás en las que se buscan servicios recurrentes
+FRACCION_MINIMA_RECURRENTES = 0.3  # Por debajo, el día se resuelve desde cero con el motor elegido
+MOTOR_HISTORIAL = 'Historial'
+
+# Columnas de la tabla `servicios` además de su id de fila
+COLUMNAS_TABLA = ['fecha', 'vehiculo', 'conductor', 'paciente', 'minuto', 'hora_cita', 'inicio_real', 'recogida',
+                  'destino', 'tipo', 'viaje']
+
+COLUMNAS_RESULTADO = [
+    'Vehículo', 'Conductor', 'Hora Cita', COLUMNA_MINUTOS, 'Inicio Real', 'Fin Servicio', 'Paciente',
+    'Recogida', 'Destino', 'Tipo', 'Base', 'Tiempo Viaje', 'Km Viaje', 'Horas Trabajadas',
+]
+
+
+def _texto(valor):
+    return None if valor is None or (isinstance(valor, float) and np.isnan(valor)) else str(valor)
+
+
+def _clave_recurrente(paciente, minuto, recogida, destino, tipo):
+    return (str(paciente), int(minuto), normalizar_direccion(recogida), normalizar_direccion(destino),
+            _texto(tipo) or 'Sentado')
+
+
+def fecha_en_nombre(nombre):
+    """Fecha AAAA-MM-DD (o AAAAMMDD) contenida en un nombre de fichero, o None."""
+    coincidencia = re.search(r'(\d{4})-?(\d{2})-?(\d{2})', str(nombre))
+    if coincidencia is None:
+        return None
+    try:
+        return date(*map(int, coincidencia.groups()))
+    except ValueError:
+        return None
+
+
+def fechas_referencia(fecha, semanas=SEMANAS_HISTORIAL):
+    """Días de los que se toman asignaciones, por prioridad: la semana pasada, ayer y semanas anteriores."""
+    return [fecha - timedelta(days=7), fecha - timedelta(days=1)] + [
+        fecha - timedelta(days=7 * semana) for semana in range(2, semanas + 1)
+    ]
+
+
+class HistorialPlanes:
+    """Planes diarios guardados en SQLite (una fila por servicio)."""
+
+    def __init__(self, ruta=RUTA_HISTORIAL_POR_DEFECTO):
+        self.ruta = str(ruta)
+        if self.ruta != ':memory:':
+            Path(self.ruta).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Varios procesos (CLI) pueden escribir días distintos: se espera al bloqueo en lugar de fallar
+        self._conexion = sqlite3.connect(self.ruta, check_same_thread=False, timeout=30)
+        self._conexion.executescript(
+            'CREATE TABLE IF NOT EXISTS servicios ('
+            'id INTEGER PRIMARY KEY, fecha TEXT NOT NULL, vehiculo TEXT NOT NULL, conductor TEXT, '
+            'paciente TEXT NOT NULL, minuto INTEGER NOT NULL, hora_cita TEXT, inicio_real TEXT, recogida TEXT, '
+            'destino TEXT, tipo TEXT, viaje TEXT);'
+            'CREATE INDEX IF NOT EXISTS servicios_fecha ON servicios (fecha, minuto);'
+            'CREATE INDEX IF NOT EXISTS servicios_vehiculo ON servicios (vehiculo, fecha);'
+            'CREATE INDEX IF NOT EXISTS servicios_paciente ON servicios (paciente, fecha);'
+        )
+        self._conexion.commit()
+
+    def guardar(self, fecha, df_resultado):
+        """Guarda (sustituyendo el de esa fecha) el plan del día; también los SIN ASIGNAR.
+
+        Cada fila del plan es una fila de la tabla, aunque se repita. Devuelve
+        los (paciente, hora de cita) que aparecen más de una vez con la misma
+        recogida y destino, que suelen ser datos duplicados en el origen.
+        """
+        filas = [
+            (fecha.isoformat(), str(f['Vehículo']), _texto(f.get('Conductor')), _texto(f['Paciente']) or '',
+             int(f[COLUMNA_MINUTOS]), _texto(f.get('Hora Cita')), _texto(f.get('Inicio Real')),
+             _texto(f.get('Recogida')), _texto(f.get('Destino')), _texto(f.get('Tipo')), _texto(f.get('Viaje')))
+            for f in df_resultado.to_dict('records')
+        ]
+        with self._lock, self._conexion:
+            self._conexion.execute('DELETE FROM servicios WHERE fecha = ?', (fecha.isoformat(),))
+            self._conexion.executemany(
+                f"INSERT INTO servicios ({', '.join(COLUMNAS_TABLA)}) "
+                f"VALUES ({', '.join(['?'] * len(COLUMNAS_TABLA))})", filas
+            )
+        vistos, repetidos = set(), []
+        for fila in filas:
+            clave = (fila[3], fila[4], normalizar_direccion(fila[7]), normalizar_direccion(fila[8]))
+            if clave in vistos:
+                repetidos.append((fila[3], fila[5]))
+            vistos.add(clave)
+        return repetidos
+
+    def _consultar(self, sql, parametros=()):
+        with self._lock:
+            cursor = self._conexion.execute(sql, parametros)
+            columnas = [c[0] for c in cursor.description]
+            return pd.DataFrame(cursor.fetchall(), columns=columnas)
+
+    def fechas(self):
+        """Fechas con plan guardado, de la más reciente a la más antigua."""
+        with self._lock:
+            filas = self._conexion.execute('SELECT DISTINCT fecha FROM servicios ORDER BY fecha DESC').fetchall()
+        return [date.fromisoformat(f[0]) for f in filas]
+
+    def plan(self, fecha, vehiculo=None):
+        """Servicios guardados de un día (de un vehículo, si se indica) en orden de cita."""
+        if vehiculo is None:
+            return self._consultar(f"SELECT {', '.join(COLUMNAS_TABLA)} FROM servicios WHERE fecha = ? "
+                                   f"ORDER BY minuto, id", (fecha.isoformat(),))
+        return self._consultar(f"SELECT {', '.join(COLUMNAS_TABLA)} FROM servicios WHERE vehiculo = ? AND fecha = ? "
+                               f"ORDER BY minuto, id", (str(vehiculo), fecha.isoformat()))
+
+    def servicios_paciente(self, paciente):
+        """Historial de un paciente: fecha, hora, vehículo y conductor de cada servicio."""
+        return self._consultar(f"SELECT {', '.join(COLUMNAS_TABLA)} FROM servicios WHERE paciente = ? "
+                               f"ORDER BY fecha, minuto, id", (str(paciente),))
+
+    def asignacion_previa(self, fecha, df_servicios, semanas=SEMANAS_HISTORIAL):
+        """({clave_servicio: id de vehículo} de los servicios recurrentes del día, informe).
+
+        Para cada servicio se toma el vehículo del primer día de
+        `fechas_referencia` en el que estuvo asignado con los mismos datos.
+        """
+        if COLUMNA_MINUTOS not in df_servicios.columns:
+            df_servicios, _ = preparar_servicios(df_servicios)
+        referencias = fechas_referencia(fecha, semanas)
+        previos = self._consultar(
+            f"SELECT fecha, vehiculo, paciente, minuto, recogida, destino, tipo FROM servicios "
+            f"WHERE fecha IN ({', '.join(['?'] * len(referencias))}) AND vehiculo != ?",
+            [f.isoformat() for f in referencias] + [SIN_ASIGNAR],
+        )
+        prioridad = {f.isoformat(): orden for orden, f in enumerate(referencias)}
+        vehiculo_de = {}
+        for fila in sorted(previos.to_dict('records'), key=lambda f: prioridad[f['fecha']]):
+            clave = _clave_recurrente(fila['paciente'], fila['minuto'], fila['recogida'], fila['destino'], fila['tipo'])
+            vehiculo_de.setdefault(clave, fila['vehiculo'])
+
+        asignacion = {}
+        for fila in df_servicios.to_dict('records'):
+            clave = _clave_recurrente(fila['Paciente'], fila[COLUMNA_MINUTOS], fila['Recogida'], fila['Destino'],
+                                      fila.get('Tipo'))
+            if clave in vehiculo_de:
+                asignacion[(clave[0], clave[1])] = vehiculo_de[clave]
+        informe = {
+            'recurrentes': len(asignacion),
+            'nuevos': len(df_servicios) - len(asignacion),
+            'dias_referencia': sorted(set(previos['fecha'])),
+        }
+        return asignacion, informe
+
+    def cerrar(self):
+        self._conexion.close()
+
+
+def hay_arranque_en_caliente(asignacion, num_servicios, agrupar=False):
+    """Si compensa partir de la asignación previa (suficientes recurrentes y sin traslados compartidos)."""
+    return not agrupar and num_servicios > 0 and len(asignacion) >= FRACCION_MINIMA_RECURRENTES * num_servicios
+
+
+def arrancar_en_caliente(df_servicios, flota, asignacion, jornada_max=JORNADA_MAX, diagnostico=None):
+    """(df_resultado, flota) con los recurrentes en su vehículo previo y el resto en el hueco más barato.
+
+    Los recurrentes que ya no caben en su vehículo (otra flota, jornada
+    más corta) se tratan como nuevos.
+    """
+    diagnostico = diagnostico if diagnostico is not None else Diagnostico()
+    instante = time.perf_counter()
+    if COLUMNA_MINUTOS not in df_servicios.columns:
+        df_servicios, _ = preparar_servicios(df_servicios)
+    df_pendientes = df_servicios.assign(**{'Vehículo': SIN_ASIGNAR, 'Conductor': 'N/A'})
+    flota = [dict(v, servicios_asignados=[], tiempo_trabajado=0, disponible_desde=0) for v in flota]
+    plan = PlanIncremental(df_pendientes, flota, jornada_max=jornada_max)
+    pendientes = len(plan.sin_asignar)
+    plan.precargar(asignacion)
+    diagnostico.contar('recurrentes_reutilizados', pendientes - len(plan.sin_asignar))
+    instante = diagnostico.medir('historial.precarga', instante)
+    pendientes = len(plan.sin_asignar)
+    plan.reparar()
+    diagnostico.contar('nuevos_colocados', pendientes - len(plan.sin_asignar))
+    diagnostico.medir('historial.nuevos', instante)
+
+    df_resultado = plan.dataframe().reindex(columns=COLUMNAS_RESULTADO)
+    df_resultado[COLUMNA_MINUTOS] = df_resultado[COLUMNA_MINUTOS].astype(np.int64)
+    return df_resultado, plan.flota
+
+
+def optimizar_con_historial(df_servicios, flota, historial, fecha, motor='Voraz', jornada_max=JORNADA_MAX,
+                            diagnostico=None, guardar=True, **opciones):
+    """Como `optimizar_rutas`, partiendo de los planes de días anteriores guardados en `historial`.
+
+    Si menos de FRACCION_MINIMA_RECURRENTES de los servicios son
+    recurrentes, o se pide `agrupar`, el día se resuelve desde cero con
+    `motor`. Devuelve (df_resultado, flota, motor_usado, informe); con
+    `guardar`, el plan resultante queda en el historial con su fecha y
+    `informe['repetidos']` cuenta los servicios duplicados que tenía.
+    """
+    diagnostico = diagnostico if diagnostico is not None else Diagnostico()
+    if COLUMNA_MINUTOS not in df_servicios.columns:
+        df_servicios, _ = preparar_servicios(df_servicios)
+    asignacion, informe = historial.asignacion_previa(fecha, df_servicios)
+    informe['en_caliente'] = hay_arranque_en_caliente(asignacion, len(df_servicios), opciones.get('agrupar'))
+    if informe['en_caliente']:
+        df_resultado, flota = arrancar_en_caliente(df_servicios, flota, asignacion, jornada_max, diagnostico)
+        if opciones.get('mejorar_segundos'):
+            df_resultado, flota, _ = mejorar_plan(df_resultado, flota, opciones['mejorar_segundos'],
+                                                  jornada_max=jornada_max, diagnostico=diagnostico)
+        motor_usado = MOTOR_HISTORIAL
+    else:
+        df_resultado, flota, motor_usado = optimizar_rutas(df_servicios, flota, motor=motor, jornada_max=jornada_max,
+                                                           diagnostico=diagnostico, **opciones)
+    if guardar:
+        informe['repetidos'] = len(historial.guardar(fecha, df_resultado))
+        diagnostico.contar('servicios_repetidos', informe['repetidos'])
+    return df_resultado, flota, motor_usado, informe
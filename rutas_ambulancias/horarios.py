@@ -0,0 +1,80 @@
+"""Normalización de 'Hora Cita' a minutos desde medianoche.
+
+Las horas llegan como texto ('08:30', '8.30', '08:30:00', '2025-03-01 08:30'),
+objetos `datetime.time` de Excel, fechas completas, `timedelta` o fracciones
+de día. Se interpretan una sola vez por valor distinto (`pd.factorize`) y el
+resultado es una columna int16 que usa el resto del proceso.
+"""
+
+import re
+from datetime import date, datetime, time, timedelta
+from numbers import Real
+
+import numpy as np
+import pandas as pd
+
+COLUMNA_MINUTOS = 'Minuto Cita'
+MINUTOS_DIA = 24 * 60
+MOTIVO_HORA_INVALIDA = 'Hora Cita no reconocida'
+
+_PATRON_HORA = re.compile(r'^\s*(\d{1,2})\s*[:.hH]\s*(\d{2})(?:\s*:\s*(\d{2}))?\s*(?:h|hrs?)?\s*$')
+_PATRON_CON_HORA = re.compile(r'\d\s*[:hH]\s*\d{2}')  # Una fecha en texto solo vale si trae hora
+
+
+def _minuto(valor):
+    if valor is None or valor is pd.NaT:
+        return None
+    if isinstance(valor, time):
+        return valor.hour * 60 + valor.minute
+    if isinstance(valor, datetime):
+        return valor.hour * 60 + valor.minute
+    if isinstance(valor, date):
+        return None
+    if isinstance(valor, timedelta):
+        minutos = int(valor.total_seconds() // 60)
+        return minutos if 0 <= minutos < MINUTOS_DIA else None
+    if isinstance(valor, Real) and not isinstance(valor, bool):
+        if np.isnan(valor) or not 0 <= valor < 1:
+            return None
+        # Fracción de día tal como la guarda Excel
+        return int(round(valor * MINUTOS_DIA)) % MINUTOS_DIA
+    texto = str(valor)
+    coincidencia = _PATRON_HORA.match(texto)
+    if coincidencia:
+        horas, minutos = int(coincidencia.group(1)), int(coincidencia.group(2))
+        return horas * 60 + minutos if horas < 24 and minutos < 60 else None
+    if not _PATRON_CON_HORA.search(texto):
+        return None  # '2025-03-01' sin hora no es las 00:00, igual que un `date`
+    fecha = pd.to_datetime(texto, errors='coerce')
+    if pd.isna(fecha):
+        return None
+    return fecha.hour * 60 + fecha.minute
+
+
+def minutos_desde_medianoche(valores):
+    """Array float64 de minutos (NaN si no se reconoce), interpretando cada valor distinto una vez."""
+    codigos, unicos = pd.factorize(pd.Series(valores, dtype=object), use_na_sentinel=True)
+    por_valor = np.array([np.nan if (m := _minuto(v)) is None else m for v in unicos] + [np.nan], dtype=np.float64)
+    return por_valor[codigos]  # El centinela -1 cae en el NaN final
+
+
+def formatear_minutos(minutos):
+    minutos = int(minutos)
+    return f"{minutos // 60 % 24:02d}:{minutos % 60:02d}"
+
+
+def preparar_servicios(df_servicios):
+    """Añade la columna int16 'Minuto Cita' y separa las filas con hora no reconocida.
+
+    Devuelve (df_validos ordenado por hora, df_rechazados con columna 'Motivo').
+    """
+    minutos = minutos_desde_medianoche(df_servicios['Hora Cita'])
+    validos = ~np.isnan(minutos)
+
+    df_rechazados = df_servicios.loc[~validos].copy()
+    df_rechazados['Motivo'] = MOTIVO_HORA_INVALIDA
+
+    df_validos = df_servicios.loc[validos].copy()
+    df_validos[COLUMNA_MINUTOS] = minutos[validos].astype(np.int16)
+    df_validos = df_validos.sort_values(COLUMNA_MINUTOS, kind='stable')
+    return df_validos, df_rechazados
@@ -0,0 +1,212 @@
+"""Lectura de PDFs de servicios de varias páginas.
+
+pdfplumber es intensivo en CPU, así que las páginas se extraen en un pool de
+procesos y cada página se convierte en filas en cuanto llega. Las cabeceras
+repetidas en cada página se descartan y los fallos se informan por página en
+lugar de abortar toda la lectura.
+"""
+
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from .config import COLUMNAS_REQUERIDAS
+from .diagnostico import Diagnostico
+from .horarios import preparar_servicios
+
+MIN_PAGINAS_POOL = 8  # Por debajo, arrancar procesos cuesta más que extraer en serie
+MOTIVO_COLUMNAS = 'Número de columnas distinto al de la cabecera'
+
+_contenido_worker = None
+
+
+def _iniciar_worker(contenido):
+    # El PDF se envía una vez por proceso, no una vez por página
+    global _contenido_worker
+    _contenido_worker = contenido
+
+
+def _extraer_tablas(contenido, numero):
+    import pdfplumber
+
+    with pdfplumber.open(io.BytesIO(contenido), pages=[numero + 1]) as pdf:
+        return [tabla for tabla in pdf.pages[0].extract_tables() if tabla]
+
+
+def _extraer_pagina(numero):
+    try:
+        return numero, _extraer_tablas(_contenido_worker, numero), None
+    except Exception as e:
+        return numero, [], f"{type(e).__name__}: {e}"
+
+
+def contar_paginas(contenido):
+    import pdfplumber
+
+    with pdfplumber.open(io.BytesIO(contenido)) as pdf:
+        return len(pdf.pages)
+
+
+def extraer_paginas(contenido, procesos=None, num_paginas=None):
+    """Genera (numero_pagina, tablas, error) a medida que se extrae cada página (sin orden garantizado)."""
+    num_paginas = contar_paginas(contenido) if num_paginas is None else num_paginas
+    procesos = procesos or os.cpu_count() or 1
+    if procesos <= 1 or num_paginas < MIN_PAGINAS_POOL:
+        _iniciar_worker(contenido)
+        for numero in range(num_paginas):
+            yield _extraer_pagina(numero)
+        return
+
+    # 'spawn' evita hacer fork de un proceso con hilos (el servidor de Streamlit)
+    with ProcessPoolExecutor(
+        max_workers=min(procesos, num_paginas),
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_iniciar_worker,
+        initargs=(contenido,),
+    ) as pool:
+        futuros = [pool.submit(_extraer_pagina, numero) for numero in range(num_paginas)]
+        for futuro in as_completed(futuros):
+            yield futuro.result()
+
+
+def _limpiar_celda(celda):
+    return ' '.join(str(celda).split()) if celda is not None else ''
+
+
+def _es_cabecera(fila):
+    return sum(c in COLUMNAS_REQUERIDAS for c in fila) >= 2
+
+
+class AcumuladorTablas:
+    """Convierte filas de tablas en DataFrame según van llegando las páginas.
+
+    La cabecera es la primera fila que contiene columnas requeridas; las
+    páginas que llegan antes de conocerla esperan en un búfer. Si el PDF no
+    tiene una cabecera reconocible se usa la primera fila de la primera
+    página con tablas, como hacía la lectura original. Las filas con otro
+    número de columnas se guardan aparte por página en `descartadas`.
+    """
+
+    def __init__(self):
+        self.cabecera = None
+        self.filas_por_pagina = {}
+        self.descartadas = {}
+        self._pendientes = {}
+
+    def _convertir(self, numero, tablas):
+        filas, descartadas = [], []
+        for tabla in tablas:
+            for fila in tabla:
+                fila = [_limpiar_celda(c) for c in fila]
+                if fila == self.cabecera or not any(fila):
+                    continue
+                (filas if len(fila) == len(self.cabecera) else descartadas).append(fila)
+        self.filas_por_pagina[numero] = filas
+        if descartadas:
+            self.descartadas[numero] = descartadas
+
+    def anadir(self, numero, tablas):
+        if self.cabecera is None:
+            for tabla in tablas:
+                for fila in tabla:
+                    fila = [_limpiar_celda(c) for c in fila]
+                    if _es_cabecera(fila):
+                        self.cabecera = fila
+                        break
+                if self.cabecera is not None:
+                    break
+        if self.cabecera is None:
+            self._pendientes[numero] = tablas
+            return
+        for pendiente, tablas_pendientes in sorted(self._pendientes.items()):
+            self._convertir(pendiente, tablas_pendientes)
+        self._pendientes.clear()
+        self._convertir(numero, tablas)
+
+    @property
+    def num_filas(self):
+        return sum(len(f) for f in self.filas_por_pagina.values())
+
+    def dataframe(self):
+        con_tablas = [numero for numero, tablas in self._pendientes.items() if tablas]
+        if self.cabecera is None and con_tablas:
+            self.cabecera = [_limpiar_celda(c) for c in self._pendientes[min(con_tablas)][0][0]]
+            for numero, tablas in sorted(self._pendientes.items()):
+                self._convertir(numero, tablas)
+            self._pendientes.clear()
+        if self.cabecera is None:
+            return None
+        filas = [f for numero in sorted(self.filas_por_pagina) for f in self.filas_por_pagina[numero]]
+        return pd.DataFrame(filas, columns=self.cabecera)
+
+    def dataframe_descartadas(self):
+        """Filas descartadas con su 'Página' (desde 1) y 'Motivo', recortadas o rellenadas a la cabecera."""
+        ancho = len(self.cabecera or [])
+        filas = [
+            (fila + [''] * ancho)[:ancho] + [numero + 1, MOTIVO_COLUMNAS]
+            for numero in sorted(self.descartadas) for fila in self.descartadas[numero]
+        ]
+        df = pd.DataFrame(filas, columns=list(self.cabecera or []) + ['Página', 'Motivo'])
+        return df.astype({'Página': 'Int64'})  # Entero con huecos al unirse a los rechazados por hora
+
+
+def leer_pdf(contenido, procesos=None, al_progresar=None):
+    """Lee todas las tablas de todas las páginas.
+
+    Devuelve (df, errores, df_descartadas) donde df es None si no hay
+    tablas, errores es una lista de (pagina, mensaje) con numeración desde 1
+    y df_descartadas las filas con otro número de columnas que la cabecera
+    (ver `AcumuladorTablas.dataframe_descartadas`). `al_progresar` recibe
+    (paginas_hechas, total_paginas, filas_leidas) tras cada página.
+    """
+    acumulador = AcumuladorTablas()
+    errores = []
+    total = contar_paginas(contenido)
+    for hechas, (numero, tablas, error) in enumerate(extraer_paginas(contenido, procesos, total), 1):
+        if error is not None:
+            errores.append((numero + 1, error))
+        else:
+            acumulador.anadir(numero, tablas)
+        if al_progresar is not None:
+            al_progresar(hechas, total, acumulador.num_filas)
+    return acumulador.dataframe(), sorted(errores), acumulador.dataframe_descartadas()
+
+
+def cargar_servicios(contenido, extension, al_progresar=None, procesos=None, diagnostico=None):
+    """Lee un Excel o PDF de servicios y lo prepara para optimizar.
+
+    Devuelve (df_validos, df_rechazados, columnas_faltantes, errores_pagina);
+    df_validos es None si el PDF no tiene tablas. df_rechazados lleva el
+    'Motivo' de cada fila: hora no reconocida o, en PDFs, columnas que no
+    cuadran con la cabecera.
+    """
+    diagnostico = diagnostico if diagnostico is not None else Diagnostico()
+    instante = time.perf_counter()
+    errores_pagina = []
+    df_descartadas = None
+    if extension == 'pdf':
+        df, errores_pagina, df_descartadas = leer_pdf(contenido, procesos=procesos, al_progresar=al_progresar)
+        diagnostico.contar('paginas_con_error', len(errores_pagina))
+        if df is None:
+            diagnostico.medir('ingesta.lectura', instante)
+            return None, None, [], errores_pagina
+    else:
+        df = pd.read_excel(io.BytesIO(contenido))
+    instante = diagnostico.medir('ingesta.lectura', instante)
+    diagnostico.contar('filas_leidas', len(df))
+
+    faltantes = [c for c in COLUMNAS_REQUERIDAS if c not in df.columns]
+    if faltantes:
+        diagnostico.contar('columnas_faltantes', len(faltantes))
+        return df, None, faltantes, errores_pagina
+
+    df, df_rechazados = preparar_servicios(df)
+    if df_descartadas is not None and len(df_descartadas):
+        df_rechazados = pd.concat([df_descartadas, df_rechazados], ignore_index=True)
+    diagnostico.rechazados.update(df_rechazados['Motivo'].value_counts().to_dict())
+    diagnostico.medir('ingesta.preparacion', instante)
+    return df, df_rechazados, [], errores_pagina
@@ -0,0 +1,136 @@
+"""Mapa de rutas del día (folium).
+
+Las rutas se precalculan como GeoJSON, una FeatureCollection por vehículo con
+la línea de la ruta y sus paradas. Las coordenadas se redondean y los puntos
+repetidos seguidos se eliminan. El mapa tiene una capa activable por
+vehículo, las paradas agrupadas con FastMarkerCluster (los marcadores se
+crean en el navegador a partir de un array, no uno a uno en el HTML) y las
+bases destacadas. folium se importa solo al dibujar.
+"""
+
+from .config import BASES
+from .geocodificacion import coordenadas
+
+COLORES = [
+    '#e6194b', '#3cb44b', '#4363d8', '#f58231', '#911eb4', '#42d4f4', '#f032e6', '#bfef45',
+    '#469990', '#9a6324', '#800000', '#808000', '#000075', '#a9a9a9', '#fabed4', '#ffd8b1',
+]
+DECIMALES = 5  # ~1 m: suficiente para el mapa y reduce el tamaño del GeoJSON
+MAX_CAPAS = 60  # A partir de aquí los vehículos restantes comparten una sola capa
+
+
+def _punto(lat, lon):
+    return [round(float(lon), DECIMALES), round(float(lat), DECIMALES)]
+
+
+def geojson_rutas(df_resultado, flota=None, geocodificar=coordenadas):
+    """{vehículo: FeatureCollection} con la ruta (LineString) y las paradas (Point) de cada vehículo asignado."""
+    asignados = df_resultado[df_resultado['Vehículo'] != 'SIN ASIGNAR']
+    bases = {v['id']: v.get('base', 'Soria') for v in flota or []}
+
+    # Una geocodificación por dirección distinta
+    direcciones = set(asignados['Recogida'].astype(str)) | set(asignados['Destino'].astype(str))
+    puntos = {d: _punto(*geocodificar(d)) for d in direcciones}
+
+    rutas = {}
+    columnas = ['Vehículo', 'Paciente', 'Hora Cita', 'Inicio Real', 'Recogida', 'Destino', 'Tipo']
+    for vehiculo, servicios in asignados[columnas].groupby('Vehículo', sort=False):
+        base = BASES.get(bases.get(vehiculo, 'Soria'), BASES['Soria'])
+        linea = [_punto(base['lat'], base['lon'])]
+        paradas = []
+        for fila in servicios.itertuples(index=False, name=None):
+            _, paciente, hora_cita, inicio_real, recogida, destino, tipo = fila  # En el orden de `columnas`
+            for parada, direccion in (('Recogida', recogida), ('Destino', destino)):
+                punto = puntos[str(direccion)]
+                if punto != linea[-1]:
+                    linea.append(punto)
+                paradas.append({
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': punto},
+                    'properties': {
+                        'parada': parada, 'direccion': str(direccion), 'paciente': str(paciente),
+                        'hora_cita': str(hora_cita), 'inicio_real': str(inicio_real), 'tipo': str(tipo),
+                    },
+                })
+        rutas[vehiculo] = {
+            'type': 'FeatureCollection',
+            'features': [{
+                'type': 'Feature',
+                'geometry': {'type': 'LineString', 'coordinates': linea},
+                'properties': {'vehiculo': str(vehiculo), 'servicios': len(servicios)},
+            }] + paradas,
+        }
+    return rutas
+
+
+# Marcadores creados en el navegador a partir de filas [lat, lon, texto, color, opacidad]
+_CREAR_PARADA = """
+function (fila) {
+    var marcador = L.circleMarker(new L.LatLng(fila[0], fila[1]),
+        {radius: 5, color: fila[3], fillColor: fila[3], fill: true, fillOpacity: fila[4], weight: 1});
+    marcador.bindTooltip(fila[2]);
+    return marcador;
+}
+"""
+
+
+def _filas_paradas(vehiculo, paradas, color):
+    filas = []
+    for parada in paradas:
+        lon, lat = parada['geometry']['coordinates']
+        p = parada['properties']
+        texto = (f"{vehiculo} · {p['parada']} {p['direccion']} · {p['paciente']} ({p['tipo']}) · "
+                 f"cita {p['hora_cita']}, inicio {p['inicio_real']}")
+        filas.append([lat, lon, texto, color, 0.9 if p['parada'] == 'Recogida' else 0.3])
+    return filas
+
+
+def crear_mapa(rutas, max_capas=MAX_CAPAS):
+    """folium.Map con una capa por vehículo (las primeras `max_capas`), paradas agrupadas y las bases."""
+    import folium
+    from folium.plugins import FastMarkerCluster
+
+    centro = BASES['Soria']
+    mapa = folium.Map(location=[centro['lat'], centro['lon']], zoom_start=9, prefer_canvas=True, tiles='OpenStreetMap')
+
+    capa_bases = folium.FeatureGroup(name='🏥 Bases', show=True)
+    for nombre, base in BASES.items():
+        nota = ' (solo tarde)' if base.get('solo_tarde') else ''
+        folium.Marker(
+            [base['lat'], base['lon']], tooltip=f"Base {nombre}{nota}",
+            icon=folium.Icon(color='red', icon='plus-sign'),
+        ).add_to(capa_bases)
+    capa_bases.add_to(mapa)
+
+    # Una capa por vehículo; a partir de `max_capas`, todos los demás juntos en una sola
+    capas = []
+    resto_lineas, resto_paradas = [], []
+    for n, (vehiculo, coleccion) in enumerate(rutas.items()):
+        color = COLORES[n % len(COLORES)]
+        linea, *paradas = coleccion['features']
+        linea = dict(linea, properties=dict(linea['properties'], color=color))
+        if n < max_capas:
+            capas.append((f"🚑 {vehiculo}", True, [linea], _filas_paradas(vehiculo, paradas, color)))
+        else:
+            resto_lineas.append(linea)
+            resto_paradas += _filas_paradas(vehiculo, paradas, color)
+    if resto_lineas:
+        capas.append((f"🚑 Otros {len(resto_lineas)} vehículos", False, resto_lineas, resto_paradas))
+
+    for nombre, visible, lineas, filas in capas:
+        capa = folium.FeatureGroup(name=nombre, show=visible)
+        folium.GeoJson(
+            {'type': 'FeatureCollection', 'features': lineas},
+            style_function=lambda linea: {'color': linea['properties']['color'], 'weight': 3, 'opacity': 0.8},
+            tooltip=folium.GeoJsonTooltip(['vehiculo', 'servicios'], aliases=['Vehículo', 'Servicios']),
+        ).add_to(capa)
+        FastMarkerCluster(filas, callback=_CREAR_PARADA, options={'disableClusteringAtZoom': 13}).add_to(capa)
+        capa.add_to(mapa)
+
+    folium.LayerControl(collapsed=len(capas) > 10).add_to(mapa)
+    return mapa
+
+
+def mapa_html(df_resultado, flota=None, max_capas=MAX_CAPAS):
+    """HTML autónomo del mapa, listo para incrustar o guardar."""
+    return crear_mapa(geojson_rutas(df_resultado, flota), max_capas).get_root().render()
@@ -0,0 +1,257 @@
+# ==========================================
+# ALGORITMO DE OPTIMIZACIÓN MEJORADO
+# ==========================================
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from .agrupacion import agrupar_servicios, desagrupar
+from .busqueda_local import mejorar_plan
+from .config import DURACION_SERVICIO, JORNADA_MAX, MARGEN_TIEMPO, puede_llevar
+from .diagnostico import (
+    Diagnostico, MOTIVO_ACOMPANANTE, MOTIVO_JORNADA, MOTIVO_MEJORA, MOTIVO_SIN_COMPATIBLE, MOTIVO_VENTANA,
+)
+from .distancias import IndiceBases, MatrizTiempos
+from .geocodificacion import coordenadas
+from .horarios import COLUMNA_MINUTOS, formatear_minutos, preparar_servicios
+from .vrptw import resolver_vrptw
+
+INDICE_BASES = IndiceBases()
+HORIZONTE_FORMATO = 2 * 24 * 60  # Horas formateadas de antemano (hasta el día siguiente)
+
+# Prioridad del voraz empaquetada en un int64: tiempo trabajado | servicios (invertidos) | orden en la flota
+BITS_ORDEN = 24
+BITS_SERVICIOS = 12
+MAX_SERVICIOS = (1 << BITS_SERVICIOS) - 1
+SIN_CANDIDATO = np.iinfo(np.int64).max
+
+
+def asignar_base_mas_cercana(ubicacion):
+    lat, lon = coordenadas(ubicacion)
+    return INDICE_BASES.mas_cercana(lat, lon)
+
+
+def _motivo_sin_asignar(compatibles, llegan_a_tiempo):
+    # Del filtro más general al más concreto: tipo, ventana y, si no, jornada
+    if not compatibles.any():
+        return MOTIVO_SIN_COMPATIBLE
+    if not (compatibles & llegan_a_tiempo).any():
+        return MOTIVO_VENTANA
+    return MOTIVO_JORNADA
+
+
+def _columna_con_huecos(valores, asignado, vacio=np.nan):
+    # Valores solo en las filas asignadas; las SIN ASIGNAR quedan vacías
+    return np.where(asignado, valores, vacio) if not asignado.all() else valores
+
+
+def optimizar_rutas_multiple_servicios(df_servicios, flota, jornada_max=JORNADA_MAX, diagnostico=None):
+    """Algoritmo voraz: cada servicio, en orden de cita, al vehículo compatible menos cargado que llegue a tiempo.
+
+    Servicios y vehículos se guardan en columnas NumPy y cada servicio elige
+    vehículo con una sola pasada vectorizada sobre la flota; la flota recibida
+    no se modifica. Devuelve (df_resultado, flota) con una fila por servicio y una
+    copia de cada vehículo con sus `servicios_asignados`. Si se pasa
+    `diagnostico`, registra el tiempo de cada etapa y el motivo de cada
+    servicio sin asignar.
+    """
+    diagnostico = diagnostico if diagnostico is not None else Diagnostico()
+    instante = time.perf_counter()
+    
+    # Hora de cita en minutos, ordenada (si no viene ya preparada)
+    if COLUMNA_MINUTOS not in df_servicios.columns:
+        df_servicios, _ = preparar_servicios(df_servicios)
+    else:
+        df_servicios = df_servicios.sort_values(COLUMNA_MINUTOS, kind='stable')
+    num_servicios = len(df_servicios)
+    
+    # Matriz de tiempos de viaje entre todas las ubicaciones del día
+    matriz = MatrizTiempos.desde_servicios(df_servicios)
+    recogidas = matriz.indices_de(df_servicios['Recogida'])
+    destinos = matriz.indices_de(df_servicios['Destino'])
+    tiempos = matriz.minutos.astype(np.int32)
+    instante = diagnostico.medir('optimizacion.matriz', instante)
+    diagnostico.contar('puntos_matriz', len(matriz))
+    
+    # Base de cada servicio (una consulta al índice por punto distinto)
+    bases = INDICE_BASES.mas_cercanas(matriz.lats, matriz.lons)[recogidas]
+    instante = diagnostico.medir('optimizacion.bases', instante)
+    
+    # Tipos de paciente como códigos enteros
+    tipos = df_servicios['Tipo'].astype(object).where(df_servicios['Tipo'].notna(), 'Sentado')
+    codigos_tipo, tipos_unicos = pd.factorize(tipos)
+    codigos_tipo = codigos_tipo.tolist()
+    
+    # Estado de la flota en columnas: un vehículo es una posición en cada array
+    num_vehiculos = len(flota)
+    bases_vehiculos = [v.get('base', 'Soria') for v in flota]
+    tipos_vehiculos = [v['tipo'] for v in flota]
+    ubicaciones = np.array([matriz.indice(base) for base in bases_vehiculos], dtype=np.int64)
+    disponibles = np.zeros(num_vehiculos, dtype=np.int64)  # Minutos; la entrada se ajusta al primer servicio
+    trabajados_vehiculo = np.zeros(num_vehiculos, dtype=np.int64)
+    servicios_vehiculo = np.zeros(num_vehiculos, dtype=np.int64)
+    compatibles = [np.array([puede_llevar(t, tipo) for t in tipos_vehiculos], dtype=bool) for tipo in tipos_unicos]
+    
+    # Prioridad (menos tiempo trabajado, más servicios, orden en la flota) en un único entero
+    claves = np.arange(num_vehiculos, dtype=np.int64) + (MAX_SERVICIOS << BITS_ORDEN)
+    
+    # Resultado por servicio: vehículo (-1 = sin asignar), inicio, viaje y jornada acumulada
+    vehiculo_de = np.full(num_servicios, -1, dtype=np.int32)
+    inicios = np.zeros(num_servicios, dtype=np.int32)
+    viajes = np.zeros(num_servicios, dtype=np.int32)
+    origenes = np.zeros(num_servicios, dtype=np.int32)
+    trabajados = np.zeros(num_servicios, dtype=np.int32)
+    
+    minutos = df_servicios[COLUMNA_MINUTOS].to_numpy(dtype=np.int64)
+    minutos_lista, recogidas_lista, destinos_lista = minutos.tolist(), recogidas.tolist(), destinos.tolist()
+    tiempos_hasta = np.ascontiguousarray(tiempos.T)  # Fila r: tiempo desde cada punto hasta r
+    
+    for i in range(num_servicios if num_vehiculos else 0):
+        minuto_cita = minutos_lista[i]
+        ventana_inicio = minuto_cita - MARGEN_TIEMPO
+        ventana_fin = minuto_cita + MARGEN_TIEMPO
+        
+        # Tiempo desde la base o desde el destino del último servicio, para toda la flota a la vez
+        viaje = tiempos_hasta[recogidas_lista[i]].take(ubicaciones)
+        
+        # Vehículos compatibles que llegan a tiempo sin superar la jornada
+        factibles = compatibles[codigos_tipo[i]] & (disponibles + viaje <= ventana_fin)
+        factibles &= trabajados_vehiculo + viaje <= jornada_max - DURACION_SERVICIO
+        
+        # El primero por prioridad es el de menor clave entre los factibles
+        orden = int(np.where(factibles, claves, SIN_CANDIDATO).argmin())
+        if not factibles[orden]:
+            diagnostico.sin_asignar[_motivo_sin_asignar(compatibles[codigos_tipo[i]], disponibles + viaje <= ventana_fin)] += 1
+            continue
+        
+        tiempo_viaje = int(viaje[orden])
+        inicio_real = max(int(disponibles[orden]) + tiempo_viaje, ventana_inicio)
+        nuevo_tiempo = int(trabajados_vehiculo[orden]) + tiempo_viaje + DURACION_SERVICIO
+        
+        vehiculo_de[i] = orden
+        inicios[i] = inicio_real
+        viajes[i] = tiempo_viaje
+        origenes[i] = ubicaciones[orden]
+        trabajados[i] = nuevo_tiempo
+        
+        disponibles[orden] = inicio_real + DURACION_SERVICIO
+        ubicaciones[orden] = destinos_lista[i]
+        trabajados_vehiculo[orden] = nuevo_tiempo
+        servicios_vehiculo[orden] += 1
+        claves[orden] = ((nuevo_tiempo << BITS_SERVICIOS) + MAX_SERVICIOS - int(servicios_vehiculo[orden])) << BITS_ORDEN | orden
+    
+    if not num_vehiculos:
+        diagnostico.sin_asignar[MOTIVO_SIN_COMPATIBLE] += num_servicios
+    instante = diagnostico.medir('optimizacion.asignacion', instante)
+    
+    # ==========================================
+    # MATERIALIZACIÓN DEL RESULTADO (una sola vez)
+    # ==========================================
+    
+    asignado = vehiculo_de >= 0
+    posicion = np.maximum(vehiculo_de, 0)
+    ids = np.array([v['id'] for v in flota] or [None], dtype=object)
+    conductores = np.array([v.get('conductor', 'N/A') for v in flota] or [None], dtype=object)
+    horas = np.array([formatear_minutos(m) for m in range(HORIZONTE_FORMATO)], dtype=object)
+    fines = np.minimum(inicios + DURACION_SERVICIO, HORIZONTE_FORMATO - 1)
+    
+    df_resultado = pd.DataFrame({
+        'Vehículo': np.where(asignado, ids[posicion], 'SIN ASIGNAR'),
+        'Conductor': np.where(asignado, conductores[posicion], 'N/A'),
+        'Hora Cita': df_servicios['Hora Cita'].to_numpy(),
+        COLUMNA_MINUTOS: minutos,
+        'Inicio Real': _columna_con_huecos(horas[np.minimum(inicios, HORIZONTE_FORMATO - 1)], asignado),
+        'Fin Servicio': _columna_con_huecos(horas[fines], asignado),
+        'Paciente': df_servicios['Paciente'].to_numpy(),
+        'Recogida': df_servicios['Recogida'].to_numpy(),
+        'Destino': df_servicios['Destino'].to_numpy(),
+        'Tipo': tipos.to_numpy(),
+        'Base': _columna_con_huecos(bases, asignado),
+        'Tiempo Viaje': _columna_con_huecos(viajes.astype(np.int64), asignado),
+        'Km Viaje': _columna_con_huecos(
+            np.round(matriz.distancias_km[origenes, recogidas].astype(np.float64), 1), asignado
+        ),
+        'Horas Trabajadas': _columna_con_huecos(np.round(trabajados / 60, 2), asignado),
+    })
+    if 'Viaje' in df_servicios.columns:
+        # Id del traslado compartido (ver agrupacion), que desagrupar necesita
+        df_resultado['Viaje'] = df_servicios['Viaje'].to_numpy()
+    
+    # Copia de la flota con los servicios de cada vehículo, en orden de cita
+    servicios_por_vehiculo = [[] for _ in flota]
+    if asignado.any():
+        for orden, servicio in zip(vehiculo_de[asignado].tolist(), df_resultado[asignado].to_dict('records')):
+            servicios_por_vehiculo[orden].append(servicio)
+    flota_resultado = [
+        dict(v, base=base, ubicacion=int(ubicacion), disponible_desde=int(disponible),
+             tiempo_trabajado=int(trabajado), servicios_asignados=servicios)
+        for v, base, ubicacion, disponible, trabajado, servicios in zip(
+            flota, bases_vehiculos, ubicaciones, disponibles, trabajados_vehiculo, servicios_por_vehiculo
+        )
+    ]
+    
+    diagnostico.medir('optimizacion.resultado', instante)
+    diagnostico.contar('servicios', num_servicios)
+    diagnostico.contar('asignados', int(asignado.sum()))
+    diagnostico.contar('vehiculos_usados', int((servicios_vehiculo > 0).sum()))
+    
+    return df_resultado, flota_resultado
+
+
+def _resolver(df_servicios, flota, motor, jornada_max, diagnostico, procesos, opciones_vrptw):
+    if motor == 'Zonas':
+        from .descomposicion import optimizar_por_zonas  # importa este módulo
+
+        return optimizar_por_zonas(df_servicios, flota, jornada_max, procesos, diagnostico=diagnostico) + ('Zonas',)
+    if motor == 'VRPTW':
+        try:
+            resultado = resolver_vrptw(df_servicios, [v.copy() for v in flota], jornada_max=jornada_max,
+                                       diagnostico=diagnostico, **opciones_vrptw)
+        except ImportError:
+            diagnostico.contar('vrptw_no_disponible')
+            resultado = None
+        if resultado is not None:
+            return resultado + ('VRPTW',)
+        diagnostico.contar('vrptw_sin_solucion')
+    return optimizar_rutas_multiple_servicios(df_servicios, flota, jornada_max, diagnostico) + ('Voraz',)
+
+
+def optimizar_rutas(df_servicios, flota, motor='Voraz', jornada_max=JORNADA_MAX, diagnostico=None, procesos=None,
+                    agrupar=False, mejorar_segundos=0, **opciones_vrptw):
+    """Devuelve (df_resultado, flota, motor_usado); el VRPTW recurre al voraz si no encuentra solución.
+
+    El motor 'Zonas' resuelve cada base y bloque horario por separado (en
+    `procesos` procesos) y repara después los SIN ASIGNAR. Con `agrupar`,
+    los pacientes compatibles comparten viaje (ver `agrupacion`). Con
+    `mejorar_segundos`, el resultado pasa después por la búsqueda local
+    entre rutas (ver `busqueda_local`) durante ese tiempo.
+    Con un `diagnostico` con perfilador, la llamada al motor se perfila.
+    """
+    diagnostico = diagnostico if diagnostico is not None else Diagnostico()
+    with diagnostico.etapa('optimizacion'), diagnostico.perfilar('optimizacion'):
+        if agrupar:
+            df_viajes, viajes = agrupar_servicios(df_servicios, {v['tipo'] for v in flota}, diagnostico=diagnostico)
+            df_resultado, flota, motor_usado = _resolver(
+                df_viajes, flota, motor, jornada_max, diagnostico, procesos, opciones_vrptw
+            )
+            viajes_sin_asignar = int((df_resultado['Vehículo'] == 'SIN ASIGNAR').sum())
+            df_resultado, flota = desagrupar(df_resultado, flota, viajes)
+            # El motor da un motivo por viaje; el resto de pacientes de cada viaje se cuentan aparte
+            acompanantes = int((df_resultado['Vehículo'] == 'SIN ASIGNAR').sum()) - viajes_sin_asignar
+            if acompanantes:
+                diagnostico.sin_asignar[MOTIVO_ACOMPANANTE] += acompanantes
+        else:
+            df_resultado, flota, motor_usado = _resolver(
+                df_servicios, flota, motor, jornada_max, diagnostico, procesos, opciones_vrptw
+            )
+    if mejorar_segundos:
+        df_resultado, flota, _ = mejorar_plan(df_resultado, flota, mejorar_segundos, jornada_max=jornada_max,
+                                              diagnostico=diagnostico)
+        # Los motivos del motor dejan de valer tras la búsqueda local, que coloca parte de los pendientes
+        diagnostico.sin_asignar.clear()
+        pendientes = int((df_resultado['Vehículo'] == 'SIN ASIGNAR').sum())
+        if pendientes:
+            diagnostico.sin_asignar[MOTIVO_MEJORA] += pendientes
+    return df_resultado, flota, motor_usado
@@ -0,0 +1,184 @@
+"""Tiempos de viaje por carretera desde un servicio de tablas tipo OSRM.
+
+La matriz del día se pide en bloques de `tamano_lote` × `tamano_lote`
+puntos (una llamada /table por bloque), todos a la vez sobre una sola
+sesión aiohttp con un máximo de `max_conexiones` conexiones abiertas. Cada
+bloque se guarda en una caché LRU en memoria; los puntos se ordenan antes de
+trocear la matriz, así que dos días con los mismos pueblos reutilizan los
+bloques. Si un bloque falla o el servicio no encuentra ruta, esas celdas se
+calculan con el proveedor haversine y el fallo queda en `errores`.
+
+aiohttp se importa solo si hay que pedir algo a la red; si no está
+instalado, toda la matriz sale del proveedor haversine con un aviso.
+"""
+
+import asyncio
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .config import TIEMPO_MINIMO_VIAJE
+from .distancias import ProveedorHaversine
+
+TAMANO_LOTE = 100  # Puntos por lado de cada bloque (el límite habitual de OSRM es max-table-size=100)
+MAX_CONEXIONES = 4
+MAX_BLOQUES_CACHE = 256
+TIMEOUT_SEGUNDOS = 30
+AVISO_SIN_AIOHTTP = "RUTAS_OSRM_URL está definida pero aiohttp no está instalado: se usan tiempos haversine"
+
+
+class ProveedorOSRM:
+    """Proveedor de tiempos (ver `distancias`) sobre el servicio /table/v1 de OSRM en `url`."""
+
+    def __init__(self, url, perfil='driving', tamano_lote=TAMANO_LOTE, max_conexiones=MAX_CONEXIONES,
+                 max_bloques_cache=MAX_BLOQUES_CACHE, timeout=TIMEOUT_SEGUNDOS, respaldo=None,
+                 tiempo_minimo=TIEMPO_MINIMO_VIAJE):
+        self.url = url.rstrip('/')
+        self.perfil = perfil
+        self.tamano_lote = tamano_lote
+        self.max_conexiones = max_conexiones
+        self.max_bloques_cache = max_bloques_cache
+        self.timeout = timeout
+        self.respaldo = respaldo if respaldo is not None else ProveedorHaversine()
+        self.tiempo_minimo = tiempo_minimo
+        self.errores = []
+        self.peticiones = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ------------------------------------------
+    # Caché LRU de bloques
+    # ------------------------------------------
+
+    def _de_cache(self, clave):
+        with self._lock:
+            if clave not in self._cache:
+                return None
+            self._cache.move_to_end(clave)
+            return self._cache[clave]
+
+    def _a_cache(self, clave, bloque):
+        with self._lock:
+            self._cache[clave] = bloque
+            self._cache.move_to_end(clave)
+            while len(self._cache) > self.max_bloques_cache:
+                self._cache.popitem(last=False)
+
+    # ------------------------------------------
+    # Peticiones
+    # ------------------------------------------
+
+    async def _pedir(self, sesion, origenes, destinos):
+        """(km, minutos) de un bloque; las celdas sin ruta quedan como NaN."""
+        puntos = ';'.join(f"{lon:.6f},{lat:.6f}" for lat, lon in origenes + destinos)
+        parametros = {
+            'sources': ';'.join(str(i) for i in range(len(origenes))),
+            'destinations': ';'.join(str(i) for i in range(len(origenes), len(origenes) + len(destinos))),
+            'annotations': 'duration,distance',
+        }
+        self.peticiones += 1
+        async with sesion.get(f"{self.url}/table/v1/{self.perfil}/{puntos}", params=parametros) as respuesta:
+            respuesta.raise_for_status()
+            datos = await respuesta.json(content_type=None)
+        if datos.get('code') != 'Ok':
+            raise ValueError(f"OSRM respondió {datos.get('code')}: {datos.get('message', '')}")
+        segundos = np.array(datos['durations'], dtype=np.float64)
+        metros = np.array(datos.get('distances') or np.full(segundos.shape, np.nan), dtype=np.float64)
+        minutos = np.maximum(np.ceil(segundos / 60), self.tiempo_minimo)
+        return (metros / 1000).astype(np.float32), minutos.astype(np.float32)
+
+    def _completar(self, bloque, origenes, destinos):
+        # Celdas sin dato (sin ruta, o el bloque entero si la petición falló) -> respaldo
+        km, minutos = bloque
+        huecos = np.isnan(km) | np.isnan(minutos)
+        if huecos.any():
+            (lats_o, lons_o), (lats_d, lons_d) = zip(*origenes), zip(*destinos)
+            km_respaldo, minutos_respaldo = self.respaldo.tabla(lats_o, lons_o, lats_d, lons_d)
+            km = np.where(huecos, km_respaldo, km).astype(np.float32)
+            minutos = np.where(huecos, minutos_respaldo, minutos).astype(np.float32)
+        return km, minutos
+
+    def _respaldo(self, clave):
+        # Bloque entero con el respaldo; no se guarda en caché para volver a pedirlo la próxima vez
+        origenes, destinos = list(clave[0]), list(clave[1])
+        vacio = np.full((len(origenes), len(destinos)), np.nan, dtype=np.float32)
+        return self._completar((vacio, vacio), origenes, destinos)
+
+    async def _tabla_async(self, origenes, destinos):
+        lote = self.tamano_lote
+        km = np.empty((len(origenes), len(destinos)), dtype=np.float32)
+        minutos = np.empty_like(km)
+        pendientes = []
+        for i in range(0, len(origenes), lote):
+            for j in range(0, len(destinos), lote):
+                clave = (tuple(origenes[i:i + lote]), tuple(destinos[j:j + lote]))
+                bloque = self._de_cache(clave)
+                if bloque is None:
+                    pendientes.append((i, j, clave))
+                else:
+                    km[i:i + lote, j:j + lote], minutos[i:i + lote, j:j + lote] = bloque
+        if not pendientes:
+            return km, minutos
+
+        try:
+            import aiohttp
+        except ImportError:
+            if AVISO_SIN_AIOHTTP not in self.errores:
+                self.errores.append(AVISO_SIN_AIOHTTP)
+                warnings.warn(AVISO_SIN_AIOHTTP, RuntimeWarning)
+            for i, j, clave in pendientes:
+                km[i:i + lote, j:j + lote], minutos[i:i + lote, j:j + lote] = self._respaldo(clave)
+            return km, minutos
+
+        limite = asyncio.Semaphore(self.max_conexiones)
+        conector = aiohttp.TCPConnector(limit=self.max_conexiones)
+        async with aiohttp.ClientSession(connector=conector,
+                                         timeout=aiohttp.ClientTimeout(total=self.timeout)) as sesion:
+
+            async def resolver(i, j, clave):
+                origenes_bloque, destinos_bloque = list(clave[0]), list(clave[1])
+                try:
+                    async with limite:
+                        bloque = await self._pedir(sesion, origenes_bloque, destinos_bloque)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+                    self.errores.append(f"{type(e).__name__}: {e}")
+                    km[i:i + lote, j:j + lote], minutos[i:i + lote, j:j + lote] = self._respaldo(clave)
+                    return
+                bloque = self._completar(bloque, origenes_bloque, destinos_bloque)
+                self._a_cache(clave, bloque)
+                km[i:i + lote, j:j + lote], minutos[i:i + lote, j:j + lote] = bloque
+
+            await asyncio.gather(*(resolver(*pendiente) for pendiente in pendientes))
+        return km, minutos
+
+    def _ejecutar(self, corrutina):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(corrutina)
+        # Ya hay un bucle en marcha en este hilo (p. ej. un notebook): se resuelve en otro hilo
+        with ThreadPoolExecutor(max_workers=1) as hilo:
+            return hilo.submit(asyncio.run, corrutina).result()
+
+    # ------------------------------------------
+    # Interfaz de proveedor
+    # ------------------------------------------
+
+    def tabla(self, lats_origen, lons_origen, lats_destino, lons_destino):
+        origenes = [(float(lat), float(lon)) for lat, lon in zip(lats_origen, lons_origen)]
+        destinos = [(float(lat), float(lon)) for lat, lon in zip(lats_destino, lons_destino)]
+        if not origenes or not destinos:
+            vacio = np.zeros((len(origenes), len(destinos)), dtype=np.float32)
+            return vacio, vacio.copy()
+        return self._ejecutar(self._tabla_async(origenes, destinos))
+
+    def matriz(self, lats, lons):
+        # Orden estable de los puntos para que los bloques (y la caché) no dependan del orden de llegada
+        lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+        orden = np.lexsort((lons, lats))
+        km, minutos = self.tabla(lats[orden], lons[orden], lats[orden], lons[orden])
+        inversa = np.argsort(orden)
+        return km[np.ix_(inversa, inversa)], minutos[np.ix_(inversa, inversa)]
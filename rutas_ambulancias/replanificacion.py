@@ -0,0 +1,478 @@
+"""Replanificación incremental durante el día.
+
+Parte de un plan ya calculado (df_resultado + flota) y aplica cambios
+sueltos —alta, cancelación o cambio de hora de un servicio— reparando solo
+las rutas afectadas en lugar de volver a optimizar el día entero.
+
+Los servicios cuya salida hacia la recogida ya ha pasado (`ahora`) quedan
+fijos: nunca se reasignan ni cambian de hora, y los conductores en ruta solo
+pueden recibir servicios nuevos detrás de lo que ya tienen en marcha.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from .config import BASES, DURACION_SERVICIO, JORNADA_MAX, MARGEN_TIEMPO, MEJORA_SEGUNDOS, puede_llevar
+from .diagnostico import Diagnostico
+from .distancias import IndiceBases, MatrizTiempos, proveedor_por_defecto
+from .geocodificacion import coordenadas
+from .horarios import COLUMNA_MINUTOS, formatear_minutos, minutos_desde_medianoche
+
+SIN_ASIGNAR = 'SIN ASIGNAR'
+
+
+def _minutos_hhmm(texto):
+    # 'HH:MM' tal como lo escribe formatear_minutos
+    horas, minutos = str(texto).split(':')[:2]
+    return int(horas) * 60 + int(minutos)
+
+
+def clave_servicio(servicio):
+    """Identificador de un servicio dentro del día: (paciente, minuto de la cita)."""
+    return str(servicio['Paciente']), int(servicio[COLUMNA_MINUTOS])
+
+
+class PlanIncremental:
+    """Plan del día modificable servicio a servicio.
+
+    Cada operación devuelve un dict con la diferencia por vehículo afectado
+    (`vehiculos`: id -> filas añadidas/eliminadas/reprogramadas), el vehículo
+    que recibe el servicio (`asignado_a`, None si queda sin asignar) y los
+    milisegundos empleados. La flota se modifica en el sitio, como en el
+    optimizador.
+    """
+
+    def __init__(self, df_resultado, flota, ahora=None, jornada_max=JORNADA_MAX, geocodificar=coordenadas,
+                 proveedor=None):
+        self.flota = flota
+        self.ahora = ahora
+        self.jornada_max = jornada_max
+        self._geocodificar = geocodificar
+        self._proveedor = proveedor if proveedor is not None else proveedor_por_defecto()
+        self._puntos = {}
+        self._tiempos = {}
+        self._bases = IndiceBases()
+        self.sin_asignar = [
+            fila for fila in df_resultado.to_dict('records') if fila['Vehículo'] == SIN_ASIGNAR
+        ]
+        # Las ubicaciones ya conocidas se piden de una vez; las nuevas, por pares bajo demanda
+        ubicaciones = list(BASES)
+        if not df_resultado.empty:
+            ubicaciones += df_resultado['Recogida'].astype(str).tolist() + df_resultado['Destino'].astype(str).tolist()
+        self._matriz = MatrizTiempos(ubicaciones, geocodificar, self._proveedor)
+
+    # ------------------------------------------
+    # Tiempos de viaje (mismo proveedor que MatrizTiempos)
+    # ------------------------------------------
+
+    def _punto(self, ubicacion):
+        ubicacion = str(ubicacion)
+        if ubicacion not in self._puntos:
+            self._puntos[ubicacion] = self._geocodificar(ubicacion)
+        return self._puntos[ubicacion]
+
+    def _viaje(self, origen, destino):
+        """(minutos, km) entre dos direcciones."""
+        clave = (str(origen), str(destino))
+        if clave not in self._tiempos:
+            i, j = self._matriz.indices.get(clave[0]), self._matriz.indices.get(clave[1])
+            if i is not None and j is not None:
+                self._tiempos[clave] = (int(self._matriz.minutos[i, j]), float(self._matriz.distancias_km[i, j]))
+            elif self._punto(origen) == self._punto(destino):
+                self._tiempos[clave] = (0, 0.0)
+            else:
+                (lat_a, lon_a), (lat_b, lon_b) = self._punto(origen), self._punto(destino)
+                km, minutos = self._proveedor.tabla([lat_a], [lon_a], [lat_b], [lon_b])
+                self._tiempos[clave] = (int(minutos[0, 0]), float(km[0, 0]))
+        return self._tiempos[clave]
+
+    # ------------------------------------------
+    # Simulación de rutas
+    # ------------------------------------------
+
+    def _fijo(self, servicio):
+        # Fijo si el vehículo ya salió hacia la recogida
+        if self.ahora is None:
+            return False
+        return _minutos_hhmm(servicio['Inicio Real']) - servicio.get('Tiempo Viaje', 0) <= self.ahora
+
+    def _num_fijos(self, vehiculo):
+        fijos = 0
+        for servicio in vehiculo['servicios_asignados']:
+            if not self._fijo(servicio):
+                break
+            fijos += 1
+        return fijos
+
+    def _simular(self, vehiculo, servicios, fijos, materializar=True):
+        """Recalcula horas de la ruta a partir del servicio `fijos`; None si alguno deja de ser factible.
+
+        Los servicios anteriores a `fijos` se conservan tal cual. Devuelve
+        (servicios, tiempo_trabajado, disponible_desde); con
+        `materializar=False` solo comprueba la factibilidad y servicios es None.
+        """
+        ubicacion = vehiculo.get('base', 'Soria')
+        disponible = 0
+        trabajado = 0
+        inicio = None
+        viaje_anterior = None
+        ruta = [] if materializar else None
+        for posicion, servicio in enumerate(servicios):
+            # Pacientes seguidos del mismo traslado compartido (ver agrupacion) van en el mismo viaje
+            id_viaje = servicio.get('Viaje')
+            id_viaje = id_viaje if isinstance(id_viaje, str) else None
+            compartido = id_viaje is not None and id_viaje == viaje_anterior
+            viaje_anterior = id_viaje
+            if posicion < fijos:
+                nuevo = servicio
+                trabajado = round(servicio['Horas Trabajadas'] * 60)
+                inicio = _minutos_hhmm(servicio['Inicio Real'])
+                disponible = _minutos_hhmm(servicio['Fin Servicio'])
+            else:
+                minuto_cita = int(servicio[COLUMNA_MINUTOS])
+                if compartido:
+                    viaje, km = 0, 0.0
+                    if inicio > minuto_cita + MARGEN_TIEMPO:
+                        return None
+                else:
+                    viaje, km = self._viaje(ubicacion, servicio['Recogida'])
+                    salida = disponible if self.ahora is None else max(disponible, self.ahora)
+                    inicio = max(salida + viaje, minuto_cita - MARGEN_TIEMPO)
+                    trabajado += viaje + DURACION_SERVICIO
+                    if inicio > minuto_cita + MARGEN_TIEMPO or trabajado > self.jornada_max:
+                        return None
+                    disponible = inicio + DURACION_SERVICIO
+                if not materializar:
+                    ubicacion = servicio['Destino']
+                    continue
+                nuevo = dict(
+                    servicio,
+                    **{
+                        'Vehículo': vehiculo['id'],
+                        'Conductor': vehiculo.get('conductor', 'N/A'),
+                        'Inicio Real': formatear_minutos(inicio),
+                        'Fin Servicio': formatear_minutos(disponible),
+                        'Tiempo Viaje': int(viaje),
+                        'Km Viaje': round(km, 1),
+                        'Horas Trabajadas': round(trabajado / 60, 2),
+                    },
+                )
+            if materializar:
+                ruta.append(nuevo)
+            ubicacion = servicio['Destino']
+        return ruta, trabajado, disponible
+
+    def _aplicar(self, vehiculo, simulacion):
+        ruta, trabajado, disponible = simulacion
+        vehiculo['servicios_asignados'] = ruta
+        vehiculo['tiempo_trabajado'] = trabajado
+        vehiculo['disponible_desde'] = disponible
+
+    def _mejor_insercion(self, servicio):
+        """(coste, vehículo, simulación) de la inserción que menos tiempo añade, o None.
+
+        Los huecos se evalúan sin construir filas; solo se materializa la ruta ganadora.
+        """
+        mejor = None
+        minuto_cita = int(servicio[COLUMNA_MINUTOS])
+        for orden, vehiculo in enumerate(self.flota):
+            if not puede_llevar(vehiculo['tipo'], servicio.get('Tipo', 'Sentado')):
+                continue
+            if vehiculo['tiempo_trabajado'] + DURACION_SERVICIO > self.jornada_max:
+                continue
+            servicios = vehiculo['servicios_asignados']
+            fijos = self._num_fijos(vehiculo)
+            for posicion in range(fijos, len(servicios) + 1):
+                # La ruta va en orden de cita: solo se prueban huecos compatibles con la hora
+                if posicion > fijos and int(servicios[posicion - 1][COLUMNA_MINUTOS]) > minuto_cita + MARGEN_TIEMPO:
+                    break
+                if posicion < len(servicios) and int(servicios[posicion][COLUMNA_MINUTOS]) < minuto_cita - MARGEN_TIEMPO:
+                    continue
+                # Lo anterior al hueco no cambia: se simula desde la posición de inserción
+                ruta = servicios[:posicion] + [servicio] + servicios[posicion:]
+                simulacion = self._simular(vehiculo, ruta, posicion, materializar=False)
+                if simulacion is None:
+                    continue
+                # Menos tiempo añadido; a igualdad, el vehículo menos cargado (como el voraz)
+                coste = (simulacion[1] - vehiculo['tiempo_trabajado'], vehiculo['tiempo_trabajado'], orden)
+                if mejor is None or coste < mejor[0]:
+                    mejor = (coste, vehiculo, ruta, posicion)
+        if mejor is None:
+            return None
+        coste, vehiculo, ruta, posicion = mejor
+        return coste, vehiculo, self._simular(vehiculo, ruta, posicion)
+
+    # ------------------------------------------
+    # Operaciones
+    # ------------------------------------------
+
+    def _preparar(self, servicio):
+        servicio = dict(servicio)
+        if COLUMNA_MINUTOS not in servicio:
+            minuto = minutos_desde_medianoche([servicio['Hora Cita']])[0]
+            if np.isnan(minuto):
+                raise ValueError(f"Hora de cita no reconocida: {servicio['Hora Cita']!r}")
+            servicio[COLUMNA_MINUTOS] = int(minuto)
+        servicio.setdefault('Tipo', 'Sentado')
+        if not isinstance(servicio.get('Base'), str):  # Falta o viene vacía (NaN) en filas SIN ASIGNAR
+            lat, lon = self._punto(servicio['Recogida'])
+            servicio['Base'] = self._bases.mas_cercana(lat, lon)
+        return servicio
+
+    def _localizar(self, clave):
+        for vehiculo in self.flota:
+            for posicion, servicio in enumerate(vehiculo['servicios_asignados']):
+                if clave_servicio(servicio) == clave:
+                    return vehiculo, posicion
+        for posicion, servicio in enumerate(self.sin_asignar):
+            if clave_servicio(servicio) == clave:
+                return None, posicion
+        raise KeyError(f"Servicio no encontrado: {clave}")
+
+    def _clave(self, paciente, hora):
+        minuto = hora if isinstance(hora, (int, np.integer)) else minutos_desde_medianoche([hora])[0]
+        if np.isnan(minuto):
+            raise ValueError(f"Hora de cita no reconocida: {hora!r}")
+        return str(paciente), int(minuto)
+
+    def _insertar(self, servicio):
+        mejor = self._mejor_insercion(servicio)
+        if mejor is None:
+            pendiente = {
+                'Vehículo': SIN_ASIGNAR,
+                'Conductor': 'N/A',
+                'Hora Cita': servicio['Hora Cita'],
+                COLUMNA_MINUTOS: servicio[COLUMNA_MINUTOS],
+                'Paciente': servicio['Paciente'],
+                'Recogida': servicio['Recogida'],
+                'Destino': servicio['Destino'],
+                'Tipo': servicio['Tipo'],
+            }
+            if 'Viaje' in servicio:
+                pendiente['Viaje'] = servicio['Viaje']
+            self.sin_asignar.append(pendiente)
+            return None
+        _, vehiculo, simulacion = mejor
+        self._aplicar(vehiculo, simulacion)
+        return vehiculo
+
+    def _quitar(self, clave):
+        vehiculo, posicion = self._localizar(clave)
+        if vehiculo is None:
+            return None, self.sin_asignar.pop(posicion)
+        servicio = vehiculo['servicios_asignados'][posicion]
+        if self._fijo(servicio):
+            raise ValueError(f"El servicio {clave} ya está en curso y no se puede modificar")
+        servicios = vehiculo['servicios_asignados'][:posicion] + vehiculo['servicios_asignados'][posicion + 1:]
+        # Quitar un servicio nunca rompe la ruta: solo adelanta o mantiene los siguientes
+        self._aplicar(vehiculo, self._simular(vehiculo, servicios, max(posicion, self._num_fijos(vehiculo))))
+        return vehiculo, servicio
+
+    def _rellenar_hueco(self, vehiculo, servicio_quitado):
+        """Intenta colocar en el vehículo liberado los pendientes de horas cercanas."""
+        asignados = []
+        minuto = int(servicio_quitado[COLUMNA_MINUTOS])
+        for pendiente in sorted(self.sin_asignar, key=lambda s: abs(int(s[COLUMNA_MINUTOS]) - minuto)):
+            if abs(int(pendiente[COLUMNA_MINUTOS]) - minuto) > DURACION_SERVICIO + 2 * MARGEN_TIEMPO:
+                break
+            if not puede_llevar(vehiculo['tipo'], pendiente.get('Tipo', 'Sentado')):
+                continue
+            servicios = vehiculo['servicios_asignados']
+            fijos = self._num_fijos(vehiculo)
+            for posicion in range(fijos, len(servicios) + 1):
+                simulacion = self._simular(vehiculo, servicios[:posicion] + [pendiente] + servicios[posicion:], posicion)
+                if simulacion is not None:
+                    self._aplicar(vehiculo, simulacion)
+                    asignados.append(pendiente)
+                    break
+        for pendiente in asignados:
+            self.sin_asignar.remove(pendiente)
+
+    def _operar(self, operacion):
+        inicio = time.perf_counter()
+        antes = {v['id']: list(v['servicios_asignados']) for v in self.flota}
+        asignado_a = operacion()
+        vehiculos = {}
+        for vehiculo in self.flota:
+            cambios = _diferencias(antes[vehiculo['id']], vehiculo['servicios_asignados'])
+            if cambios:
+                vehiculos[vehiculo['id']] = cambios
+        return {
+            'vehiculos': vehiculos,
+            'asignado_a': asignado_a['id'] if asignado_a else None,
+            'milisegundos': round((time.perf_counter() - inicio) * 1000, 2),
+        }
+
+    def insertar(self, servicio):
+        """Añade un servicio (dict con las columnas de entrada) en el hueco más barato."""
+        servicio = self._preparar(servicio)
+        return self._operar(lambda: self._insertar(servicio))
+
+    def cancelar(self, paciente, hora):
+        """Elimina el servicio y aprovecha el hueco para los pendientes de horas cercanas."""
+        clave = self._clave(paciente, hora)
+
+        def operacion():
+            vehiculo, servicio = self._quitar(clave)
+            if vehiculo is not None:
+                self._rellenar_hueco(vehiculo, servicio)
+            return None
+
+        return self._operar(operacion)
+
+    def mover(self, paciente, hora, nueva_hora=None, **cambios):
+        """Cambia la hora (u otros campos) de un servicio y lo recoloca; si no cabe queda sin asignar."""
+        clave = self._clave(paciente, hora)
+
+        def operacion():
+            vehiculo, servicio = self._quitar(clave)
+            nuevo = {k: servicio[k] for k in ('Paciente', 'Hora Cita', 'Recogida', 'Destino', 'Tipo')}
+            nuevo.update(cambios)
+            if nueva_hora is not None:
+                nuevo['Hora Cita'] = nueva_hora
+            nuevo = self._preparar(nuevo)
+            destino = self._insertar(nuevo)
+            if vehiculo is not None and vehiculo is not destino:
+                self._rellenar_hueco(vehiculo, servicio)
+            return destino
+
+        return self._operar(operacion)
+
+    def reparar(self):
+        """Intenta colocar, por orden de cita, cada servicio sin asignar en el hueco más barato de la flota."""
+
+        def operacion():
+            pendientes, self.sin_asignar = self.sin_asignar, []
+            for servicio in sorted(pendientes, key=lambda s: int(s[COLUMNA_MINUTOS])):
+                # Los que no caben vuelven a sin_asignar desde _insertar
+                self._insertar(self._preparar(servicio))
+            return None
+
+        return self._operar(operacion)
+
+    def precargar(self, asignacion):
+        """Coloca cada SIN ASIGNAR con clave en `asignacion` (clave_servicio -> id de vehículo) en ese vehículo.
+
+        Se recorren por hora de cita y se insertan en su lugar de la ruta;
+        los que ya no caben (otra hora, jornada completa) siguen sin asignar.
+        """
+
+        def operacion():
+            vehiculos = {v['id']: v for v in self.flota}
+            restantes = []
+            rutas = {}
+            for servicio in sorted(self.sin_asignar, key=lambda s: int(s[COLUMNA_MINUTOS])):
+                vehiculo = vehiculos.get(asignacion.get(clave_servicio(servicio)))
+                if vehiculo is None or not puede_llevar(vehiculo['tipo'], servicio.get('Tipo', 'Sentado')):
+                    restantes.append(servicio)
+                    continue
+                ruta = rutas.setdefault(vehiculo['id'], list(vehiculo['servicios_asignados']))
+                fijos = self._num_fijos(vehiculo)
+                minuto = int(servicio[COLUMNA_MINUTOS])
+                posicion = len(ruta)
+                while posicion > fijos and int(ruta[posicion - 1][COLUMNA_MINUTOS]) > minuto:
+                    posicion -= 1
+                candidata = ruta[:posicion] + [self._preparar(servicio)] + ruta[posicion:]
+                if self._simular(vehiculo, candidata, fijos, materializar=False) is None:
+                    restantes.append(servicio)
+                else:
+                    rutas[vehiculo['id']] = candidata
+            for id_vehiculo, ruta in rutas.items():
+                vehiculo = vehiculos[id_vehiculo]
+                self._aplicar(vehiculo, self._simular(vehiculo, ruta, self._num_fijos(vehiculo)))
+            self.sin_asignar = restantes
+            return None
+
+        return self._operar(operacion)
+
+    def vaciar(self, vehiculo_id):
+        """Reparte los servicios de un vehículo entre el resto y lo quita de la flota.
+
+        Solo se aplica si caben todos (y ninguno está en curso): devuelve
+        True; si no, el plan queda como estaba y devuelve False.
+        """
+        vehiculo = next((v for v in self.flota if v['id'] == vehiculo_id), None)
+        if vehiculo is None:
+            raise KeyError(f"Vehículo no encontrado: {vehiculo_id}")
+        if self._num_fijos(vehiculo):
+            return False
+        # _aplicar sustituye las listas de servicios, así que basta guardar las referencias
+        estado = [(v, v['servicios_asignados'], v['tiempo_trabajado'], v['disponible_desde']) for v in self.flota]
+        sin_asignar = list(self.sin_asignar)
+        self.flota = [v for v in self.flota if v is not vehiculo]
+        for servicio in vehiculo['servicios_asignados']:
+            if self._insertar(self._preparar(servicio)) is None:
+                for v, servicios, trabajado, disponible in estado:
+                    self._aplicar(v, (servicios, trabajado, disponible))
+                self.flota = [v for v, *_ in estado]
+                self.sin_asignar = sin_asignar
+                return False
+        return True
+
+    def mejorar(self, segundos=MEJORA_SEGUNDOS, max_iteraciones=None, semilla=0, diagnostico=None):
+        """Búsqueda local entre rutas (ver busqueda_local) durante `segundos` o `max_iteraciones`.
+
+        Además de la diferencia, devuelve en 'mejora' los minutos de viaje
+        ahorrados, los pendientes asignados y los movimientos aplicados. Si
+        alguna ruta resultante no se pudiera simular, el plan no cambia.
+        """
+        from .busqueda_local import BusquedaLocal
+
+        diagnostico = diagnostico if diagnostico is not None else Diagnostico()
+        resumen = {}
+
+        def operacion():
+            busqueda = BusquedaLocal(self, semilla)
+            resumen.update(busqueda.ejecutar(segundos, max_iteraciones))
+            rutas, pendientes = busqueda.filas_por_vehiculo()
+            simulaciones = []
+            for vehiculo, filas in zip(self.flota, rutas):
+                if [id(f) for f in filas] == [id(s) for s in vehiculo['servicios_asignados']]:
+                    continue
+                filas = [s if s.get('Vehículo', SIN_ASIGNAR) != SIN_ASIGNAR else self._preparar(s) for s in filas]
+                simulacion = self._simular(vehiculo, filas, self._num_fijos(vehiculo))
+                if simulacion is None:
+                    resumen.update(minutos_ahorrados=0, asignados=0, descartada=True)
+                    return None
+                simulaciones.append((vehiculo, simulacion))
+            for vehiculo, simulacion in simulaciones:
+                self._aplicar(vehiculo, simulacion)
+            self.sin_asignar = pendientes
+            return None
+
+        instante = time.perf_counter()
+        cambios = self._operar(operacion)
+        diagnostico.medir('mejora', instante)
+        diagnostico.contar('movimientos_mejora', sum(resumen['movimientos'].values()))
+        cambios['mejora'] = resumen
+        return cambios
+
+    def dataframe(self):
+        """df_resultado equivalente al del optimizador, ordenado por hora de cita."""
+        filas = [s for v in self.flota for s in v['servicios_asignados']] + self.sin_asignar
+        df = pd.DataFrame(filas)
+        if df.empty:
+            return df
+        return df.sort_values(COLUMNA_MINUTOS, kind='stable').reset_index(drop=True)
+
+
+def _diferencias(antes, despues):
+    """Filas añadidas, eliminadas o reprogramadas entre dos rutas de un vehículo."""
+    previos = {clave_servicio(s): s for s in antes}
+    actuales = {clave_servicio(s): s for s in despues}
+    cambios = []
+    for clave, servicio in actuales.items():
+        previo = previos.get(clave)
+        if previo is None:
+            cambios.append({'Cambio': 'añadido', 'Paciente': clave[0], 'Hora Cita': servicio['Hora Cita'],
+                            'Inicio Anterior': None, 'Inicio Real': servicio['Inicio Real']})
+        elif previo['Inicio Real'] != servicio['Inicio Real']:
+            cambios.append({'Cambio': 'reprogramado', 'Paciente': clave[0], 'Hora Cita': servicio['Hora Cita'],
+                            'Inicio Anterior': previo['Inicio Real'], 'Inicio Real': servicio['Inicio Real']})
+    for clave, servicio in previos.items():
+        if clave not in actuales:
+            cambios.append({'Cambio': 'eliminado', 'Paciente': clave[0], 'Hora Cita': servicio['Hora Cita'],
+                            'Inicio Anterior': servicio['Inicio Real'], 'Inicio Real': None})
+    return cambios
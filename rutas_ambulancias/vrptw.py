@@ -0,0 +1,167 @@
+"""Motor alternativo: problema de rutas de vehículos con ventanas de tiempo (OR-Tools).
+
+Cada servicio es un nodo con ventana `Hora Cita` ± MARGEN_TIEMPO y duración
+DURACION_SERVICIO; los vehículos salen de su base, solo visitan servicios
+compatibles según `puede_llevar` y su jornada (fin - inicio) no supera
+JORNADA_MAX. Los servicios que no caben se descartan con una penalización y
+se devuelven como 'SIN ASIGNAR'. OR-Tools se importa solo al resolver.
+"""
+
+import pandas as pd
+
+from .config import DURACION_SERVICIO, JORNADA_MAX, MARGEN_TIEMPO, puede_llevar
+from .diagnostico import Diagnostico, MOTIVO_SIN_COMPATIBLE, MOTIVO_VRPTW
+from .distancias import IndiceBases, MatrizTiempos
+from .horarios import COLUMNA_MINUTOS, formatear_minutos, preparar_servicios
+
+ESTRATEGIAS_INICIALES = (
+    'PATH_CHEAPEST_ARC',
+    'PARALLEL_CHEAPEST_INSERTION',
+    'LOCAL_CHEAPEST_INSERTION',
+    'SAVINGS',
+    'AUTOMATIC',
+)
+HORIZONTE = 24 * 60  # Minutos de un día
+PENALIZACION_SIN_ASIGNAR = 100_000  # Coste de dejar un servicio sin vehículo
+COSTE_VEHICULO = 1_000  # Coste fijo por vehículo utilizado
+
+
+def resolver_vrptw(df_servicios, flota, estrategia_inicial='PATH_CHEAPEST_ARC', limite_segundos=10,
+                   jornada_max=JORNADA_MAX, busqueda_guiada=True, diagnostico=None):
+    """Resuelve el día como VRPTW; devuelve (df_resultado, flota) o None si no hay solución a tiempo."""
+    diagnostico = diagnostico if diagnostico is not None else Diagnostico()
+    from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
+    if COLUMNA_MINUTOS not in df_servicios.columns:
+        df_servicios, _ = preparar_servicios(df_servicios)
+    servicios = df_servicios.to_dict('records')
+    if not servicios or not flota:
+        return None
+
+    matriz = MatrizTiempos.desde_servicios(df_servicios)
+    bases_por_punto = IndiceBases().mas_cercanas(matriz.lats, matriz.lons)
+    minutos = matriz.minutos.astype(int).tolist()
+
+    # Nodos 0..S-1: servicios; S..: una base por vehículo (salida y llegada)
+    num_servicios = len(servicios)
+    origen = [matriz.indice(s['Recogida']) for s in servicios]
+    destino = [matriz.indice(s['Destino']) for s in servicios]
+    for vehiculo in flota:
+        vehiculo['base'] = vehiculo.get('base', 'Soria')
+        origen.append(matriz.indice(vehiculo['base']))
+        destino.append(matriz.indice(vehiculo['base']))
+    duracion = [DURACION_SERVICIO] * num_servicios + [0] * len(flota)
+    depositos = list(range(num_servicios, num_servicios + len(flota)))
+
+    manager = pywrapcp.RoutingIndexManager(len(origen), len(flota), depositos, depositos)
+    routing = pywrapcp.RoutingModel(manager)
+
+    def viaje(desde, hasta):
+        # La vuelta a la base no computa, igual que en el algoritmo voraz
+        return 0 if hasta >= num_servicios else minutos[destino[desde]][origen[hasta]]
+
+    def coste(i, j):
+        return viaje(manager.IndexToNode(i), manager.IndexToNode(j))
+
+    def transito(i, j):
+        desde, hasta = manager.IndexToNode(i), manager.IndexToNode(j)
+        return duracion[desde] + viaje(desde, hasta)
+
+    routing.SetArcCostEvaluatorOfAllVehicles(routing.RegisterTransitCallback(coste))
+    routing.SetFixedCostOfAllVehicles(COSTE_VEHICULO)
+    indice_transito = routing.RegisterTransitCallback(transito)
+    routing.AddDimension(indice_transito, HORIZONTE, HORIZONTE + DURACION_SERVICIO, False, 'Tiempo')
+    tiempo = routing.GetDimensionOrDie('Tiempo')
+
+    for nodo, servicio in enumerate(servicios):
+        indice = manager.NodeToIndex(nodo)
+        cita = int(servicio[COLUMNA_MINUTOS])
+        tiempo.CumulVar(indice).SetRange(max(0, cita - MARGEN_TIEMPO), cita + MARGEN_TIEMPO)
+        tipo = servicio.get('Tipo', 'Sentado')
+        permitidos = [v for v, vehiculo in enumerate(flota) if puede_llevar(vehiculo['tipo'], tipo)]
+        # -1 = no realizado; sin vehículos compatibles el servicio queda sin asignar
+        routing.VehicleVar(indice).SetValues([-1] + permitidos)
+        routing.AddDisjunction([indice], PENALIZACION_SIN_ASIGNAR)
+
+    for v in range(len(flota)):
+        tiempo.SetSpanUpperBoundForVehicle(jornada_max, v)
+        routing.AddVariableMinimizedByFinalizer(tiempo.CumulVar(routing.Start(v)))
+        routing.AddVariableMinimizedByFinalizer(tiempo.CumulVar(routing.End(v)))
+
+    parametros = pywrapcp.DefaultRoutingSearchParameters()
+    parametros.first_solution_strategy = getattr(routing_enums_pb2.FirstSolutionStrategy, estrategia_inicial)
+    if busqueda_guiada:
+        parametros.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    parametros.time_limit.FromMilliseconds(int(limite_segundos * 1000))
+
+    with diagnostico.etapa('optimizacion.vrptw'):
+        solucion = routing.SolveWithParameters(parametros)
+    if solucion is None:
+        return None
+
+    filas = [None] * num_servicios
+    for v, vehiculo in enumerate(flota):
+        vehiculo['servicios_asignados'] = []
+        vehiculo['tiempo_trabajado'] = 0
+        vehiculo['ubicacion'] = matriz.indice(vehiculo['base'])
+        vehiculo['disponible_desde'] = 0
+
+        anterior = manager.IndexToNode(routing.Start(v))
+        indice = solucion.Value(routing.NextVar(routing.Start(v)))
+        while not routing.IsEnd(indice):
+            nodo = manager.IndexToNode(indice)
+            servicio = servicios[nodo]
+            tiempo_viaje = viaje(anterior, nodo)
+            inicio = solucion.Min(tiempo.CumulVar(indice))
+            vehiculo['tiempo_trabajado'] += tiempo_viaje + DURACION_SERVICIO
+
+            servicio_info = {
+                'Vehículo': vehiculo['id'],
+                'Conductor': vehiculo.get('conductor', 'N/A'),
+                'Hora Cita': servicio['Hora Cita'],
+                COLUMNA_MINUTOS: int(servicio[COLUMNA_MINUTOS]),
+                'Inicio Real': formatear_minutos(inicio),
+                'Fin Servicio': formatear_minutos(inicio + DURACION_SERVICIO),
+                'Paciente': servicio['Paciente'],
+                'Recogida': servicio['Recogida'],
+                'Destino': servicio['Destino'],
+                'Tipo': servicio.get('Tipo', 'Sentado'),
+                'Base': bases_por_punto[origen[nodo]],
+                'Tiempo Viaje': int(tiempo_viaje),
+                'Km Viaje': round(matriz.distancia(destino[anterior], origen[nodo]), 1),
+                'Horas Trabajadas': round(vehiculo['tiempo_trabajado'] / 60, 2)
+            }
+            if 'Viaje' in servicio:
+                servicio_info['Viaje'] = servicio['Viaje']
+            vehiculo['servicios_asignados'].append(servicio_info)
+            vehiculo['disponible_desde'] = inicio + DURACION_SERVICIO
+            vehiculo['ubicacion'] = destino[nodo]
+            filas[nodo] = servicio_info
+
+            anterior = nodo
+            indice = solucion.Value(routing.NextVar(indice))
+
+    resultados = []
+    for nodo, servicio in enumerate(servicios):
+        if filas[nodo] is None:
+            tipo = servicio.get('Tipo', 'Sentado')
+            compatible = any(puede_llevar(v['tipo'], tipo) for v in flota)
+            diagnostico.sin_asignar[MOTIVO_VRPTW if compatible else MOTIVO_SIN_COMPATIBLE] += 1
+            filas[nodo] = {
+                'Vehículo': 'SIN ASIGNAR',
+                'Conductor': 'N/A',
+                'Hora Cita': servicio['Hora Cita'],
+                COLUMNA_MINUTOS: int(servicio[COLUMNA_MINUTOS]),
+                'Paciente': servicio['Paciente'],
+                'Recogida': servicio['Recogida'],
+                'Destino': servicio['Destino'],
+                'Tipo': servicio.get('Tipo', 'Sentado')
+            }
+            if 'Viaje' in servicio:
+                filas[nodo]['Viaje'] = servicio['Viaje']
+        resultados.append(filas[nodo])
+
+    diagnostico.contar('servicios', num_servicios)
+    diagnostico.contar('asignados', sum(f['Vehículo'] != 'SIN ASIGNAR' for f in resultados))
+    diagnostico.contar('vehiculos_usados', sum(bool(v['servicios_asignados']) for v in flota))
+    return pd.DataFrame(resultados), flota
@@ -4,14 +4,29 @@
 # ==========================================
 
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import numpy as np
 import random
-from datetime import datetime, timedelta
-import io
+from datetime import datetime
+import functools
+import hashlib
+import importlib.util
 from collections import defaultdict
-import math
-import pdfplumber
+
+from rutas_ambulancias.busqueda_local import mejorar_plan
+from rutas_ambulancias.config import BASES, CAPACIDAD_VEHICULO, COLUMNAS_REQUERIDAS, MEJORA_SEGUNDOS
+from rutas_ambulancias.diagnostico import Diagnostico
+from rutas_ambulancias.dimensionado import completar_flota, dimensionar_flota
+from rutas_ambulancias.exportacion import escribir_excel, generar_paquete, resumen_por_conductor
+from rutas_ambulancias.flota import flota_automatica, flota_desde_tabla, flota_predefinida, leer_flota, tabla_flota
+from rutas_ambulancias.ingesta import cargar_servicios
+from rutas_ambulancias.historial import MOTOR_HISTORIAL, HistorialPlanes, arrancar_en_caliente, hay_arranque_en_caliente
+from rutas_ambulancias.horarios import COLUMNA_MINUTOS
+from rutas_ambulancias.mapa import mapa_html
+from rutas_ambulancias.optimizador import optimizar_rutas
+from rutas_ambulancias.replanificacion import PlanIncremental
+from rutas_ambulancias.vrptw import ESTRATEGIAS_INICIALES
 
 # ==========================================
 # CONFIGURACIÓN
@@ -25,162 +40,69 @@ st.set_page_config(
 
 st.title("🏆 Gestor Inteligente de Flota V4.0 - OPTIMIZADO")
 
-# Configuración
-
-DURACION_SERVICIO = 60
-MARGEN_TIEMPO = 30  # Margen de tiempo para llegar a la cita (minutos)
-JORNADA_MAX = 600  # Jornada máxima en minutos (10 horas)
-
-BASES = {
-    'Soria': {'lat': 41.7665, 'lon': -2.4790},
-    'Almazán': {'lat': 41.4856, 'lon': -2.5252},
-    'Burgo de Osma': {'lat': 41.5869, 'lon': -3.0661},
-    'Ólvega': {'lat': 41.7974, 'lon': -2.0306, 'solo_tarde': True}
-}
-
-# Función para calcular distancia real
-def calcular_distancia_km(lat1, lon1, lat2, lon2):
-    R = 6371
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R * c
-
-def asignar_base_mas_cercana(ubicacion):
-    mejor_base = 'Soria'
-    min_dist = float('inf')
-    for base, coords in BASES.items():
-        if 'Almazán' in str(ubicacion):
-            return 'Almazán'
-        if 'Burgo' in str(ubicacion) or 'Osma' in str(ubicacion):
-            return 'Burgo de Osma'
-        if 'Ólvega' in str(ubicacion):
-            return 'Ólvega'
-    return 'Soria'
-
-def puede_llevar(vehiculo_tipo, paciente_tipo):
-    if vehiculo_tipo == "A":
-        return paciente_tipo in ["Sentado", "Silla"]
-    return True
-
-def calcular_hora_entrada(servicios):
-    if not servicios:
-        return "08:00"
-    try:
-        primer_servicio = min(servicios, key=lambda x: pd.to_datetime(str(x.get('Hora Cita', '08:00')), errors='coerce'))
-        hora_cita = pd.to_datetime(str(primer_servicio.get('Hora Cita', '08:00')), errors='coerce')
-        hora_entrada = hora_cita - timedelta(minutes=45)
-        return hora_entrada.strftime("%H:%M")
-    except:
-        return "08:00"
-
 # ==========================================
-# ALGORITMO DE OPTIMIZACIÓN MEJORADO
+# CACHÉ ENTRE RERUNS
 # ==========================================
 
-def optimizar_rutas_multiple_servicios(df_servicios, flota):
-    resultados = []
-    
-    # Ordenar servicios por hora
-    df_servicios = df_servicios.sort_values('Hora Cita')
-    
-    # Asignar base a cada servicio
-    df_servicios['Base'] = df_servicios['Recogida'].apply(asignar_base_mas_cercana)
-    
-    # Agrupar servicios por bloques horarios
-    servicios_pendientes = df_servicios.to_dict('records')
-    
-    for vehiculo in flota:
-        vehiculo['disponible_desde'] = datetime.strptime("08:00", "%H:%M")
-        vehiculo['servicios_asignados'] = []
-        vehiculo['tiempo_trabajado'] = 0
-        vehiculo['base'] = 'Soria'
-    
-    # Asignar múltiples servicios por conductor
-    for servicio in servicios_pendientes:
-        try:
-            hora_cita = pd.to_datetime(str(servicio['Hora Cita']), errors='coerce')
-            if pd.isna(hora_cita):
-                hora_cita = pd.to_datetime(f"2000-01-01 {servicio['Hora Cita']}", errors='coerce')
-            
-            ventana_inicio = hora_cita - timedelta(minutes=MARGEN_TIEMPO)
-            ventana_fin = hora_cita + timedelta(minutes=MARGEN_TIEMPO)
-            
-            # Buscar vehículo disponible que pueda llevar este servicio
-            candidatos = [v for v in flota if puede_llevar(v['tipo'], servicio.get('Tipo', 'Sentado'))]
-            
-            # Filtrar candidatos que aún tienen tiempo disponible
-            candidatos = [c for c in candidatos if c['tiempo_trabajado'] < JORNADA_MAX]
-            
-            # Ordenar por: 1) menos tiempo trabajado, 2) más servicios (para agrupar)
-            candidatos.sort(key=lambda x: (x['tiempo_trabajado'], -len(x['servicios_asignados'])))
-            
-            asignado = False
-            
-            for vehiculo in candidatos:
-                tiempo_viaje = 20  # Tiempo base
-                
-                if vehiculo['servicios_asignados']:
-                    # Calcular tiempo desde último servicio
-                    tiempo_viaje = 25
-                
-                hora_disponible = vehiculo['disponible_desde'] + timedelta(minutes=tiempo_viaje)
-                inicio_real = max(hora_disponible, ventana_inicio)
-                
-                # Verificar si puede llegar a tiempo y no supera jornada
-                if inicio_real <= ventana_fin:
-                    tiempo_servicio = tiempo_viaje + DURACION_SERVICIO
-                    nuevo_tiempo = vehiculo['tiempo_trabajado'] + tiempo_servicio
-                    
-                    if nuevo_tiempo <= JORNADA_MAX:
-                        # ASIGNAR SERVICIO
-                        fin_real = inicio_real + timedelta(minutes=DURACION_SERVICIO)
-                        
-                        servicio_info = {
-                            'Vehículo': vehiculo['id'],
-                            'Conductor': vehiculo.get('conductor', 'N/A'),
-                            'Hora Cita': servicio['Hora Cita'],
-                            'Inicio Real': inicio_real.strftime("%H:%M"),
-                            'Fin Servicio': fin_real.strftime("%H:%M"),
-                            'Paciente': servicio['Paciente'],
-                            'Recogida': servicio['Recogida'],
-                            'Destino': servicio['Destino'],
-                            'Tipo': servicio.get('Tipo', 'Sentado'),
-                            'Base': servicio.get('Base', 'Soria'),
-                            'Tiempo Viaje': int(tiempo_viaje),
-                            'Horas Trabajadas': round(nuevo_tiempo / 60, 2)
-                        }
-                        
-                        vehiculo['disponible_desde'] = fin_real
-                        vehiculo['tiempo_trabajado'] = nuevo_tiempo
-                        vehiculo['servicios_asignados'].append(servicio_info)
-                        resultados.append(servicio_info)
-                        asignado = True
-                        break
-            
-            if not asignado:
-                resultados.append({
-                    'Vehículo': 'SIN ASIGNAR',
-                    'Conductor': 'N/A',
-                    'Hora Cita': servicio['Hora Cita'],
-                    'Paciente': servicio['Paciente'],
-                    'Recogida': servicio['Recogida'],
-                    'Destino': servicio['Destino'],
-                    'Tipo': servicio.get('Tipo', 'Sentado')
-                })
-        
-        except Exception as e:
-            pass
-    
-    return pd.DataFrame(resultados), flota
+# Streamlit vuelve a ejecutar el script en cada interacción: la lectura del
+# fichero, la optimización y el Excel se cachean por contenido de sus entradas.
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cargar_servicios_cacheado(contenido, file_ext, _al_progresar=None):
+    diagnostico = Diagnostico()
+    return cargar_servicios(contenido, file_ext, al_progresar=_al_progresar, diagnostico=diagnostico) + (diagnostico,)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def calcular_rutas(df_servicios, flota, motor, estrategia_inicial, limite_segundos, jornada_max, perfilador=None,
+                   agrupar=False):
+    diagnostico = Diagnostico(perfilador)
+    df_resultado, flota, motor_usado = optimizar_rutas(
+        df_servicios, [v.copy() for v in flota], motor=motor, jornada_max=jornada_max, diagnostico=diagnostico,
+        agrupar=agrupar, estrategia_inicial=estrategia_inicial, limite_segundos=limite_segundos
+    )
+    return df_resultado, flota, motor_usado, huella_resultado(df_resultado), diagnostico
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def dimensionar_cacheado(df_servicios, jornada_max):
+    diagnostico = Diagnostico()
+    df_resultado, flota, informe = dimensionar_flota(df_servicios, jornada_max, diagnostico=diagnostico)
+    return df_resultado, flota, informe, huella_resultado(df_resultado), diagnostico
+
+def huella_resultado(df_resultado):
+    return hashlib.sha1(pd.util.hash_pandas_object(df_resultado.astype(str), index=False).to_numpy().tobytes()).hexdigest()
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def mapa_resultado(clave_resultado, _df_res, _flota):
+    # El HTML del mapa se genera una vez por resultado, no en cada interacción
+    return mapa_html(_df_res, _flota)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def exportar_resultado(clave_resultado, jornada_objetivo, formato, _df_res, _df_conductores):
+    # Los argumentos con '_' no se hashean: la clave es la huella del resultado y la jornada objetivo
+    if formato == 'xlsx':
+        return escribir_excel(_df_res, _df_conductores)
+    return generar_paquete(_df_res, _df_conductores, formato)
+
+def exportar_con_diagnostico(diagnostico, *argumentos):
+    with diagnostico.etapa('exportacion'):
+        return exportar_resultado(*argumentos)
+
+@st.cache_resource
+def historial_planes():
+    # Una conexión SQLite compartida por todas las sesiones
+    return HistorialPlanes()
+
+def fijar_flota(flota):
+    # Nueva versión del editor: la rejilla no arrastra ediciones hechas sobre la tabla anterior
+    st.session_state['flota_tabla'] = tabla_flota(flota)
+    st.session_state['version_flota'] = st.session_state.get('version_flota', 0) + 1
 
 # ==========================================
 # GESTIÓN DE FLOTA (SIDEBAR)
 # ==========================================
 
-if 'vehiculos_personalizados' not in st.session_state:
-    st.session_state['vehiculos_personalizados'] = []
+if 'flota_tabla' not in st.session_state:
+    fijar_flota([])
 
 # Parámetros de Jornada
 st.sidebar.subheader("⚙️ Parámetros de Jornada")
@@ -193,13 +115,13 @@ jornada_objetivo = st.sidebar.slider(
         help="Jornada objetivo para servicios normales"
     )
 
-jornada_maxima_fuera = st.sidebar.slider(
-        "Jornada Máxima Fuera de Provincia (horas)",
+jornada_maxima = st.sidebar.slider(
+        "Jornada Máxima (horas)",
         min_value=8.0,
         max_value=12.0,
         value=10.0,
         step=0.5,
-        help="Jornada máxima para servicios fuera de provincia"
+        help="Jornada máxima de cada conductor (incluye servicios fuera de provincia)"
     )
 
 calcular_necesarias = st.sidebar.checkbox(
@@ -210,61 +132,103 @@ calcular_necesarias = st.sidebar.checkbox(
 
 
 
+motor_optimizacion = st.sidebar.selectbox(
+        "Motor de optimización",
+        ["Voraz", "VRPTW", "Zonas"],
+        help="VRPTW usa OR-Tools con ventanas de tiempo; si no encuentra solución a tiempo se usa el voraz. "
+             "Zonas reparte el día por base y mañana/tarde, resuelve cada parte en paralelo y repara los huecos"
+    )
+
+if motor_optimizacion == "VRPTW":
+    estrategia_inicial = st.sidebar.selectbox("Estrategia inicial", ESTRATEGIAS_INICIALES)
+    limite_segundos = st.sidebar.slider(
+        "Tiempo máximo de cálculo (s)",
+        min_value=1,
+        max_value=120,
+        value=10,
+        help="Límite de reloj para la búsqueda local guiada"
+    )
+else:
+    estrategia_inicial, limite_segundos = ESTRATEGIAS_INICIALES[0], 10
+
+agrupar_traslados = st.sidebar.checkbox(
+        "Agrupar traslados compartidos",
+        value=False,
+        help="Pacientes de la misma localidad al mismo destino con citas cercanas viajan juntos "
+             "si caben en las plazas del vehículo"
+    )
+
+fecha_plan = st.sidebar.date_input("Fecha del plan", value=datetime.now().date())
+usar_historial = st.sidebar.checkbox(
+        "Partir de planes anteriores",
+        value=True,
+        help="Los servicios que se repiten (mismo paciente, hora y trayecto que la semana pasada o ayer) van "
+             "con el mismo vehículo y solo se colocan los nuevos. Necesita planes guardados en el historial"
+    )
+
+perfiladores = {'Ninguno': None, 'cProfile': 'cprofile'}
+if importlib.util.find_spec('pyinstrument') is not None:
+    perfiladores['pyinstrument'] = 'pyinstrument'
+perfilador = perfiladores[st.sidebar.selectbox(
+        "Perfilar optimización",
+        list(perfiladores),
+        help="Guarda un perfil de la llamada al motor en el panel de diagnóstico"
+    )]
+
 st.sidebar.header("🚗 Gestión de Flota")
 
+# La flota vive en una tabla (DataFrame) y se edita en una sola rejilla: las
+# ediciones se aplican juntas al guardar, sin un widget ni un rerun por vehículo.
+
 if st.sidebar.button("🚑 Cargar Flota Automática (35 vehículos)"):
-    st.session_state['vehiculos_personalizados'] = []
-    
-    for i in range(1, 28):
-        st.session_state['vehiculos_personalizados'].append({
-            "id": f"B-{i:03d}",
-            "tipo": "B",
-            "conductor": f"Conductor B-{i}",
-            "matricula": f"{1000+i}BBB"
-        })
-    
-    for i in range(1, 9):
-        st.session_state['vehiculos_personalizados'].append({
-            "id": f"A-{i:03d}",
-            "tipo": "A",
-            "conductor": f"Conductor A-{i}",
-            "matricula": f"{2000+i}AAA"
-        })
-    
+    fijar_flota(flota_predefinida())
     st.sidebar.success("✅ Flota cargada: 27 tipo B + 8 tipo A")
-    st.rerun()
 
 if st.sidebar.button("🗑️ Limpiar Flota"):
-    st.session_state['vehiculos_personalizados'] = []
+    fijar_flota([])
     st.sidebar.warning("⚠️ Flota limpiada")
-    st.rerun()
-
-with st.sidebar.expander("➕ Añadir Vehículo", expanded=False):
-    with st.form("form_vehiculo"):
-        nuevo_id = st.text_input("ID", placeholder="A-001")
-        nuevo_tipo = st.selectbox("Tipo", ["A", "B"])
-        nuevo_conductor = st.text_input("Conductor")
-        nueva_matricula = st.text_input("Matrícula")
-        
-        if st.form_submit_button("✅ Añadir"):
-            if nuevo_id and nuevo_conductor:
-                st.session_state['vehiculos_personalizados'].append({
-                    "id": nuevo_id,
-                    "tipo": nuevo_tipo,
-                    "conductor": nuevo_conductor,
-                    "matricula": nueva_matricula
-                })
-                st.success(f"✅ {nuevo_id} añadido")
-
-if st.session_state['vehiculos_personalizados']:
-    st.sidebar.subheader(f"📋 Flota ({len(st.session_state['vehiculos_personalizados'])} vehículos)")
-    for idx, v in enumerate(st.session_state['vehiculos_personalizados']):
-        with st.sidebar.expander(f"{v['id']} - {v['conductor']}"):
-            st.write(f"**Tipo:** {v['tipo']}")
-            st.write(f"**Matrícula:** {v['matricula']}")
-            if st.button(f"🗑️ Eliminar", key=f"del_{idx}"):
-                st.session_state['vehiculos_personalizados'].pop(idx)
-                st.rerun()
+
+with st.sidebar.expander("📂 Importar Flota (CSV/Excel)", expanded=False):
+    with st.form("importar_flota", clear_on_submit=True):
+        fichero_flota = st.file_uploader("Columnas: id, tipo y opcionalmente conductor, matricula, base",
+                                         type=['csv', 'xlsx', 'xls'])
+        anadir_flota = st.checkbox("Añadir a la flota actual (si no, la sustituye)")
+        if st.form_submit_button("📥 Importar") and fichero_flota is not None:
+            try:
+                importada = leer_flota(fichero_flota)
+                if anadir_flota:
+                    importada = flota_desde_tabla(pd.concat([st.session_state['flota_tabla'], tabla_flota(importada)]))
+            except (KeyError, ValueError) as e:
+                st.error(f"❌ {e}")
+            else:
+                fijar_flota(importada)
+                st.success(f"✅ Flota importada: {len(importada)} vehículos")
+
+tabla = st.session_state['flota_tabla']
+st.sidebar.subheader(f"📋 Flota ({len(tabla)} vehículos)")
+with st.sidebar.form("editar_flota"):
+    # La rejilla solo dibuja las filas visibles; las filas nuevas se añaden al final y se borran seleccionándolas
+    flota_editada = st.data_editor(
+        tabla,
+        key=f"editor_flota_{st.session_state['version_flota']}",
+        num_rows="dynamic",
+        hide_index=True,
+        height=320,
+        column_config={
+            'id': st.column_config.TextColumn("ID", required=True),
+            'tipo': st.column_config.SelectboxColumn("Tipo", options=list(CAPACIDAD_VEHICULO), required=True),
+            'conductor': st.column_config.TextColumn("Conductor"),
+            'matricula': st.column_config.TextColumn("Matrícula"),
+            'base': st.column_config.SelectboxColumn("Base", options=list(BASES), help="Vacía: la decide el optimizador"),
+        },
+    )
+    if st.form_submit_button("💾 Guardar cambios"):
+        try:
+            fijar_flota(flota_desde_tabla(flota_editada))
+        except ValueError as e:
+            st.error(f"❌ {e}")
+        else:
+            st.rerun()
 
 # ==========================================
 # INTERFAZ PRINCIPAL
@@ -277,28 +241,31 @@ uploaded_file = st.file_uploader("Sube tu archivo Excel o PDF", type=['xlsx', 'x
 if uploaded_file:
     try:
         file_ext = uploaded_file.name.split('.')[-1].lower()
+        progreso = st.progress(0.0, text="📄 Leyendo servicios...")
         
-        if file_ext == 'pdf':
-            with pdfplumber.open(uploaded_file) as pdf:
-                table = pdf.pages[0].extract_table()
-                if table:
-                    df = pd.DataFrame(table[1:], columns=table[0])
-                else:
-                    st.error("❌ No se encontraron tablas en PDF")
-                    df = None
-        else:
-            df = pd.read_excel(uploaded_file)
+        def al_progresar(hechas, total, filas):
+            progreso.progress(hechas / total, text=f"📄 Página {hechas}/{total} · {filas} filas leídas")
         
-        if df is not None:
-            columnas_req = ['Paciente', 'Hora Cita', 'Recogida', 'Destino', 'Tipo']
-            faltantes = [c for c in columnas_req if c not in df.columns]
-            
-            if faltantes:
-                st.error(f"❌ Faltan columnas: {', '.join(faltantes)}")
-                st.info("💡 Columnas requeridas: Paciente, Hora Cita, Recogida, Destino, Tipo")
-            else:
-                st.session_state['df_servicios'] = df
-                st.success(f"✅ {len(df)} servicios cargados")
+        df, df_rechazados, faltantes, errores_pagina, diagnostico_ingesta = cargar_servicios_cacheado(
+            uploaded_file.getvalue(), file_ext, _al_progresar=al_progresar
+        )
+        progreso.empty()
+        st.session_state['diagnostico_ingesta'] = diagnostico_ingesta
+        
+        for pagina, error in errores_pagina:
+            st.warning(f"⚠️ Página {pagina} no se pudo leer: {error}")
+        
+        if df is None:
+            st.error("❌ No se encontraron tablas en PDF")
+        elif faltantes:
+            st.error(f"❌ Faltan columnas: {', '.join(faltantes)}")
+            st.info(f"💡 Columnas requeridas: {', '.join(COLUMNAS_REQUERIDAS)}")
+        else:
+            st.session_state['df_servicios'] = df
+            st.success(f"✅ {len(df)} servicios cargados")
+            if len(df_rechazados):
+                st.warning(f"⚠️ {len(df_rechazados)} filas no se planificarán (ver 'Motivo')")
+                st.dataframe(df_rechazados, use_container_width=True)
     
     except Exception as e:
         st.error(f"❌ Error: {str(e)}")
@@ -323,42 +290,81 @@ if 'df_servicios' in st.session_state:
     
     st.subheader("🚀 Paso 2: Calcular Rutas Optimizadas")
     
-if st.button("🚀 CALCULAR RUTAS CON OPTIMIZACIÓN"):
+    if st.button("🚀 CALCULAR RUTAS CON OPTIMIZACIÓN"):
+        jornada_max = int(jornada_maxima * 60)
+        dimensionado = None
         # Auto-crear vehículos si no existen
-        if not st.session_state['vehiculos_personalizados']:
+        flota_configurada = flota_desde_tabla(st.session_state['flota_tabla'])
+        if not flota_configurada and calcular_necesarias:
+            with st.spinner("🤖 Calculando la flota mínima necesaria..."):
+                dimensionado = dimensionar_cacheado(df, jornada_max)
+            # Se fija cuando el plan calculado abajo confirme que basta
+            flota_configurada = flota_desde_tabla(tabla_flota(dimensionado[1]))
+        elif not flota_configurada:
             st.info("🤖 Calculando vehículos necesarios automáticamente...")
-            num_servicios = len(st.session_state['df_servicios'])
-            num_vehiculos = max(10, (num_servicios // 6) + 1)
-            num_b = int(num_vehiculos * 0.7)
-            num_a = num_vehiculos - num_b
-            
-            st.session_state['vehiculos_personalizados'] = []
-            for i in range(1, num_b + 1):
-                st.session_state['vehiculos_personalizados'].append({
-                    "id": f"B-{i:03d}",
-                    "tipo": "B",
-                    "conductor": f"Conductor B-{i}",
-                    "matricula": f"{1000+i}BBB"
-                })
-            
-            for i in range(1, num_a + 1):
-                st.session_state['vehiculos_personalizados'].append({
-                    "id": f"A-{i:03d}",
-                    "tipo": "A",
-                    "conductor": f"Conductor A-{i}",
-                    "matricula": f"{2000+i}AAA"
-                })
+            flota_auto = flota_automatica(len(st.session_state['df_servicios']))
+            fijar_flota(flota_auto)
+            flota_configurada = flota_auto
+            num_b = sum(v['tipo'] == 'B' for v in flota_auto)
+            num_a = len(flota_auto) - num_b
+            num_vehiculos = len(flota_auto)
             
             st.success(f"✅ Flota creada automáticamente: {num_b} tipo B + {num_a} tipo A = {num_vehiculos} total")
         
-            with st.spinner("🔄 Optimizando con múltiples servicios por conductor..."):
-                flota = [v.copy() for v in st.session_state['vehiculos_personalizados']]
-                
-                df_resultado, flota = optimizar_rutas_multiple_servicios(df, flota)
-                st.session_state['df_resultado'] = df_resultado
-                st.session_state['flota'] = flota
-                
-                st.success("✅ ¡Optimización completada con éxito!")
+        asignacion_previa, informe_historial = {}, None
+        if usar_historial:
+            asignacion_previa, informe_historial = historial_planes().asignacion_previa(fecha_plan, df)
+        
+        with st.spinner("🔄 Optimizando con múltiples servicios por conductor..."):
+            if informe_historial and hay_arranque_en_caliente(asignacion_previa, len(df), agrupar_traslados):
+                # Recurrentes con su vehículo de días anteriores; solo se colocan los nuevos o cambiados
+                diagnostico = Diagnostico()
+                df_resultado, flota = arrancar_en_caliente(df, flota_configurada, asignacion_previa, jornada_max,
+                                                           diagnostico)
+                motor_usado, clave_resultado = MOTOR_HISTORIAL, huella_resultado(df_resultado)
+                st.info(f"♻️ {informe_historial['recurrentes']} servicios recurrentes con su vehículo de "
+                        f"{', '.join(informe_historial['dias_referencia'])}; {informe_historial['nuevos']} nuevos o cambiados")
+            elif dimensionado is not None and motor_optimizacion == "Voraz" and not agrupar_traslados:
+                # El plan del dimensionado ya es el del voraz con esa flota
+                df_resultado, flota, _, clave_resultado, diagnostico = dimensionado
+                motor_usado = motor_optimizacion
+            else:
+                df_resultado, flota, motor_usado, clave_resultado, diagnostico = calcular_rutas(
+                    df, flota_configurada, motor_optimizacion,
+                    estrategia_inicial, limite_segundos, jornada_max, perfilador, agrupar_traslados
+                )
+            if dimensionado is not None:
+                # La flota dimensionada solo garantiza el plan voraz del dimensionado: se completa con el plan
+                # realmente calculado (otro motor, traslados compartidos, historial) hasta asignarlo todo
+                df_resultado, flota, completado = completar_flota(df_resultado, flota, jornada_max,
+                                                                  diagnostico=diagnostico)
+                if sum(completado['anadidos'].values()):
+                    clave_resultado = huella_resultado(df_resultado)
+                fijar_flota(flota)
+                informe, anadidos = dimensionado[2], completado['anadidos']
+                num_b = sum(v['tipo'] == 'B' for v in flota)
+                st.success(
+                    f"✅ Flota necesaria: {num_b} tipo B + {len(flota) - num_b} tipo A = {len(flota)} total "
+                    f"(cota inferior: {informe['cota']['B']} B + {informe['cota']['A']} A)"
+                )
+                if sum(anadidos.values()):
+                    st.info(f"ℹ️ El dimensionado pedía {informe['necesarios']['B']} B + {informe['necesarios']['A']} A; "
+                            f"con el motor {motor_usado} hacen falta {anadidos['B']} B + {anadidos['A']} A más")
+                if completado['sin_asignar']:
+                    st.warning(f"⚠️ {completado['sin_asignar']} servicios no caben en ninguna jornada de "
+                               f"{jornada_maxima} h, ni con más vehículos")
+            st.session_state['diagnostico'] = Diagnostico().combinar(
+                st.session_state.get('diagnostico_ingesta')
+            ).combinar(diagnostico)
+            st.session_state['df_resultado'] = df_resultado
+            st.session_state['flota'] = flota
+            st.session_state['clave_resultado'] = clave_resultado
+            st.session_state.pop('ultimo_cambio', None)
+            st.session_state.pop('mejora', None)
+            
+            if motor_usado not in (motor_optimizacion, MOTOR_HISTORIAL):
+                st.warning("⚠️ VRPTW sin solución en el tiempo límite: se muestra el resultado voraz")
+            st.success("✅ ¡Optimización completada con éxito!")
 
 # ==========================================
 # DASHBOARD DE RESULTADOS
@@ -383,32 +389,31 @@ if 'df_resultado' in st.session_state:
     col3.metric("❌ Pendientes", pendientes)
     col4.metric("🎯 Eficiencia", f"{eficiencia}%")
     
+    # Búsqueda local sobre el plan actual (recolocar, intercambiar y 2-opt* entre vehículos)
+    col_mejora, col_info = st.columns([1, 3])
+    if col_mejora.button(f"⏱️ Mejorar {MEJORA_SEGUNDOS} s más"):
+        with st.spinner(f"⏱️ Buscando mejoras durante {MEJORA_SEGUNDOS} s..."):
+            df_mejorado, flota_mejorada, mejora = mejorar_plan(df_res, flota, MEJORA_SEGUNDOS,
+                                                               jornada_max=int(jornada_maxima * 60))
+        st.session_state['df_resultado'] = df_mejorado
+        st.session_state['flota'] = flota_mejorada
+        st.session_state['clave_resultado'] = huella_resultado(st.session_state['df_resultado'])
+        # Lo ahorrado se acumula entre tandas hasta el siguiente cálculo
+        acumulado = st.session_state.get('mejora', {'minutos_ahorrados': 0, 'asignados': 0})
+        mejora['minutos_ahorrados'] += acumulado['minutos_ahorrados']
+        mejora['asignados'] += acumulado['asignados']
+        st.session_state['mejora'] = mejora
+        st.rerun()
+    if 'mejora' in st.session_state:
+        mejora = st.session_state['mejora']
+        col_info.success(f"✅ Búsqueda local: {round(mejora['minutos_ahorrados'] / 60, 1)} h de viaje ahorradas y "
+                         f"{mejora['asignados']} pendientes asignados en total · última tanda: "
+                         f"{sum(mejora['movimientos'].values())} movimientos en {mejora['segundos']} s")
+    
     # Resumen por conductor
     st.subheader("👥 Resumen por Conductor")
     
-    resumen_conductores = []
-    for v in flota:
-        if v['servicios_asignados']:
-            hora_entrada = calcular_hora_entrada(v['servicios_asignados'])
-            hora_salida = v['servicios_asignados'][-1]['Fin Servicio']
-            total_horas = round(v['tiempo_trabajado'] / 60, 2)
-            num_servicios = len(v['servicios_asignados'])
-                        
-            # Calcular horas de espera y viaje para jornada
-            total_viaje = sum([s.get('Tiempo Viaje', 0) for s in v['servicios_asignados']]) / 60  # Convertir a horas
-            jornada_horas = 8 - total_viaje  # Jornada = 8h - tiempo_viaje
-            
-            resumen_conductores.append({
-                'Vehículo': v['id'],
-                'Conductor': v.get('conductor', 'N/A'),
-                'Matrícula': v.get('matricula', 'N/A'),
-                'Hora Entrada': hora_entrada,
-                'Hora Salida': hora_salida,
-                'Total Horas': total_horas,
-                'Nº Servicios': num_servicios,
-                                'Jornada (h)': round(jornada_horas, 2),
-                'Estado': '✅ Óptimo' if total_horas <= 8 else '⚠️ Extendida'
-            })
+    resumen_conductores = resumen_por_conductor(flota, jornada_objetivo)
     
     if resumen_conductores:
         df_conductores = pd.DataFrame(resumen_conductores)
@@ -421,79 +426,150 @@ if 'df_resultado' in st.session_state:
     st.subheader("📋 Tabla Detallada")
     st.dataframe(df_res, use_container_width=True)
     
+    # Mapa de rutas
+    st.subheader("🗺️ Mapa de Rutas")
+    if st.toggle("Mostrar mapa", value=True):
+        with st.spinner("🗺️ Dibujando rutas..."):
+            components.html(mapa_resultado(st.session_state['clave_resultado'], df_res, flota), height=600)
+    
     # ==========================================
-    # EXPORTACIÓN A EXCEL
+    # CAMBIOS DEL DÍA (REPLANIFICACIÓN INCREMENTAL)
     # ==========================================
     
-    st.subheader("📥 Exportar Excel Profesional")
-    
-    buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        # Hoja resumen general
-        df_res.to_excel(writer, index=False, sheet_name='Resumen General')
+    with st.expander("🔄 Cambios del Día", expanded='ultimo_cambio' in st.session_state):
+        st.caption("Altas, cancelaciones y cambios de hora sin recalcular el día: solo se reparan las rutas afectadas")
+        hora_actual = st.time_input("🕒 Hora actual (lo ya en marcha no se toca)", value=datetime.now().time().replace(second=0, microsecond=0))
         
-        # Hoja por cada conductor
-        for v in flota:
-            if v['servicios_asignados']:
-                conductor_nombre = v.get('conductor', v['id']).replace('/', '-')[:30]
-                
-                jornada_data = []
-                hora_entrada = calcular_hora_entrada(v['servicios_asignados'])
-                
-                # Entrada
-                jornada_data.append({
-                    'Hora': hora_entrada,
-                    'Actividad': 'ENTRADA',
-                    'Paciente': '-',
-                    'Recogida': '-',
-                    'Destino': '-',
-                    'Tipo': '-',
-                    'Observaciones': f"Conductor: {v.get('conductor', 'N/A')} | Veh: {v['id']}"
-                })
-                
-                # Servicios
-                for i, servicio in enumerate(v['servicios_asignados'], 1):
-                    jornada_data.append({
-                        'Hora': servicio['Hora Cita'],
-                        'Actividad': f'SERVICIO #{i}',
-                        'Paciente': servicio['Paciente'],
-                        'Recogida': servicio['Recogida'],
-                        'Destino': servicio['Destino'],
-                        'Tipo': servicio['Tipo'],
-                        'Observaciones': f"Inicio: {servicio['Inicio Real']} | Fin: {servicio['Fin Servicio']}"
+        etiquetas = {f"{fila['Paciente']} · {fila['Hora Cita']} · {fila['Vehículo']}": (fila['Paciente'], int(fila[COLUMNA_MINUTOS]))
+                     for fila in df_res.to_dict('records')}
+        tab_alta, tab_cancelar, tab_mover = st.tabs(["➕ Alta", "❌ Cancelar", "🕒 Cambiar hora"])
+        cambio = None
+        
+        with tab_alta:
+            with st.form("alta_servicio", clear_on_submit=True):
+                col1, col2 = st.columns(2)
+                paciente_nuevo = col1.text_input("Paciente")
+                hora_nueva = col2.time_input("Hora Cita", value=None)
+                recogida_nueva = col1.text_input("Recogida")
+                destino_nuevo = col2.text_input("Destino", value="Hospital Santa Bárbara")
+                tipo_nuevo = st.selectbox("Tipo", ["Sentado", "Silla", "Camilla"])
+                if st.form_submit_button("➕ Añadir servicio") and paciente_nuevo and hora_nueva and recogida_nueva:
+                    cambio = ('insertar', {
+                        'Paciente': paciente_nuevo, 'Hora Cita': hora_nueva.strftime('%H:%M'),
+                        'Recogida': recogida_nueva, 'Destino': destino_nuevo, 'Tipo': tipo_nuevo
                     })
-                
-                # Salida
-                hora_salida = v['servicios_asignados'][-1]['Fin Servicio']
-                total_horas = round(v['tiempo_trabajado'] / 60, 2)
-                jornada_data.append({
-                    'Hora': hora_salida,
-                    'Actividad': 'SALIDA',
-                    'Paciente': '-',
-                    'Recogida': '-',
-                    'Destino': '-',
-                    'Tipo': '-',
-                    'Observaciones': f'Total: {total_horas}h | Servicios: {len(v["servicios_asignados"])}'
-                })
-                
-                df_jornada = pd.DataFrame(jornada_data)
-                df_jornada.to_excel(writer, index=False, sheet_name=conductor_nombre)
         
-        # Estadísticas
-        if resumen_conductores:
-            df_stats = pd.DataFrame(resumen_conductores)
-            df_stats.to_excel(writer, index=False, sheet_name='Estadísticas')
+        with tab_cancelar:
+            seleccion = st.selectbox("Servicio", list(etiquetas), key='cancelar_servicio')
+            if st.button("❌ Cancelar servicio") and seleccion:
+                cambio = ('cancelar', etiquetas[seleccion])
+        
+        with tab_mover:
+            seleccion = st.selectbox("Servicio", list(etiquetas), key='mover_servicio')
+            nueva_hora = st.time_input("Nueva hora", value=None, key='mover_hora')
+            if st.button("🕒 Cambiar hora") and seleccion and nueva_hora:
+                cambio = ('mover', etiquetas[seleccion] + (nueva_hora.strftime('%H:%M'),))
+        
+        if cambio:
+            plan = PlanIncremental(df_res, flota, ahora=hora_actual.hour * 60 + hora_actual.minute,
+                                   jornada_max=int(jornada_maxima * 60))
+            try:
+                operacion, argumentos = cambio
+                if operacion == 'insertar':
+                    diferencia = plan.insertar(argumentos)
+                else:
+                    diferencia = getattr(plan, operacion)(*argumentos)
+            except (KeyError, ValueError) as e:
+                st.error(f"❌ {e}")
+            else:
+                st.session_state['df_resultado'] = plan.dataframe()
+                st.session_state['flota'] = plan.flota
+                st.session_state['clave_resultado'] = huella_resultado(st.session_state['df_resultado'])
+                st.session_state['ultimo_cambio'] = diferencia
+                st.rerun()
+        
+        if 'ultimo_cambio' in st.session_state:
+            diferencia = st.session_state['ultimo_cambio']
+            filas = [dict(Vehículo=vehiculo, **c) for vehiculo, cambios in diferencia['vehiculos'].items() for c in cambios]
+            if filas:
+                st.success(f"✅ Cambio aplicado en {diferencia['milisegundos']} ms · {len(diferencia['vehiculos'])} vehículos afectados")
+                st.dataframe(pd.DataFrame(filas), use_container_width=True)
+            else:
+                st.warning(f"⚠️ Cambio aplicado en {diferencia['milisegundos']} ms sin vehículo disponible: el servicio queda SIN ASIGNAR")
+    
+    # ==========================================
+    # EXPORTACIÓN A EXCEL
+    # ==========================================
     
-    buffer.seek(0)
+    st.subheader("📥 Exportar Excel Profesional")
     
+    formatos = {'Excel (.xlsx)': 'xlsx', 'CSV (.zip)': 'csv'}
+    if importlib.util.find_spec('pyarrow') is not None:
+        formatos['Parquet (.zip)'] = 'parquet'
+    formato = formatos[st.radio("Formato", list(formatos), horizontal=True)]
+    
+    # El fichero se genera al pulsar la descarga (y queda cacheado por resultado)
+    df_conductores = pd.DataFrame(resumen_conductores)
+    extension, mime = ('xlsx', "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet") if formato == 'xlsx' else ('zip', "application/zip")
     st.download_button(
-        label="📈 DESCARGAR EXCEL OPTIMIZADO",
-        data=buffer.getvalue(),
-        file_name=f"rutas_optimizadas_V3_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        label="📈 DESCARGAR EXCEL OPTIMIZADO" if formato == 'xlsx' else "📦 DESCARGAR PAQUETE DE DATOS",
+        data=functools.partial(
+            exportar_con_diagnostico, st.session_state['diagnostico'],
+            st.session_state['clave_resultado'], jornada_objetivo, formato, df_res, df_conductores
+        ),
+        file_name=f"rutas_optimizadas_V3_{datetime.now().strftime('%Y%m%d_%H%M')}.{extension}",
+        mime=mime,
+        on_click='ignore'
     )
     
-    st.success("✅ Excel con hojas individuales por conductor listo para descargar")
+    st.success("✅ Excel con hojas individuales por conductor listo para descargar" if formato == 'xlsx' else "✅ Paquete de datos listo para descargar")
+    
+    if st.button(f"💾 Guardar plan del {fecha_plan.strftime('%d/%m/%Y')} en el historial"):
+        repetidos = historial_planes().guardar(fecha_plan, df_res)
+        st.success("✅ Plan guardado: los próximos días partirán de estas asignaciones")
+        if repetidos:
+            st.warning(f"⚠️ {len(repetidos)} servicios repetidos (mismo paciente, hora, recogida y destino): "
+                       + ', '.join(f"{paciente or '(sin paciente)'} {hora}" for paciente, hora in repetidos[:10]))
+    
+    # ==========================================
+    # DIAGNÓSTICO
+    # ==========================================
+    
+    with st.expander("🩺 Diagnóstico", expanded=False):
+        diagnostico = st.session_state['diagnostico'].como_dict()
+        
+        st.markdown("**⏱️ Tiempos por etapa**")
+        st.dataframe(pd.DataFrame([
+            {'Etapa': etapa, 'Segundos': datos['segundos'], 'Llamadas': datos['llamadas']}
+            for etapa, datos in diagnostico['etapas'].items()
+        ]), use_container_width=True)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("**🚫 Filas rechazadas**")
+            if diagnostico['rechazados']:
+                st.dataframe(pd.Series(diagnostico['rechazados'], name='Filas'), use_container_width=True)
+            else:
+                st.caption("Ninguna")
+        with col2:
+            st.markdown("**❌ Servicios sin asignar**")
+            if diagnostico['sin_asignar']:
+                st.dataframe(pd.Series(diagnostico['sin_asignar'], name='Servicios'), use_container_width=True)
+            else:
+                st.caption("Ninguno")
+        
+        st.markdown("**🔢 Contadores**")
+        st.json(diagnostico['contadores'])
+        for etapa, perfil in diagnostico['perfiles'].items():
+            st.markdown(f"**🔬 Perfil: {etapa}**")
+            st.code(perfil, language=None)
+        
+        st.download_button(
+            "💾 Descargar diagnóstico (JSON)",
+            data=st.session_state['diagnostico'].como_json(),
+            file_name=f"diagnostico_{datetime.now().strftime('%Y%m%d_%H%M')}.json",
+            mime="application/json"
+        )
 
 # Footer
 st.markdown("""---""")
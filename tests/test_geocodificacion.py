@@ -0,0 +1,35 @@
+"""Geocodificador contra el nomenclátor incluido (sin caché ni red)."""
+
+import pytest
+
+from rutas_ambulancias.config import BASES
+from rutas_ambulancias.geocodificacion import Geocodificador
+
+SORIA = (BASES['Soria']['lat'], BASES['Soria']['lon'])
+LA_PAZ = (40.4815, -3.6865)
+MIGUEL_SERVET = (41.6345, -0.9023)
+
+
+@pytest.fixture
+def geocodificador():
+    return Geocodificador()
+
+
+@pytest.mark.parametrize('direccion', ['Calle La Paz 3, Soria', 'C/ Miguel Servet 5, Soria'])
+def test_calle_con_nombre_de_hospital_es_del_municipio(geocodificador, direccion):
+    assert geocodificador.geocodificar(direccion) == SORIA
+
+
+@pytest.mark.parametrize('direccion, punto', [
+    ('La Paz', LA_PAZ),
+    ('Hospital La Paz', LA_PAZ),
+    ('Miguel Servet', MIGUEL_SERVET),
+    ('H. Miguel Servet, Zaragoza', MIGUEL_SERVET),
+    ('Hospital Universitario Miguel Servet', MIGUEL_SERVET),
+])
+def test_alias_de_hospital_solo_o_tras_hospital(geocodificador, direccion, punto):
+    assert geocodificador.geocodificar(direccion) == punto
+
+
+def test_nombre_mas_largo_gana_en_la_direccion(geocodificador):
+    assert geocodificador.geocodificar('Calle Mayor 1, El Burgo de Osma') == (41.5869, -3.0661)
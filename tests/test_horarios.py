@@ -0,0 +1,37 @@
+"""Normalización de 'Hora Cita' a minutos."""
+
+from datetime import date, datetime, time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rutas_ambulancias.horarios import MOTIVO_HORA_INVALIDA, minutos_desde_medianoche, preparar_servicios
+
+
+@pytest.mark.parametrize('valor, minuto', [
+    ('08:30', 510),
+    ('8.30', 510),
+    ('8h30', 510),
+    ('08:30:00', 510),
+    ('2025-03-01 08:30', 510),
+    ('2025-03-01 00:00', 0),
+    (time(8, 30), 510),
+    (datetime(2025, 3, 1, 8, 30), 510),
+    (0.5, 720),
+])
+def test_horas_reconocidas(valor, minuto):
+    assert minutos_desde_medianoche([valor])[0] == minuto
+
+
+@pytest.mark.parametrize('valor', ['2025-03-01', '01/03/2025', date(2025, 3, 1), '25:00', 'mañana', None])
+def test_fechas_sin_hora_y_textos_se_rechazan(valor):
+    assert np.isnan(minutos_desde_medianoche([valor])[0])
+
+
+def test_fecha_sin_hora_va_a_rechazados():
+    df = pd.DataFrame({'Paciente': ['P1', 'P2'], 'Hora Cita': ['09:00', '2025-03-01']})
+    validos, rechazados = preparar_servicios(df)
+    assert validos['Paciente'].tolist() == ['P1']
+    assert rechazados['Paciente'].tolist() == ['P2']
+    assert rechazados['Motivo'].tolist() == [MOTIVO_HORA_INVALIDA]
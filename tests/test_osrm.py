@@ -0,0 +1,173 @@
+"""ProveedorOSRM contra un servidor /table/v1 de prueba (aiohttp.web en localhost)."""
+
+import asyncio
+import threading
+
+import sys
+
+import numpy as np
+import pytest
+from aiohttp import web
+
+from rutas_ambulancias.distancias import ProveedorHaversine, calcular_distancia_km
+from rutas_ambulancias.osrm import AVISO_SIN_AIOHTTP, ProveedorOSRM
+
+FACTOR_STUB = 1.5  # Metros por carretera = línea recta × FACTOR_STUB; a 60 km/h, un minuto por km
+
+# Pueblos de Soria (lat, lon)
+LATS = [41.7636, 41.4858, 41.5862, 41.8427, 41.4344, 41.6300, 41.9520]
+LONS = [-2.4649, -2.5330, -3.0716, -1.8559, -2.0925, -2.3000, -2.1200]
+
+
+def _esperado(lats_o, lons_o, lats_d, lons_d, tiempo_minimo=5):
+    km = calcular_distancia_km(np.asarray(lats_o)[:, None], np.asarray(lons_o)[:, None],
+                               np.asarray(lats_d)[None, :], np.asarray(lons_d)[None, :]) * FACTOR_STUB
+    return km, np.maximum(np.ceil(km), tiempo_minimo)
+
+
+class ServidorOSRM:
+    """Servidor /table/v1 en un hilo propio; registra el tamaño de cada petición y puede fallar con 500."""
+
+    def __init__(self):
+        self.peticiones = []
+        self.fallar = False
+        self.sin_ruta = set()  # (origen, destino) en coordenadas (lat, lon) que responden null
+        self._bucle = asyncio.new_event_loop()
+        self._hilo = threading.Thread(target=self._bucle.run_forever, daemon=True)
+
+    async def _tabla(self, peticion):
+        coordenadas = [tuple(map(float, c.split(','))) for c in peticion.match_info['coordenadas'].split(';')]
+        origenes = [coordenadas[int(i)] for i in peticion.query['sources'].split(';')]
+        destinos = [coordenadas[int(i)] for i in peticion.query['destinations'].split(';')]
+        self.peticiones.append((len(origenes), len(destinos)))
+        if self.fallar:
+            return web.Response(status=500)
+        metros, segundos = [], []
+        for lon_o, lat_o in origenes:
+            fila_m, fila_s = [], []
+            for lon_d, lat_d in destinos:
+                km = float(calcular_distancia_km(lat_o, lon_o, lat_d, lon_d)) * FACTOR_STUB
+                sin_ruta = ((round(lat_o, 4), round(lon_o, 4)), (round(lat_d, 4), round(lon_d, 4))) in self.sin_ruta
+                fila_m.append(None if sin_ruta else km * 1000)
+                fila_s.append(None if sin_ruta else km * 60)
+            metros.append(fila_m)
+            segundos.append(fila_s)
+        return web.json_response({'code': 'Ok', 'durations': segundos, 'distances': metros})
+
+    async def _arrancar(self):
+        aplicacion = web.Application()
+        aplicacion.router.add_get('/table/v1/driving/{coordenadas}', self._tabla)
+        self._runner = web.AppRunner(aplicacion)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '127.0.0.1', 0).start()
+        return self._runner.addresses[0][1]
+
+    def __enter__(self):
+        self._hilo.start()
+        puerto = asyncio.run_coroutine_threadsafe(self._arrancar(), self._bucle).result()
+        self.url = f"http://127.0.0.1:{puerto}"
+        return self
+
+    def __exit__(self, *_):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._bucle).result()
+        self._bucle.call_soon_threadsafe(self._bucle.stop)
+        self._hilo.join()
+        self._bucle.close()
+
+
+@pytest.fixture
+def servidor():
+    with ServidorOSRM() as servidor:
+        yield servidor
+
+
+def test_trocea_la_matriz_en_bloques(servidor):
+    proveedor = ProveedorOSRM(servidor.url, tamano_lote=3)
+    km, minutos = proveedor.matriz(LATS, LONS)
+
+    # 7 puntos en bloques de 3: 3 × 3 peticiones, ninguna mayor que el lote
+    assert proveedor.peticiones == len(servidor.peticiones) == 9
+    assert max(max(p) for p in servidor.peticiones) == 3
+    km_esperado, minutos_esperados = _esperado(LATS, LONS, LATS, LONS)
+    np.testing.assert_allclose(km, km_esperado, rtol=1e-5, atol=1e-4)
+    np.testing.assert_array_equal(minutos, minutos_esperados)
+    assert km.dtype == minutos.dtype == np.float32
+    assert proveedor.errores == []
+
+
+def test_reutiliza_los_bloques_en_cache(servidor):
+    proveedor = ProveedorOSRM(servidor.url, tamano_lote=3)
+    km, minutos = proveedor.matriz(LATS, LONS)
+
+    # Los mismos puntos en otro orden caen en los mismos bloques
+    orden = np.random.default_rng(0).permutation(len(LATS))
+    km_2, minutos_2 = proveedor.matriz(np.array(LATS)[orden], np.array(LONS)[orden])
+
+    assert proveedor.peticiones == len(servidor.peticiones) == 9
+    np.testing.assert_array_equal(km_2, km[np.ix_(orden, orden)])
+    np.testing.assert_array_equal(minutos_2, minutos[np.ix_(orden, orden)])
+
+
+def test_cache_lru_descarta_los_bloques_mas_antiguos(servidor):
+    proveedor = ProveedorOSRM(servidor.url, tamano_lote=3, max_bloques_cache=4)
+    proveedor.matriz(LATS, LONS)
+    assert len(proveedor._cache) == 4
+
+    proveedor.matriz(LATS, LONS)
+    assert proveedor.peticiones > 9
+
+
+def test_error_del_servidor_recurre_a_haversine(servidor):
+    servidor.fallar = True
+    proveedor = ProveedorOSRM(servidor.url, tamano_lote=3)
+    km, minutos = proveedor.matriz(LATS, LONS)
+
+    km_respaldo, minutos_respaldo = ProveedorHaversine().matriz(LATS, LONS)
+    np.testing.assert_allclose(km, km_respaldo, rtol=1e-5, atol=1e-4)
+    np.testing.assert_allclose(minutos, minutos_respaldo)
+    assert len(proveedor.errores) == 9
+    assert all('500' in error for error in proveedor.errores)
+
+    # Los bloques fallidos no se guardan: al recuperarse el servidor se vuelven a pedir
+    servidor.fallar = False
+    km, _ = proveedor.matriz(LATS, LONS)
+    assert proveedor.peticiones == 18
+    np.testing.assert_allclose(km, _esperado(LATS, LONS, LATS, LONS)[0], rtol=1e-5, atol=1e-4)
+
+
+def test_celdas_sin_ruta_recurren_a_haversine(servidor):
+    origen, destino = (LATS[0], LONS[0]), (LATS[1], LONS[1])
+    servidor.sin_ruta.add((origen, destino))
+    proveedor = ProveedorOSRM(servidor.url)
+    km, minutos = proveedor.tabla([origen[0]], [origen[1]], [destino[0], LATS[2]], [destino[1], LONS[2]])
+
+    km_respaldo, minutos_respaldo = ProveedorHaversine().tabla([origen[0]], [origen[1]], [destino[0]], [destino[1]])
+    assert km[0, 0] == pytest.approx(km_respaldo[0, 0], rel=1e-5)
+    assert minutos[0, 0] == minutos_respaldo[0, 0]
+    km_esperado, _ = _esperado([origen[0]], [origen[1]], [LATS[2]], [LONS[2]])
+    assert km[0, 1] == pytest.approx(km_esperado[0, 0], rel=1e-5)
+    assert proveedor.errores == []
+
+
+def test_funciona_con_un_bucle_de_eventos_en_marcha(servidor):
+    proveedor = ProveedorOSRM(servidor.url, tamano_lote=3)
+
+    async def desde_un_bucle():
+        return proveedor.matriz(LATS, LONS)
+
+    km, minutos = asyncio.run(desde_un_bucle())
+    np.testing.assert_array_equal(minutos, _esperado(LATS, LONS, LATS, LONS)[1])
+    assert proveedor.peticiones == 9
+
+
+def test_sin_aiohttp_recurre_a_haversine_con_aviso(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'aiohttp', None)  # `import aiohttp` lanza ImportError
+    proveedor = ProveedorOSRM('http://127.0.0.1:9', tamano_lote=3)
+    with pytest.warns(RuntimeWarning, match='aiohttp'):
+        km, minutos = proveedor.matriz(LATS, LONS)
+
+    km_respaldo, minutos_respaldo = ProveedorHaversine().matriz(LATS, LONS)
+    np.testing.assert_allclose(km, km_respaldo, rtol=1e-5, atol=1e-4)
+    np.testing.assert_allclose(minutos, minutos_respaldo)
+    assert proveedor.errores == [AVISO_SIN_AIOHTTP]
+    assert proveedor.peticiones == 0